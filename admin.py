@@ -1,6 +1,11 @@
 from sqladmin import ModelView
 
 from db.models import UserModel, FileModel
+from db.session import async_session
+from services.events import FILES_CHANNEL, broker
+from services.files import FILES_TAG, file_message
+from services.result_cache import result_cache
+from services.users import bump_version, get, invalidate_principal
 
 
 class AuthModelView(ModelView):
@@ -20,11 +25,40 @@ class AuthModelView(ModelView):
 
 class UserAdmin(AuthModelView, model=UserModel):
     column_list = [UserModel.id, UserModel.email, UserModel.is_active]
+    form_excluded_columns = [UserModel.version]
+
+    async def update_model(self, pk, data) -> None:
+        await super().update_model(pk, data)
+        async with async_session() as session:
+            user = await get(session, user_id=pk)
+            await invalidate_principal(pk, await bump_version(session, user))
+
+    async def delete_model(self, obj) -> None:
+        await super().delete_model(obj)
+        await invalidate_principal(obj.id)
 
 
 class FileAdmin(AuthModelView, model=FileModel):
     column_list = [FileModel.file_name, FileModel.is_deleted]
 
+    async def insert_model(self, data: dict) -> None:
+        await super().insert_model(data)
+        await result_cache.invalidate(FILES_TAG)
+
+    async def update_model(self, pk, data) -> None:
+        await super().update_model(pk, data)
+        await result_cache.invalidate(FILES_TAG)
+        if data.get('is_deleted'):
+            file = await self.get_model_by_pk(pk)
+            await broker.publish(FILES_CHANNEL, {'event': 'deleted',
+                                                 'file': file_message(file)})
+
+    async def delete_model(self, obj) -> None:
+        await super().delete_model(obj)
+        await result_cache.invalidate(FILES_TAG)
+        await broker.publish(FILES_CHANNEL, {'event': 'deleted',
+                                             'file': file_message(obj)})
+
 
 def init_admin_page(admin_app):
     admin_app.register_model(UserAdmin)
@@ -1,12 +1,26 @@
+import logging
+import time
+
 from sqladmin.authentication import AuthenticationBackend
-from sqlalchemy.ext.asyncio import AsyncSession
 from starlette.requests import Request
-from db.models import UserModel
 
-from db.session import engine
-from services.users import login_admin, get_current_user
+from db.session import async_session, use_primary
+from exceptions import GQLError
+from services.revocation import revoke
+from services.users import get, is_current_version, login_admin
 from schemas.types import LoginInput
 from settings import get_settings
+from utils import decode_payload
+
+logger = logging.getLogger(__name__)
+
+
+def is_claim_valid(claim: dict) -> bool:
+    ''' Signed session cookie: expiry, rights and version are checked '''
+
+    return (claim.get('expires_at', 0) > time.time()
+            and claim.get('is_active') and claim.get('is_superuser')
+            and is_current_version(claim['id'], claim.get('version')))
 
 
 class AuthBackend(AuthenticationBackend):
@@ -15,18 +29,33 @@ class AuthBackend(AuthenticationBackend):
         username, password = form["username"], form["password"]
         data = LoginInput(email=username, password=password)
         try:
-            async with AsyncSession(engine) as session:
-                result = await login_admin(data, session)
+            async with async_session() as session:
+                result = await login_admin(
+                    data, session,
+                    request.client.host if request.client else None,
+                )
                 request.session.update(
                     {"token": f"{get_settings().jwt_header} {result}"}
                 )
+                request.session.pop("user", None)
                 return True
-        except Exception as e:
-            print(e)
+        except GQLError as e:
+            logger.info('Admin login failed',
+                        extra={'explain': e.extensions['explain']})
+        except Exception:
+            logger.exception('Admin login failed')
         return False
 
     async def logout(self, request: Request) -> bool:
-        # Usually you'd want to just clear the session
+        token = request.session.get("token")
+        if token:
+            try:
+                async with async_session() as session:
+                    await revoke(session, decode_payload(token.split()[-1]))
+            except GQLError:
+                pass
+            except Exception:
+                logger.exception('Admin token revocation failed')
         request.session.clear()
         return True
 
@@ -34,16 +63,31 @@ class AuthBackend(AuthenticationBackend):
         token = request.session.get("token")
         if not token:
             return False
+        claim = request.session.get("user")
+        if claim and is_claim_valid(claim):
+            return True
         try:
-            async with AsyncSession(engine) as session:
-                result = await get_current_user(token.split()[-1], session)
-            if isinstance(result, UserModel):
+            payload = decode_payload(token.split()[-1])
+            async with async_session() as session:
+                # Cached principals of other workers may be stale,
+                # rights are read from the primary
+                use_primary(session)
+                result = await get(session, user_id=payload['user_id'])
+            if result and result.is_active and result.is_superuser:
                 request.session.update({"user": {
                     'id': result.id,
                     'is_active': result.is_active,
                     'is_superuser': result.is_superuser,
+                    'version': result.version,
+                    'expires_at': time.time() + get_settings().admin_session_ttl,
                 }})
                 return True
-        except Exception as e:
-            print(e)
+            logger.info('Admin session user is not an active admin',
+                        extra={'user_id': payload['user_id']})
+        except GQLError as e:
+            logger.info('Admin session is not valid',
+                        extra={'explain': e.extensions['explain']})
+        except Exception:
+            logger.exception('Admin session validation failed')
+        request.session.pop("user", None)
         return False
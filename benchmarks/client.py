@@ -0,0 +1,83 @@
+'''
+Minimal in-process ASGI client: requests go straight to the app without
+sockets, so numbers show the app's own cost.
+'''
+import json
+import uuid
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlencode
+
+
+async def request(app, method: str, path: str, body: bytes = b'',
+                  headers: Optional[Dict[str, str]] = None,
+                  query: Optional[dict] = None) -> Tuple[int, bytes]:
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': method,
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': urlencode(query or {}).encode(),
+        'root_path': '',
+        'headers': [(key.lower().encode(), value.encode())
+                    for key, value in (headers or {}).items()],
+        'client': ('127.0.0.1', 50000),
+        'server': ('benchmark', 80),
+    }
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    status, chunks = 0, []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+        elif message['type'] == 'http.response.body':
+            chunks.append(message.get('body', b''))
+
+    await app(scope, receive, send)
+    return status, b''.join(chunks)
+
+
+async def graphql(app, query: str, variables: Optional[dict] = None,
+                  token: Optional[str] = None) -> Tuple[int, dict]:
+    headers = {'content-type': 'application/json'}
+    if token:
+        headers['authorization'] = f'Bearer {token}'
+    body = json.dumps({'query': query, 'variables': variables or {}}).encode()
+    status, content = await request(app, 'POST', '/graphql', body, headers)
+    return status, json.loads(content or b'{}')
+
+
+async def graphql_upload(app, query: str, file_name: str, content: bytes,
+                         token: str) -> Tuple[int, dict]:
+    ''' GraphQL multipart request spec with single `file` variable '''
+
+    boundary = uuid.uuid4().hex
+    operations = json.dumps({'query': query, 'variables': {'file': None}})
+    parts = [
+        ('operations', None, operations.encode()),
+        ('map', None, json.dumps({'0': ['variables.file']}).encode()),
+        ('0', file_name, content),
+    ]
+    body = b''
+    for name, filename, value in parts:
+        disposition = f'form-data; name="{name}"'
+        if filename:
+            disposition += f'; filename="{filename}"'
+        body += (f'--{boundary}\r\nContent-Disposition: {disposition}\r\n'
+                 f'Content-Type: application/octet-stream\r\n\r\n').encode()
+        body += value + b'\r\n'
+    body += f'--{boundary}--\r\n'.encode()
+    headers = {
+        'content-type': f'multipart/form-data; boundary={boundary}',
+        'authorization': f'Bearer {token}',
+    }
+    status, content = await request(app, 'POST', '/graphql', body, headers)
+    return status, json.loads(content or b'{}')
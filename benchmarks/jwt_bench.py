@@ -0,0 +1,101 @@
+'''
+Microbenchmark of token encode/decode: python-jose (previous implementation)
+against prepared `tokens.TokenEngine`.
+
+    python -m benchmarks.jwt_bench --number 20000
+'''
+import argparse
+import json
+import sys
+import time
+import timeit
+from datetime import datetime, timedelta
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519
+from jose import jwt as jose_jwt
+
+from tokens import TokenEngine
+
+SECRET = 'bPVisLCKKyDIkIBVpWIukimDvyxGxVnHoszVijcZwcOLOMAaDeApkyHZuRVWlTHh'
+CLAIMS = {'token_type': 'access', 'user_id': 42}
+
+
+def pem(private_key) -> bytes:
+    return private_key.private_bytes(serialization.Encoding.PEM,
+                                     serialization.PrivateFormat.PKCS8,
+                                     serialization.NoEncryption())
+
+
+def ops_per_second(func, number: int) -> float:
+    seconds = min(timeit.repeat(func, number=number, repeat=3))
+    return round(number / seconds, 1)
+
+
+def public_pem(private_key) -> bytes:
+    return private_key.public_key().public_bytes(
+        serialization.Encoding.PEM,
+        serialization.PublicFormat.SubjectPublicKeyInfo,
+    )
+
+
+def bench_jose(algorithm: str, key, verifying_key, number: int) -> dict:
+    # Mirrors the previous utils.create_access_token/decode_token
+    def encode():
+        claims = {**CLAIMS, 'exp': datetime.utcnow() + timedelta(hours=1)}
+        return jose_jwt.encode(claims, key, algorithm=algorithm)
+
+    token = encode()
+    return {
+        'encode_ops': ops_per_second(encode, number),
+        'decode_ops': ops_per_second(
+            lambda: jose_jwt.decode(token, verifying_key,
+                                    algorithms=[algorithm]),
+            number,
+        ),
+    }
+
+
+def bench_engine(engine: TokenEngine, number: int) -> dict:
+    def encode():
+        return engine.encode({**CLAIMS, 'exp': int(time.time()) + 3600})
+
+    token = encode()
+    return {
+        'encode_ops': ops_per_second(encode, number),
+        'decode_ops': ops_per_second(lambda: engine.decode(token), number),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--number', type=int, default=10000)
+    parser.add_argument('--output', help='JSON results path')
+    args = parser.parse_args()
+
+    ed_key = ed25519.Ed25519PrivateKey.generate()
+    ec_key = ec.generate_private_key(ec.SECP256R1())
+    results = {
+        'jose HS256': bench_jose('HS256', SECRET, SECRET, args.number),
+        'engine HS256': bench_engine(
+            TokenEngine('HS256', SECRET, SECRET), args.number),
+        'jose ES256': bench_jose('ES256', pem(ec_key).decode(),
+                                 public_pem(ec_key).decode(),
+                                 args.number // 10),
+        'engine ES256': bench_engine(
+            TokenEngine('ES256', ec_key, ec_key.public_key(), 'es-1'),
+            args.number // 10),
+        'engine EdDSA': bench_engine(
+            TokenEngine('EdDSA', ed_key, ed_key.public_key(), 'ed-1'),
+            args.number // 10),
+    }
+    for name, result in results.items():
+        print(f'{name:>13}: encode {result["encode_ops"]:>10} ops/s, '
+              f'decode {result["decode_ops"]:>10} ops/s', file=sys.stderr)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
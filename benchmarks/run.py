@@ -0,0 +1,276 @@
+'''
+Load test of auth and GraphQL hot paths against in-process app.
+
+    python -m benchmarks.run --users 1000 --files 5000 --requests 500 -c 20
+
+Uses DB_URL (dedicated database!) or a temporary SQLite file, and
+S3_ENDPOINT_URL or in-process moto server. Results are written as JSON,
+see README.
+'''
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List
+
+from benchmarks import client
+
+OPERATIONS = ('token', 'login', 'me', 'filesList', 'fileUpload')
+PASSWORD = 'benchmark-password'
+EMAIL_DOMAIN = 'bench.local'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--files', type=int, default=1000)
+    parser.add_argument('--requests', type=int, default=200,
+                        help='measured requests per operation')
+    parser.add_argument('--warmup', type=int, default=20,
+                        help='not measured requests per operation')
+    parser.add_argument('-c', '--concurrency', type=int, default=10)
+    parser.add_argument('--operations', default=','.join(OPERATIONS))
+    parser.add_argument('--upload-size', type=int, default=64 * 1024)
+    parser.add_argument('--output', help='JSON results path, '
+                        'default is benchmarks/results/<commit>.json')
+    parser.add_argument('--seed', type=int, default=42)
+    return parser.parse_args()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def configure_environment():
+    ''' Must run before app import: settings are read on import '''
+
+    if not os.environ.get('DB_URL'):
+        path = Path(tempfile.mkdtemp()) / 'benchmark.db'
+        os.environ['DB_URL'] = f'sqlite+aiosqlite:///{path}'
+    s3_server = None
+    if not os.environ.get('S3_ENDPOINT_URL'):
+        from moto.server import ThreadedMotoServer
+
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        port = free_port()
+        s3_server = ThreadedMotoServer(port=port, verbose=False)
+        s3_server.start()
+        os.environ.update({
+            'S3_ENDPOINT_URL': f'http://127.0.0.1:{port}',
+            'S3_BUCKET': 'benchmark',
+            'S3_KEY': 'testing',
+            'S3_SECRET': 'testing',
+            'S3_REGION': 'us-east-1',
+        })
+        os.environ.setdefault('S3_REGION', 'us-east-1')
+    # All requests come from one client, login throttling would reject them
+    os.environ.setdefault('LOGIN_IP_PER_MINUTE', '0')
+    os.environ.setdefault('LOGIN_ACCOUNT_PER_MINUTE', '0')
+    return s3_server
+
+
+async def seed(users: int, files: int):
+    from sqlalchemy import delete
+
+    from db.models import Base, FileModel, UserModel
+    from db.session import engine
+    from utils import get_password_hash
+
+    now = datetime.utcnow()
+    hashed_password = get_password_hash(PASSWORD)
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+        await connection.execute(
+            delete(UserModel).where(UserModel.email.like(f'%@{EMAIL_DOMAIN}'))
+        )
+        await connection.execute(
+            delete(FileModel).where(FileModel.file_name.like('bench-%'))
+        )
+        for start in range(0, users, 1000):
+            await connection.execute(UserModel.__table__.insert(), [
+                {'email': f'user{i}@{EMAIL_DOMAIN}',
+                 'hashed_password': hashed_password, 'is_active': True,
+                 'is_superuser': False, 'created_at': now, 'updated_at': now}
+                for i in range(start, min(start + 1000, users))
+            ])
+        for start in range(0, files, 1000):
+            await connection.execute(FileModel.__table__.insert(), [
+                {'file_name': f'bench-{i}.jpg', 'file_url': f'media/bench-{i}.jpg',
+                 'is_deleted': i % 10 == 0, 'created_at': now, 'updated_at': now}
+                for i in range(start, min(start + 1000, files))
+            ])
+
+
+def percentile(values: List[float], percent: float) -> float:
+    ''' Nearest-rank percentile of sorted values '''
+
+    if not values:
+        return 0.0
+    rank = max(int(round(percent / 100 * len(values) + 0.5)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+async def measure(operation: Callable[[int], Awaitable[bool]], requests: int,
+                  warmup: int, concurrency: int) -> Dict:
+    for i in range(warmup):
+        await operation(i)
+
+    latencies, errors = [], 0
+    counter = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            started_at = time.perf_counter()
+            ok = await operation(i)
+            latencies.append(time.perf_counter() - started_at)
+            errors += not ok
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started_at
+    latencies.sort()
+    return {
+        'requests': requests,
+        'errors': errors,
+        'rps': round(requests / elapsed, 2) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'max_ms': round(latencies[-1] * 1000, 3) if latencies else 0.0,
+    }
+
+
+def build_operations(app, args, rng: random.Random, token: str):
+    def email() -> str:
+        return f'user{rng.randrange(args.users)}@{EMAIL_DOMAIN}'
+
+    async def token_endpoint(i: int) -> bool:
+        body = f'username={email()}&password={PASSWORD}'.encode()
+        status, _ = await client.request(
+            app, 'POST', '/token', body,
+            {'content-type': 'application/x-www-form-urlencoded'},
+        )
+        return status == 200
+
+    async def login(i: int) -> bool:
+        status, data = await client.graphql(
+            app,
+            'mutation($data: LoginInput!) { login(data: $data) { accessToken } }',
+            {'data': {'email': email(), 'password': PASSWORD}},
+        )
+        return status == 200 and not data.get('errors')
+
+    async def me(i: int) -> bool:
+        status, data = await client.graphql(app, '{ me { id email } }',
+                                            token=token)
+        return status == 200 and not data.get('errors')
+
+    async def files_list(i: int) -> bool:
+        status, data = await client.graphql(
+            app,
+            '{ filesList(first: 20) { edges { node { id fileName fileUrl } } '
+            'pageInfo { hasNextPage endCursor } } }',
+            token=token,
+        )
+        return status == 200 and not data.get('errors')
+
+    content = os.urandom(args.upload_size)
+
+    async def file_upload(i: int) -> bool:
+        status, data = await client.graphql_upload(
+            app, 'mutation($file: Upload!) { fileUpload(file: $file) { id } }',
+            f'bench-upload-{i}.bin', content, token,
+        )
+        return status == 200 and not data.get('errors')
+
+    return {
+        'token': token_endpoint,
+        'login': login,
+        'me': me,
+        'filesList': files_list,
+        'fileUpload': file_upload,
+    }
+
+
+def current_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+async def run(args) -> Dict:
+    from main import app
+    from services.storage import get_s3_client
+    from settings import get_settings
+
+    await seed(args.users, args.files)
+    if 'fileUpload' in args.operations:
+        bucket = get_settings().s3_bucket
+        if bucket not in [b['Name'] for b in get_s3_client().list_buckets()['Buckets']]:
+            get_s3_client().create_bucket(Bucket=bucket)
+
+    await app.router.startup()
+    try:
+        status, data = await client.graphql(
+            app,
+            'mutation($data: LoginInput!) { login(data: $data) { accessToken } }',
+            {'data': {'email': f'user0@{EMAIL_DOMAIN}', 'password': PASSWORD}},
+        )
+        token = data['data']['login']['accessToken']
+        operations = build_operations(app, args, random.Random(args.seed), token)
+        results = {}
+        for name in args.operations.split(','):
+            results[name] = await measure(operations[name], args.requests,
+                                          args.warmup, args.concurrency)
+            print(f'{name:>12}: {json.dumps(results[name])}', file=sys.stderr)
+    finally:
+        await app.router.shutdown()
+
+    return {
+        'commit': current_commit(),
+        'created_at': datetime.utcnow().isoformat(),
+        'python': sys.version.split()[0],
+        'database': os.environ['DB_URL'].split(':', 1)[0],
+        'config': {
+            'users': args.users,
+            'files': args.files,
+            'requests': args.requests,
+            'warmup': args.warmup,
+            'concurrency': args.concurrency,
+            'upload_size': args.upload_size,
+        },
+        'results': results,
+    }
+
+
+def main():
+    args = parse_args()
+    s3_server = configure_environment()
+    try:
+        report = asyncio.run(run(args))
+    finally:
+        if s3_server:
+            s3_server.stop()
+    output = Path(args.output or
+                  Path(__file__).parent / 'results' / f'{report["commit"]}.json')
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f'Results: {output}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,7 +5,7 @@ from getpass import getpass
 from db.models import UserModel
 from db.session import async_session
 from services.users import get
-from utils import get_password_hash
+from utils import hash_password
 
 email = input('Email: ')
 
@@ -17,7 +17,7 @@ async def async_main():
         else:
             user = UserModel(email=email)
             password = getpass()
-            user.hashed_password = get_password_hash(password)
+            user.hashed_password = await hash_password(password)
             user.is_superuser = True
             session.add(user)
             sys.stdout.write('User was successfully created')
@@ -1,5 +1,6 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, Boolean, TIMESTAMP, MetaData
+from sqlalchemy import (Column, Integer, String, Boolean, TIMESTAMP, MetaData,
+                        Index, ForeignKey, JSON)
 from sqlalchemy.ext.declarative import declarative_base
 from typing import Any
 
@@ -41,11 +42,33 @@ class UserModel(BaseModel):
     is_superuser: bool = Column(Boolean, default=False, nullable=True)
     first_name: str = Column(String(100), nullable=True)
     last_name: str = Column(String(100), nullable=True)
+    # Bumped on every change, admin sessions of older version are revalidated
+    version: int = Column(Integer, nullable=False, default=0,
+                          server_default='0')
 
 
 class FileModel(BaseModel):
     __tablename__ = "file"
 
     file_name: str = Column(String(length=100), nullable=True)
-    file_url: str = Column(String(length=1024), nullable=True)
+    # Unique: concurrent confirmations of one upload store it once
+    file_url: str = Column(String(length=1024), nullable=True, unique=True)
     is_deleted: bool = Column(Boolean, default=False, nullable=True)
+    # Photo variants by name: url, content_type, width, height
+    variants: dict = Column(JSON, nullable=True)
+
+    __table_args__ = (
+        # Keyset pagination and count over not deleted files
+        Index('ix_file_id_not_deleted', 'id',
+              postgresql_where=is_deleted.isnot(True)),
+    )
+
+
+class RevokedTokenModel(BaseModel):
+    __tablename__ = "revoked_token"
+
+    jti: str = Column(String(length=32), unique=True, nullable=False)
+    user_id: int = Column(Integer, ForeignKey('user.id', ondelete='CASCADE'),
+                          nullable=False, index=True)
+    expires_at: datetime = Column(TIMESTAMP(timezone=False), nullable=False,
+                                  index=True)
@@ -1,16 +1,143 @@
+import asyncio
+import time
 from typing import AsyncGenerator
 
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql import Select
+from starlette.requests import HTTPConnection
 
-from settings import get_settings
+from settings import Settings, get_settings
 
 DB_URL = get_settings().db_url
+DB_REPLICA_URL = get_settings().db_replica_url
+PRIMARY_COOKIE = 'db_primary_until'
 
-engine = create_async_engine(DB_URL)
-async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
+def engine_options(url: str, settings: Settings) -> dict:
+    ''' Pool and connection lifecycle params for `create_async_engine` '''
 
-async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
+    url = make_url(url)
+    options = {
+        'pool_pre_ping': settings.db_pool_pre_ping,
+        'pool_recycle': settings.db_pool_recycle,
+    }
+    if url.get_backend_name() == 'sqlite':
+        return options
+    options.update({
+        'pool_size': settings.db_pool_size,
+        'max_overflow': settings.db_max_overflow,
+        'pool_timeout': settings.db_pool_timeout,
+    })
+    if url.get_driver_name() == 'asyncpg':
+        server_settings = {'application_name': settings.db_application_name}
+        if settings.db_statement_timeout:
+            server_settings['statement_timeout'] = str(settings.db_statement_timeout)
+        options['connect_args'] = {
+            'prepared_statement_cache_size': settings.db_statement_cache_size,
+            'server_settings': server_settings,
+        }
+    return options
+
+
+engine = create_async_engine(DB_URL, **engine_options(DB_URL, get_settings()))
+if DB_REPLICA_URL:
+    replica_engine = create_async_engine(
+        DB_REPLICA_URL, **engine_options(DB_REPLICA_URL, get_settings())
+    )
+else:
+    replica_engine = engine
+
+
+def use_current_credentials(engine: AsyncEngine, url_setting: str) -> None:
+    '''
+    New connections take user and password from current settings, so
+    rotated secrets apply without restart. Open connections stay as is.
+    '''
+
+    @event.listens_for(engine.sync_engine, 'do_connect')
+    def set_credentials(dialect, connection_record, cargs, cparams):
+        url = make_url(getattr(get_settings(), url_setting))
+        if url.password is not None:
+            cparams['user'] = url.username
+            cparams['password'] = url.password
+
+
+use_current_credentials(engine, 'db_url')
+if replica_engine is not engine:
+    use_current_credentials(replica_engine, 'db_replica_url')
+
+
+class RoutingSession(Session):
+    '''
+    Sends plain SELECTs to the replica, everything else to the primary.
+    After the first flush or `use_primary()` session sticks to the primary.
+    '''
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self._flushing:
+            self.info['primary'] = True
+        if (self.info.get('primary') or not isinstance(clause, Select)
+                or clause._for_update_arg is not None):
+            return engine.sync_engine
+        return replica_engine.sync_engine
+
+
+def use_primary(session: AsyncSession) -> None:
+    session.info['primary'] = True
+
+
+async_session = sessionmaker(engine, class_=AsyncSession,
+                             sync_session_class=RoutingSession,
+                             expire_on_commit=False)
+
+
+async def warm_up_pool(engine: AsyncEngine, connections: int) -> None:
+    ''' Opening connections before the first request, they stay in pool '''
+
+    if connections <= 0:
+        return
+    if isinstance(engine.pool, QueuePool):
+        connections = min(connections, engine.pool.size())
+    opened = await asyncio.gather(*(engine.connect() for _ in range(connections)))
+    for connection in opened:
+        await connection.close()
+
+
+def pool_stats(engine: AsyncEngine) -> dict:
+    pool = engine.pool
+    if not isinstance(pool, QueuePool):
+        return {'status': pool.status()}
+    return {
+        'size': pool.size(),
+        'checked_in': pool.checkedin(),
+        'checked_out': pool.checkedout(),
+        'overflow': pool.overflow(),
+        'max_overflow': pool._max_overflow,
+    }
+
+
+async def get_async_session(
+    connection: HTTPConnection,
+) -> AsyncGenerator[AsyncSession, None]:
     async with async_session() as session:
+        # Read-your-writes: client wrote recently, replica can lag behind
+        primary_until = connection.cookies.get(PRIMARY_COOKIE)
+        try:
+            if primary_until and float(primary_until) > time.time():
+                use_primary(session)
+        except ValueError:
+            pass
         yield session
+
+
+def stick_to_primary(response) -> None:
+    ''' Pinning client's next requests to the primary for a while '''
+
+    if DB_REPLICA_URL and response is not None:
+        seconds = get_settings().db_replica_sticky_seconds
+        response.set_cookie(PRIMARY_COOKIE, str(time.time() + seconds),
+                            max_age=seconds, httponly=True)
@@ -14,6 +14,9 @@ class ExceptionEnum(Enum):
     TOKEN_EXPIRED = 'TOKEN_EXPIRED'
     UNPROCESSABLE_ENTITY = 'UNPROCESSABLE_ENTITY'
     RESOURCE_NOT_FOUND = 'RESOURCE_NOT_FOUND'
+    PERSISTED_QUERY_NOT_FOUND = 'PERSISTED_QUERY_NOT_FOUND'
+    QUERY_TOO_COMPLEX = 'QUERY_TOO_COMPLEX'
+    TOO_MANY_REQUESTS = 'TOO_MANY_REQUESTS'
 
 
 class GQLError(GraphQLError):
@@ -41,3 +44,19 @@ class AuthenticationError(GQLError):
 class FoundError(GQLError):
     message: str = 'Data couldn\'t be found'
     code: str = ExceptionEnum.RESOURCE_NOT_FOUND.value
+
+
+class PersistedQueryNotFound(GQLError):
+    # Apollo clients resend the full query after this exact message
+    message: str = 'PersistedQueryNotFound'
+    code: str = ExceptionEnum.PERSISTED_QUERY_NOT_FOUND.value
+
+
+class QueryComplexityError(GQLError):
+    message: str = 'Query is too complex'
+    code: str = ExceptionEnum.QUERY_TOO_COMPLEX.value
+
+
+class ThrottledError(GQLError):
+    message: str = 'Too many requests'
+    code: str = ExceptionEnum.TOO_MANY_REQUESTS.value
@@ -0,0 +1,80 @@
+'''
+Importing users from CSV or JSONL file:
+
+    python importusers.py users.csv
+    python importusers.py users.jsonl --batch-size 1000 --workers 8
+
+Rows need `email` and `password`, `first_name` and `last_name` are optional.
+Existing emails are skipped.
+'''
+import argparse
+import asyncio
+import csv
+import json
+import os
+import sys
+import time
+from typing import IO, Iterator
+
+from db.session import async_session
+from schemas.types import BulkCreateResult, UserInput
+from services.users import bulk_create
+from utils import WorkerPool
+
+
+def read_users(file: IO, file_format: str) -> Iterator[UserInput]:
+    if file_format == 'csv':
+        rows = csv.DictReader(file)
+    else:
+        rows = (json.loads(line) for line in file if line.strip())
+    for row in rows:
+        yield UserInput(email=row['email'], password=row.get('password'),
+                        first_name=row.get('first_name') or None,
+                        last_name=row.get('last_name') or None)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Importing users')
+    parser.add_argument('path', help='CSV or JSONL file, "-" for stdin')
+    parser.add_argument('--format', choices=['csv', 'jsonl'],
+                        help='by default it is taken from file extension')
+    parser.add_argument('--batch-size', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='processes for password hashing')
+    return parser.parse_args()
+
+
+async def async_main(args: argparse.Namespace) -> BulkCreateResult:
+    file_format = args.format or ('csv' if args.path.endswith('.csv')
+                                  else 'jsonl')
+    pool = WorkerPool(name='password', kind='process', workers=args.workers,
+                      concurrency=args.workers * 2)
+    started = time.perf_counter()
+
+    def progress(result: BulkCreateResult) -> None:
+        elapsed = time.perf_counter() - started
+        sys.stderr.write(
+            f'\r{result.total} processed, {result.created} created, '
+            f'{len(result.skipped)} skipped, '
+            f'{result.total / elapsed:.0f} users/s'
+        )
+
+    file = sys.stdin if args.path == '-' else open(args.path, newline='')
+    try:
+        async with async_session() as session:
+            result = await bulk_create(read_users(file, file_format), session,
+                                       pool=pool, batch_size=args.batch_size,
+                                       concurrency=pool.concurrency,
+                                       progress=progress)
+    finally:
+        if file is not sys.stdin:
+            file.close()
+        pool.executor.shutdown()
+    sys.stderr.write(f'\nDone in {time.perf_counter() - started:.1f}s\n')
+    return result
+
+
+if __name__ == '__main__':
+    result = asyncio.run(async_main(parse_args()))
+    for email in result.skipped:
+        sys.stdout.write(f'Skipped: {email}\n')
@@ -1,61 +1,175 @@
+import asyncio
+import json
+from functools import lru_cache, partial
+
 from fastapi import FastAPI, Depends, Request, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, Response
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
 from pathlib import Path
 from starlette.middleware.sessions import SessionMiddleware
 import strawberry
-from strawberry.fastapi import GraphQLRouter
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqladmin import Admin
 
-from admin import init_admin_page
-from auth_backend import AuthBackend
-from db.session import engine, get_async_session
+from db.session import (engine, get_async_session, pool_stats,
+                        replica_engine, warm_up_pool)
+from exceptions import GQLError, ThrottledError
 from schemas.mutations import Mutation
+from schemas.documents import (cache_policy_cache, cost_cache, document_cache,
+                               persisted_queries)
+from schemas.extensions import (DocumentCache, HttpCaching, PrimaryRouting,
+                                QueryCost, RequestTracing)
 from schemas.queries import Query
-from settings import get_settings
-from services.users import login, get_current_user
+from schemas.subscriptions import Subscription
+from schemas.router import PersistedQueryRouter
+from settings import get_settings, reload_settings
+from services.compression import CompressionMiddleware
+from services.events import broker, start_events_bridge, stop_events_bridge
+from services.loaders import Loaders
+from services.logger import RequestIdMiddleware, logging_stats, setup_logging
+from services.metrics import render_metrics
+from services.result_cache import result_cache
+from services.revocation import (purge_expired, refresh_revoked_tokens,
+                                 revoked_tokens)
+from services.secrets import get_secrets_provider
+from services.startup import log_startup, startup_phase
+from services.static import CachedStaticFiles, static_version
+from services.storage import get_s3_client
+from services.throttle import login_throttle
+from services.tracing import instrument_engine
+from services.users import (login, get_current_user, principal_cache,
+                            watch_user_changes)
+from tokens import get_token_engine, rotate_token_engine
+from utils import password_pool
 from schemas.types import LoginInput
 
 
 # App's config
 
+setup_logging()
+
 async def get_context(
     session: AsyncSession = Depends(get_async_session),
 ):
     return {
         'session': session,
+        'loaders': Loaders(session),
     }
 
-schema = strawberry.Schema(Query, Mutation)
-graphql_app = GraphQLRouter(schema, context_getter=get_context)
+instrument_engine(engine)
+if replica_engine is not engine:
+    instrument_engine(replica_engine)
+
+schema = strawberry.Schema(Query, Mutation, Subscription,
+                           extensions=[RequestTracing, DocumentCache,
+                                       QueryCost, PrimaryRouting,
+                                       HttpCaching])
+graphql_app = PersistedQueryRouter(schema, context_getter=get_context)
 
 app = FastAPI()
 
-app.mount(
-    '/static',
-    StaticFiles(directory=Path(__file__).parent.absolute() / 'templates'),
-    name='static',
-)
+STATIC_DIR = Path(__file__).parent.absolute() / 'templates'
+app.mount('/static', CachedStaticFiles(directory=STATIC_DIR), name='static')
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl='token')
 
-auth_backend = AuthBackend(secret_key=get_settings().secret_key)
-admin_app = Admin(app, engine, authentication_backend=auth_backend)
-init_admin_page(admin_app)
-
 app.include_router(graphql_app, prefix='/graphql')
 
 app.add_middleware(CORSMiddleware, allow_headers=["*"],
                    allow_origins=["*"], allow_methods=["*"])
 app.add_middleware(SessionMiddleware, secret_key=get_settings().secret_key)
+app.add_middleware(RequestIdMiddleware)
+app.add_middleware(CompressionMiddleware,
+                   minimum_size=get_settings().compression_minimum_size,
+                   gzip_level=get_settings().gzip_level,
+                   brotli_quality=get_settings().brotli_quality)
 
-# FastAPI endpoints
 
-templates = Jinja2Templates(directory='templates')
+def mount_admin() -> None:
+    ''' sqladmin and WTForms are heavy to import, it's done on startup '''
+
+    if getattr(app.state, 'admin', None) is not None:
+        return
+    from sqladmin import Admin
+
+    from admin import init_admin_page
+    from auth_backend import AuthBackend
+
+    auth_backend = AuthBackend(secret_key=get_settings().secret_key)
+    admin_app = Admin(app, engine, authentication_backend=auth_backend)
+    init_admin_page(admin_app)
+    admin_app.templates.env.globals['static_version'] = partial(
+        static_version, str(STATIC_DIR)
+    )
+    app.state.admin = admin_app
+
+
+@lru_cache
+def get_templates():
+    from fastapi.templating import Jinja2Templates
+
+    templates = Jinja2Templates(directory='templates')
+    templates.env.globals['static_version'] = partial(static_version,
+                                                      str(STATIC_DIR))
+    return templates
+
 
+def preload() -> None:
+    ''' Lazy parts initialized at once, e.g. before forking workers '''
+
+    mount_admin()
+    get_templates()
+
+
+@app.on_event('startup')
+async def start_background_tasks():
+    with startup_phase('admin'):
+        mount_admin()
+    with startup_phase('db_warmup'):
+        connections = get_settings().db_warmup_connections
+        await warm_up_pool(engine, connections)
+        if replica_engine is not engine:
+            await warm_up_pool(replica_engine, connections)
+    with startup_phase('background_tasks'):
+        app.state.revocation_task = asyncio.create_task(
+            refresh_revoked_tokens()
+        )
+        app.state.purge_task = asyncio.create_task(purge_expired())
+        start_events_bridge()
+        app.state.users_task = asyncio.create_task(watch_user_changes())
+        app.state.cache_task = asyncio.create_task(
+            result_cache.watch_invalidations()
+        )
+        secrets_provider = get_secrets_provider()
+        if secrets_provider is not None:
+            app.state.secrets_task = asyncio.create_task(
+                secrets_provider.reload_periodically(
+                    get_settings().secrets_reload_interval, on_secrets_change
+                )
+            )
+    log_startup()
+
+
+def on_secrets_change() -> None:
+    ''' Dropping objects built from old secrets, DB takes them on connect '''
+
+    reload_settings()
+    rotate_token_engine()
+    get_s3_client.cache_clear()
+    info_body.cache_clear()
+
+
+@app.on_event('shutdown')
+async def stop_background_tasks():
+    app.state.revocation_task.cancel()
+    app.state.purge_task.cancel()
+    app.state.users_task.cancel()
+    app.state.cache_task.cancel()
+    if getattr(app.state, 'secrets_task', None) is not None:
+        app.state.secrets_task.cancel()
+    await stop_events_bridge()
+
+# FastAPI endpoints
 
 async def get_current_user_rest(
     token: str = Depends(oauth2_scheme),
@@ -68,29 +182,88 @@ async def get_current_user_rest(
     )
     try:
         user = await get_current_user(token, session)
-    except PermissionError:
+    except (PermissionError, GQLError):
         raise credentials_exception
     return user
 
 
+async def get_superuser_rest(user=Depends(get_current_user_rest)):
+    if not (user.is_active and user.is_superuser):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail='User is not admin')
+    return user
+
+
 @app.get('/')
 async def root(request: Request):
-    return templates.TemplateResponse('main.html', {'request': request})
+    return get_templates().TemplateResponse('main.html',
+                                            {'request': request})
+
+
+@lru_cache
+def info_body() -> bytes:
+    settings = get_settings()
+    return json.dumps({
+        'app_name': settings.app_name,
+        'admin_email': settings.admin_email
+    }).encode()
 
 
 @app.get('/info')
 async def info():
     ''' Getting app info '''
 
-    settings = get_settings()
-    return {
-        'app_name': settings.app_name,
-        'admin_email': settings.admin_email
+    max_age = get_settings().info_max_age
+    return Response(info_body(), media_type='application/json',
+                    headers={'Cache-Control': f'public, max-age={max_age}'})
+
+
+@app.get('/stats', dependencies=[Depends(get_superuser_rest)])
+async def stats():
+    ''' Getting in-process caches and pools statistics, admins only '''
+
+    # Pillow is heavy to import, `import main` doesn't need it
+    from services.images import image_pool
+
+    data = {
+        'principal_cache': principal_cache.stats(),
+        'password_pool': password_pool.stats(),
+        'image_pool': image_pool.stats(),
+        'db_pool': pool_stats(engine),
+        'graphql_document_cache': document_cache.stats(),
+        'graphql_persisted_queries': persisted_queries.stats(),
+        'graphql_cost_cache': cost_cache.stats(),
+        'graphql_cache_policy_cache': cache_policy_cache.stats(),
+        'revoked_tokens': revoked_tokens.stats(),
+        'result_cache': result_cache.stats(),
+        'events': broker.stats(),
+        'logging': logging_stats(),
+        'login_throttle': login_throttle.stats(),
     }
+    if get_secrets_provider() is not None:
+        data['secrets'] = get_secrets_provider().stats()
+    if replica_engine is not engine:
+        data['db_replica_pool'] = pool_stats(replica_engine)
+    return data
+
+
+@app.get('/metrics', response_class=PlainTextResponse)
+async def metrics():
+    ''' Getting Prometheus histograms '''
+
+    return render_metrics()
+
+
+@app.get('/.well-known/jwks.json')
+async def jwks():
+    ''' Getting public keys for local tokens verification '''
+
+    return get_token_engine().jwks()
 
 
 @app.post('/token')
 async def login_for_access_token(
+    request: Request,
     form_data: OAuth2PasswordRequestForm = Depends(),
     session: AsyncSession = Depends(get_async_session),
 ):
@@ -98,7 +271,15 @@ async def login_for_access_token(
 
     cred = LoginInput(email=form_data.username, password=form_data.password)
     try:
-        data = await login(cred, session)
+        data = await login(cred, session, client_ip=(
+            request.client.host if request.client else None
+        ))
+    except ThrottledError as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail='Too many login attempts',
+            headers={'Retry-After': str(e.extensions['explain']['retry_after'])},
+        )
     except Exception:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
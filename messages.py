@@ -3,8 +3,20 @@ USER_EXISTS = {'email': 'User already exists'}
 USER_NOT_EXISTS = {'non_field': 'User doesn\'t exist'}
 USER_NOT_ACTIVE = {'non_field': 'User is not active'}
 USER_NOT_ADMIN = {'non_field': 'User is not admin'}
+TOO_MANY_USERS = {'data': 'Too many users in one request'}
 INVALID_TOKEN = {'non_field': 'Invalid JWT'}
 WRONG_TOKEN = {'non_field': 'Wrong JWT type'}
+REVOKED_TOKEN = {'non_field': 'Revoked JWT'}
 WRONG_TOKEN_HEADER = {'non_field': 'Wrong JWT header'}
 INCORRECT_PASSWORD = {'password': 'Incorrect password'}
+LOGIN_THROTTLED = {'non_field': 'Too many login attempts, try again later'}
 AUTH_NEEDED = {'non_field': 'You need to be logged'}
+INVALID_UPLOAD_SIZE = {'size': 'File size is out of range'}
+UPLOAD_NOT_FOUND = {'upload_token': 'Uploaded file couldn\'t be found'}
+UPLOAD_SIZE_MISMATCH = {'upload_token': 'Uploaded file size doesn\'t match'}
+UPLOAD_PARTS_NEEDED = {'parts': 'Parts are needed for multipart upload'}
+UPLOAD_PARTS_INVALID = {'parts': 'Parts don\'t match the uploaded ones'}
+INVALID_CURSOR = {'after': 'Invalid cursor'}
+INVALID_PAGE_SIZE = {'first': 'Page size is out of range'}
+PERSISTED_QUERY_MISMATCH = {'non_field': 'Provided sha256Hash does not match query'}
+PERSISTED_QUERY_VERSION = {'non_field': 'Unsupported persisted query version'}
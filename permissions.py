@@ -6,7 +6,8 @@ from strawberry.permission import BasePermission
 from strawberry.types import Info
 
 from exceptions import GQLError
-from messages import AUTH_NEEDED, WRONG_TOKEN_HEADER
+from messages import AUTH_NEEDED, USER_NOT_ADMIN, WRONG_TOKEN_HEADER
+from services.tracing import span
 from services.users import get_current_user
 from settings import get_settings
 
@@ -19,7 +20,21 @@ class IsAuthenticated(BasePermission):
             authorization = request.headers['Authorization'].split()
             if authorization[0] != get_settings().jwt_header:
                 raise GQLError(WRONG_TOKEN_HEADER)
-            info.context['user'] = await get_current_user(authorization[1],
-                                                          info.context['session'])
+            info.context['token'] = authorization[1]
+            with span('IsAuthenticated'):
+                info.context['user'] = await get_current_user(
+                    authorization[1],
+                    info.context['session'],
+                    info.context.get('loaders'),
+                )
             return True
         raise GQLError(AUTH_NEEDED)
+
+
+class IsSuperuser(IsAuthenticated):
+
+    async def has_permission(self, source: typing.Any, info: Info, **kwargs) -> bool:
+        await super().has_permission(source, info, **kwargs)
+        if not info.context['user'].is_superuser:
+            raise GQLError(USER_NOT_ADMIN)
+        return True
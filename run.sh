@@ -1,11 +1,15 @@
 #!/bin/env bash
 
-# Retrieve secrets from AWS & export to environment
-python3 retrieve-secrets.py .aws-secrets.env 2>&1
-export $(grep -v '^#' .aws-secrets.env | xargs) 2>&1
+# Settings read secrets from AWS themselves, cached in ~/.cache/boilerplate-back
+export SECRETS_BACKEND=${SECRETS_BACKEND:-aws}
 
 # Migrate
 alembic upgrade head
 
-# Run server
-uvicorn main:app --host 0.0.0.0 --port 8000 --reload
+# Run server: `run.sh production` starts forked workers, otherwise
+# a single process reloading on code changes
+if [ "$1" = "production" ]; then
+    exec python3 serve.py --host 0.0.0.0 --port 8000
+else
+    uvicorn main:app --host 0.0.0.0 --port 8000 --reload
+fi
@@ -0,0 +1,110 @@
+from dataclasses import dataclass
+from typing import Dict, FrozenSet
+
+from graphql import (GraphQLSchema, get_named_type, is_object_type,
+                     is_interface_type)
+from graphql.language import (DocumentNode, FieldNode, FragmentDefinitionNode,
+                              FragmentSpreadNode, InlineFragmentNode,
+                              OperationDefinitionNode, SelectionSetNode)
+
+from schemas.directives import CacheControl, CacheScope, get_directive
+
+
+@dataclass(frozen=True)
+class CachePolicy:
+    max_age: int
+    private: bool = False
+
+    def restrict(self, other: 'CachePolicy') -> 'CachePolicy':
+        return CachePolicy(min(self.max_age, other.max_age),
+                           self.private or other.private)
+
+    @property
+    def header(self) -> str:
+        if self.max_age <= 0:
+            return 'no-store'
+        scope = 'private' if self.private else 'public'
+        return f'{scope}, max-age={self.max_age}'
+
+
+# Nothing selected restricts caching yet
+UNRESTRICTED = CachePolicy(max_age=2 ** 31)
+
+
+def selection_policy(schema: GraphQLSchema, parent_type,
+                     selection_set: SelectionSetNode,
+                     fragments: Dict[str, FragmentDefinitionNode],
+                     parent_max_age: int,
+                     visited: FrozenSet[str]) -> CachePolicy:
+    ''' The strictest policy of the fields in the selection set '''
+
+    policy = UNRESTRICTED
+    for selection in selection_set.selections:
+        if isinstance(selection, FieldNode):
+            name = selection.name.value
+            fields = getattr(parent_type, 'fields', None) or {}
+            field = fields.get(name)
+            if name.startswith('__') or field is None:
+                continue
+            directive = get_directive(field, CacheControl)
+            definition = (field.extensions or {}).get('strawberry-definition')
+            max_age = parent_max_age
+            if directive and directive.max_age is not None:
+                max_age = directive.max_age
+            # Results of authenticated fields are never shared
+            private = bool(getattr(definition, 'permission_classes', None))
+            if directive is not None and directive.scope == CacheScope.PRIVATE:
+                private = True
+            policy = policy.restrict(CachePolicy(max_age, private))
+            if selection.selection_set:
+                policy = policy.restrict(selection_policy(
+                    schema, get_named_type(field.type), selection.selection_set,
+                    fragments, max_age, visited,
+                ))
+            continue
+
+        if isinstance(selection, FragmentSpreadNode):
+            name = selection.name.value
+            fragment = fragments.get(name)
+            if fragment is None or name in visited:
+                continue
+            visited = visited | {name}
+        elif isinstance(selection, InlineFragmentNode):
+            fragment = selection
+        else:
+            continue
+        fragment_type = parent_type
+        if fragment.type_condition:
+            condition = schema.get_type(fragment.type_condition.name.value)
+            if is_object_type(condition) or is_interface_type(condition):
+                fragment_type = condition
+        policy = policy.restrict(selection_policy(
+            schema, fragment_type, fragment.selection_set, fragments,
+            parent_max_age, visited,
+        ))
+    return policy
+
+
+def document_cache_policy(schema: GraphQLSchema,
+                          document: DocumentNode) -> CachePolicy:
+    ''' Cache policy of all operations in document, root fields default to 0 '''
+
+    fragments = {
+        definition.name.value: definition
+        for definition in document.definitions
+        if isinstance(definition, FragmentDefinitionNode)
+    }
+    policy = UNRESTRICTED
+    for definition in document.definitions:
+        if not isinstance(definition, OperationDefinitionNode):
+            continue
+        root_type = schema.get_root_type(definition.operation)
+        if root_type is None:
+            continue
+        policy = policy.restrict(selection_policy(
+            schema, root_type, definition.selection_set, fragments,
+            0, frozenset(),
+        ))
+    if policy == UNRESTRICTED:
+        return CachePolicy(max_age=0)
+    return policy
@@ -0,0 +1,115 @@
+from typing import Dict, FrozenSet, Optional, Tuple
+
+from graphql import (GraphQLSchema, get_named_type, is_leaf_type,
+                     is_object_type, is_interface_type)
+from graphql.language import (DocumentNode, FieldNode, FragmentDefinitionNode,
+                              FragmentSpreadNode, InlineFragmentNode,
+                              IntValueNode, OperationDefinitionNode,
+                              SelectionSetNode)
+
+from schemas.directives import Cost, get_directive
+from settings import get_settings
+
+
+def get_multiplier(node: FieldNode, argument: Optional[str]) -> int:
+    ''' Page size of list field: literal value or the worst case '''
+
+    if not argument:
+        return 1
+    for arg in node.arguments:
+        if arg.name.value == argument:
+            if isinstance(arg.value, IntValueNode):
+                return max(int(arg.value.value), 1)
+            # Variables are unknown for the static cost
+            return get_settings().page_size_max
+    return get_settings().page_size_default
+
+
+def selection_cost(schema: GraphQLSchema, parent_type,
+                   selection_set: SelectionSetNode,
+                   fragments: Dict[str, FragmentDefinitionNode],
+                   depth: int, visited: FrozenSet[str]
+                   ) -> Tuple[int, int, int]:
+    '''
+    Returns cost, cost of fields counted once per page (`Cost.once`, not
+    multiplied by the parent's page size) and depth of the selection set
+    '''
+
+    cost, once_cost, max_depth = 0, 0, depth
+    for selection in selection_set.selections:
+        if isinstance(selection, FieldNode):
+            name = selection.name.value
+            fields = getattr(parent_type, 'fields', None) or {}
+            field = fields.get(name)
+            if name.startswith('__') or field is None:
+                continue
+            field_type = get_named_type(field.type)
+            directive = get_directive(field, Cost)
+            if directive:
+                weight = directive.weight
+                multiplier = get_multiplier(selection, directive.multiplier)
+            else:
+                weight = 0 if is_leaf_type(field_type) else 1
+                multiplier = 1
+            children_cost, children_once, children_depth = 0, 0, depth + 1
+            if selection.selection_set:
+                children_cost, children_once, children_depth = selection_cost(
+                    schema, field_type, selection.selection_set, fragments,
+                    depth + 1, visited,
+                )
+            field_cost = weight + multiplier * children_cost + children_once
+            if directive and directive.once:
+                once_cost += field_cost
+            else:
+                cost += field_cost
+            max_depth = max(max_depth, children_depth)
+            continue
+
+        if isinstance(selection, FragmentSpreadNode):
+            name = selection.name.value
+            fragment = fragments.get(name)
+            if fragment is None or name in visited:
+                continue
+            visited = visited | {name}
+        elif isinstance(selection, InlineFragmentNode):
+            fragment = selection
+        else:
+            continue
+        fragment_type = parent_type
+        if fragment.type_condition:
+            condition = schema.get_type(fragment.type_condition.name.value)
+            if is_object_type(condition) or is_interface_type(condition):
+                fragment_type = condition
+        fragment_cost, fragment_once, fragment_depth = selection_cost(
+            schema, fragment_type, fragment.selection_set, fragments,
+            depth, visited,
+        )
+        cost += fragment_cost
+        once_cost += fragment_once
+        max_depth = max(max_depth, fragment_depth)
+    return cost, once_cost, max_depth
+
+
+def document_cost(schema: GraphQLSchema,
+                  document: DocumentNode) -> Tuple[int, int]:
+    ''' Static cost and depth of the most expensive operation in document '''
+
+    fragments = {
+        definition.name.value: definition
+        for definition in document.definitions
+        if isinstance(definition, FragmentDefinitionNode)
+    }
+    cost, depth = 0, 0
+    for definition in document.definitions:
+        if not isinstance(definition, OperationDefinitionNode):
+            continue
+        root_type = schema.get_root_type(definition.operation)
+        if root_type is None:
+            continue
+        operation_cost, once_cost, operation_depth = selection_cost(
+            schema, root_type, definition.selection_set, fragments,
+            0, frozenset(),
+        )
+        operation_cost += once_cost
+        cost, depth = max(cost, operation_cost), max(depth, operation_depth)
+    return cost, depth
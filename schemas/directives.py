@@ -0,0 +1,44 @@
+from enum import Enum
+from typing import Optional
+
+import strawberry
+from strawberry.schema_directive import Location
+
+
+@strawberry.schema_directive(
+    locations=[Location.FIELD_DEFINITION],
+    description='Static cost of the field; children cost is multiplied '
+                'by the page size argument, if set, except children '
+                'counted once per page',
+)
+class Cost:
+    weight: int = 1
+    multiplier: Optional[str] = None
+    once: bool = False
+
+
+@strawberry.enum
+class CacheScope(Enum):
+    PUBLIC = 'PUBLIC'
+    PRIVATE = 'PRIVATE'
+
+
+@strawberry.schema_directive(
+    locations=[Location.FIELD_DEFINITION],
+    description='HTTP caching of GET queries selecting the field; '
+                'without max age root fields aren\'t cached, '
+                'nested fields inherit it from the parent',
+)
+class CacheControl:
+    max_age: Optional[int] = None
+    scope: Optional[CacheScope] = None
+
+
+def get_directive(field, directive_class):
+    ''' Getting schema directive of graphql-core field defined by strawberry '''
+
+    definition = (field.extensions or {}).get('strawberry-definition')
+    for directive in getattr(definition, 'directives', None) or ():
+        if isinstance(directive, directive_class):
+            return directive
+    return None
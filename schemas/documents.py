@@ -0,0 +1,31 @@
+import hashlib
+from dataclasses import dataclass
+from typing import Optional
+
+from graphql.language import DocumentNode
+
+from services.cache import LRUCache
+from settings import get_settings
+
+
+@dataclass
+class CachedDocument:
+    document: DocumentNode
+
+
+# Parsed and validated documents by query hash
+document_cache = LRUCache(maxsize=get_settings().graphql_document_cache_size)
+# Static cost and depth by query hash
+cost_cache = LRUCache(maxsize=get_settings().graphql_document_cache_size)
+# HTTP cache policy of GET queries by query hash
+cache_policy_cache = LRUCache(maxsize=get_settings().graphql_document_cache_size)
+# Automatic persisted queries: query text by its sha256 hash
+persisted_queries = LRUCache(maxsize=get_settings().graphql_persisted_queries_size)
+
+
+def query_hash(query: str) -> str:
+    return hashlib.sha256(query.encode()).hexdigest()
+
+
+def get_cached_document(query: str) -> Optional[CachedDocument]:
+    return document_cache.get(query_hash(query))
@@ -0,0 +1,158 @@
+import time
+from inspect import isawaitable
+from typing import Optional
+
+from graphql import GraphQLResolveInfo
+from strawberry.extensions import Extension
+from strawberry.types.graphql import OperationType
+
+from db.session import stick_to_primary, use_primary
+from exceptions import QueryComplexityError
+from schemas.cache_control import document_cache_policy
+from schemas.cost import document_cost
+from schemas.documents import (CachedDocument, cache_policy_cache, cost_cache,
+                               document_cache, get_cached_document,
+                               query_hash)
+from services.tracing import (RequestTrace, current_trace, field_duration,
+                              operation_label, request_duration,
+                              request_sql_count)
+from settings import get_settings
+
+
+class PrimaryRouting(Extension):
+    ''' Mutations run on the primary, queries are left to the replica '''
+
+    def on_executing_start(self):
+        if self.execution_context.operation_type == OperationType.MUTATION:
+            context = self.execution_context.context
+            use_primary(context['session'])
+            stick_to_primary(context.get('response'))
+
+
+class DocumentCache(Extension):
+    ''' Skips parsing and validation of documents which were validated before '''
+
+    cached: Optional[CachedDocument] = None
+
+    def on_parsing_start(self):
+        self.cached = get_cached_document(self.execution_context.query)
+        if self.cached:
+            self.execution_context.graphql_document = self.cached.document
+
+    def on_validation_start(self):
+        if self.cached:
+            self.execution_context.errors = []
+
+    def on_validation_end(self):
+        execution_context = self.execution_context
+        if not self.cached and not execution_context.errors:
+            document_cache.set(query_hash(execution_context.query),
+                               CachedDocument(execution_context.graphql_document))
+
+
+class QueryCost(Extension):
+    ''' Rejects documents over cost or depth budget before execution '''
+
+    def on_validation_start(self):
+        execution_context = self.execution_context
+        key = query_hash(execution_context.query)
+        cost_and_depth = cost_cache.get(key)
+        if cost_and_depth is None:
+            cost_and_depth = document_cost(execution_context.schema._schema,
+                                           execution_context.graphql_document)
+            cost_cache.set(key, cost_and_depth)
+        cost, depth = cost_and_depth
+        settings = get_settings()
+        if cost > settings.graphql_max_cost or depth > settings.graphql_max_depth:
+            execution_context.errors = [QueryComplexityError({
+                'cost': cost, 'max_cost': settings.graphql_max_cost,
+                'depth': depth, 'max_depth': settings.graphql_max_depth,
+            })]
+
+
+class RequestTracing(Extension):
+    '''
+    Per-field resolve time and SQL statements count of the request.
+    Exported as histograms, returned in response `extensions` when
+    debug header is sent and tracing header is enabled in settings.
+    '''
+
+    def on_request_start(self):
+        self.trace = RequestTrace()
+        self.token = current_trace.set(self.trace)
+
+    def on_request_end(self):
+        current_trace.reset(self.token)
+        duration = time.perf_counter() - self.trace.started_at
+        try:
+            operation = self.execution_context.operation_name
+        except RuntimeError:
+            operation = None
+        request_duration.observe(duration, operation=operation_label(operation))
+        request_sql_count.observe(self.trace.sql_count)
+
+    def resolve(self, _next, root, info: GraphQLResolveInfo, *args, **kwargs):
+        field = None
+        if not info.field_name.startswith('__'):
+            # Meta fields (`__typename`, `__schema`) aren't in `fields`
+            field = info.parent_type.fields.get(info.field_name)
+        definition = field.extensions.get('strawberry-definition') \
+            if field is not None else None
+        if definition is None or definition.base_resolver is None:
+            # Plain attributes aren't worth timing
+            return _next(root, info, *args, **kwargs)
+        field = f'{info.parent_type.name}.{info.field_name}'
+        started_at = time.perf_counter()
+        result = _next(root, info, *args, **kwargs)
+        if isawaitable(result):
+            return self._timed(result, field, started_at, info)
+        self._record(field, started_at, info)
+        return result
+
+    async def _timed(self, result, field, started_at, info):
+        try:
+            return await result
+        finally:
+            self._record(field, started_at, info)
+
+    def _record(self, field, started_at, info):
+        duration = time.perf_counter() - started_at
+        field_duration.observe(duration, field=field)
+        self.trace.fields.append({
+            'path': '.'.join(str(key) for key in info.path.as_list()),
+            'field': field,
+            'duration': duration,
+        })
+
+    def get_results(self):
+        header = get_settings().graphql_trace_header
+        context = self.execution_context.context or {}
+        request = context.get('request')
+        if header and request is not None and request.headers.get(header):
+            return {'tracing': self.trace.as_dict()}
+        return {}
+
+
+class HttpCaching(Extension):
+    ''' Cache-Control of GET queries from `@cacheControl` of selected fields '''
+
+    def on_request_end(self):
+        execution_context = self.execution_context
+        context = execution_context.context or {}
+        request, response = context.get('request'), context.get('response')
+        if getattr(request, 'method', None) != 'GET' or response is None:
+            return
+        try:
+            operation_type = execution_context.operation_type
+        except RuntimeError:
+            return
+        if operation_type != OperationType.QUERY or execution_context.errors:
+            response.headers['Cache-Control'] = 'no-store'
+            return
+        key = query_hash(execution_context.query)
+        policy = cache_policy_cache.get(key)
+        if policy is None:
+            policy = document_cache_policy(execution_context.schema._schema,
+                                           execution_context.graphql_document)
+            cache_policy_cache.set(key, policy)
+        response.headers['Cache-Control'] = policy.header
@@ -1,27 +1,50 @@
+from typing import List, Optional
+
 import strawberry
 from strawberry.types import Info
 from strawberry.file_uploads import Upload
 
-from permissions import IsAuthenticated
-from schemas.types import (FileType, LoginSuccess, LoginInput, UserType,
-                           RefreshTokenInput, MessageType, UserInput)
-from services.users import (create, delete_user, update, login,
-                            refresh_token)
-from services.files import upload
+from exceptions import ValidationError
+from messages import TOO_MANY_USERS
+from permissions import IsAuthenticated, IsSuperuser
+from schemas.directives import Cost
+from schemas.types import (BulkCreateResult, ConfirmUploadInput, FileType,
+                           LoginSuccess, LoginInput, UserType,
+                           RefreshTokenInput, MessageType, UploadTicket,
+                           UploadUrlInput, UserInput)
+from services.users import (bulk_create, create, delete_user, update, login,
+                            logout, refresh_token)
+from settings import get_settings
+from services.files import confirm_upload, request_upload, upload
 
 
 @strawberry.type
 class Mutation:
     @strawberry.mutation(
-        description='User creation and sending OTP to email'
+        description='User creation and sending OTP to email',
+        directives=[Cost(weight=10)],
     )
     async def signup(self, info: Info, data: LoginInput) -> MessageType:
         return await create(data, info.context['session'])
 
-    @strawberry.mutation(description='Login')
+    @strawberry.mutation(
+        description='Users creation by admin, existing emails are skipped',
+        permission_classes=[IsSuperuser],
+        directives=[Cost(weight=100)],
+    )
+    async def bulk_create_users(self, info: Info,
+                                data: List[UserInput]) -> BulkCreateResult:
+        if len(data) > get_settings().bulk_create_max_users:
+            raise ValidationError(TOO_MANY_USERS)
+        return await bulk_create(data, info.context['session'])
+
+    @strawberry.mutation(description='Login', directives=[Cost(weight=10)])
     async def login(self, info: Info,
                     data: LoginInput) -> LoginSuccess:
-        return await login(data, info.context['session'])
+        request = info.context['request']
+        return await login(data, info.context['session'],
+                           info.context['loaders'],
+                           request.client.host if request.client else None)
 
     @strawberry.mutation(
         description='User updating',
@@ -40,11 +63,44 @@ class Mutation:
     @strawberry.mutation(description='Refresh tokens')
     async def token_refresh(self, info: Info,
                             data: RefreshTokenInput) -> LoginSuccess:
-        return await refresh_token(data, info.context['session'])
+        return await refresh_token(data, info.context['session'],
+                                   info.context['loaders'])
+
+    @strawberry.mutation(
+        description='Revoking current access token and refresh token',
+        permission_classes=[IsAuthenticated],
+    )
+    async def logout(self, info: Info,
+                     data: Optional[RefreshTokenInput] = None) -> MessageType:
+        return await logout(info.context['token'], info.context['session'],
+                            info.context['user'],
+                            data.refresh_token if data else None)
 
     @strawberry.mutation(
         description='Uploading photo and pixelation',
         permission_classes=[IsAuthenticated],
+        directives=[Cost(weight=20)],
+    )
+    async def file_upload(self, info: Info, file: Upload,
+                          upload_id: Optional[str] = None) -> FileType:
+        return await upload(file, info.context['session'], upload_id,
+                            info.context['user'])
+
+    @strawberry.mutation(
+        description='Presigned URLs for uploading file straight to S3',
+        permission_classes=[IsAuthenticated],
+        directives=[Cost(weight=10)],
+    )
+    async def request_upload_url(self, info: Info,
+                                 data: UploadUrlInput) -> UploadTicket:
+        return await request_upload(data, info.context['user'])
+
+    @strawberry.mutation(
+        description='Storing file uploaded with `requestUploadUrl`',
+        permission_classes=[IsAuthenticated],
+        directives=[Cost(weight=10)],
     )
-    async def file_upload(self, info: Info, file: Upload) -> FileType:
-        return await upload(file, info.context['session'])
+    async def confirm_upload(self, info: Info,
+                             data: ConfirmUploadInput) -> FileType:
+        return await confirm_upload(data, info.context['session'],
+                                    info.context['user'])
@@ -1,30 +1,50 @@
+from typing import Optional
+
 import strawberry
 from strawberry.types import Info
 
 from permissions import IsAuthenticated
+from schemas.directives import CacheControl, CacheScope, Cost
 from services.users import get_users
 from services.files import get_files
-from schemas.types import UserType, FileType
+from schemas.types import AppInfoType, Connection, UserType, FileType
+from settings import get_settings
 
 
 @strawberry.type
 class Query:
 
+    @strawberry.field(
+        description='Getting app info',
+        directives=[CacheControl(max_age=300, scope=CacheScope.PUBLIC)],
+    )
+    def info(self) -> AppInfoType:
+        settings = get_settings()
+        return AppInfoType(app_name=settings.app_name,
+                           admin_email=settings.admin_email)
+
     @strawberry.field(
         description='Getting list of users',
         permission_classes=[IsAuthenticated],
+        directives=[Cost(weight=5, multiplier='first')],
     )
+    async def users_list(self, info: Info, first: Optional[int] = None,
+                         after: Optional[str] = None) -> Connection[UserType]:
+        return await get_users(info.context['session'], first, after)
 
     @strawberry.field(
         description='Getting authenticated user',
         permission_classes=[IsAuthenticated],
+        directives=[CacheControl(scope=CacheScope.PRIVATE)],
     )
     async def me(self, info: Info) -> UserType:
         return info.context['user']
 
     @strawberry.field(
-        description='Getting list of all files',
+        description='Getting list of not deleted files',
         permission_classes=[IsAuthenticated],
+        directives=[Cost(weight=5, multiplier='first')],
     )
-    async def files_list(self, info: Info) -> List[FileType]:
-        return await get_files(info.context['session'])
+    async def files_list(self, info: Info, first: Optional[int] = None,
+                         after: Optional[str] = None) -> Connection[FileType]:
+        return await get_files(info.context['session'], first, after)
@@ -0,0 +1,62 @@
+import json
+
+from starlette.requests import Request
+from starlette import status
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+from strawberry.fastapi import GraphQLRouter
+
+from exceptions import GQLError, PersistedQueryNotFound
+from messages import PERSISTED_QUERY_MISMATCH, PERSISTED_QUERY_VERSION
+from schemas.documents import persisted_queries, query_hash
+
+
+class PersistedQueryRouter(GraphQLRouter):
+    ''' GraphQL router with Automatic Persisted Queries (sha256, version 1) '''
+
+    async def execute_request(self, request: Request, response: Response,
+                              data: dict, context, root_value) -> Response:
+        if not isinstance(data, dict):
+            # JSON array or scalar body
+            return self._merge_responses(response, PlainTextResponse(
+                'Unable to parse request body as JSON object',
+                status_code=status.HTTP_400_BAD_REQUEST,
+            ))
+        extensions = data.get('extensions') or {}
+        if isinstance(extensions, str):
+            # GET query parameter
+            try:
+                extensions = json.loads(extensions)
+            except ValueError:
+                extensions = None
+        if not isinstance(extensions, dict):
+            return self._merge_responses(response, PlainTextResponse(
+                'Unable to parse extensions as JSON object',
+                status_code=status.HTTP_400_BAD_REQUEST,
+            ))
+        persisted = extensions.get('persistedQuery')
+        if persisted:
+            try:
+                data = self.resolve_persisted_query(data, persisted)
+            except GQLError as error:
+                return self._merge_responses(
+                    response, JSONResponse({'data': None,
+                                            'errors': [error.formatted]})
+                )
+        return await super().execute_request(request, response, data,
+                                             context, root_value)
+
+    @staticmethod
+    def resolve_persisted_query(data: dict, persisted: dict) -> dict:
+        if not isinstance(persisted, dict) or persisted.get('version') != 1:
+            raise GQLError(PERSISTED_QUERY_VERSION)
+        sha256_hash = persisted.get('sha256Hash')
+        query = data.get('query')
+        if query:
+            if query_hash(query) != sha256_hash:
+                raise GQLError(PERSISTED_QUERY_MISMATCH)
+            persisted_queries.set(sha256_hash, query)
+            return data
+        query = persisted_queries.get(sha256_hash)
+        if query is None:
+            raise PersistedQueryNotFound()
+        return {**data, 'query': query}
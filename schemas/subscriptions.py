@@ -0,0 +1,61 @@
+from typing import AsyncGenerator
+
+import strawberry
+from strawberry.types import Info
+
+from permissions import IsAuthenticated
+from services.events import FILES_CHANNEL, broker, upload_channel
+from schemas.types import FileType, UploadProgress
+
+
+async def release_session(info: Info) -> None:
+    # Subscriptions wait for long, the pool connection is returned meanwhile
+    await info.context['session'].close()
+
+
+async def file_events(info: Info, event: str) -> AsyncGenerator[FileType, None]:
+    await release_session(info)
+    async for message in broker.subscribe(FILES_CHANNEL):
+        if message['event'] == event:
+            yield FileType(**message['file'])
+
+
+@strawberry.type
+class Subscription:
+
+    @strawberry.subscription(
+        description='Uploaded files',
+        permission_classes=[IsAuthenticated],
+    )
+    async def file_added(self, info: Info) -> AsyncGenerator[FileType, None]:
+        async for file in file_events(info, 'added'):
+            yield file
+
+    @strawberry.subscription(
+        description='Deleted files',
+        permission_classes=[IsAuthenticated],
+    )
+    async def file_deleted(self, info: Info) -> AsyncGenerator[FileType, None]:
+        async for file in file_events(info, 'deleted'):
+            yield file
+
+    @strawberry.subscription(
+        description='Uploaded bytes of own `fileUpload` with the same uploadId',
+        permission_classes=[IsAuthenticated],
+    )
+    async def upload_progress(
+        self, info: Info, upload_id: str,
+    ) -> AsyncGenerator[UploadProgress, None]:
+        channel = upload_channel(info.context['user'].id, upload_id)
+        await release_session(info)
+        async for message in broker.subscribe(channel):
+            file = message['file']
+            yield UploadProgress(
+                upload_id=message['upload_id'],
+                loaded=message['loaded'],
+                total=message['total'],
+                done=message['done'],
+                file=FileType(**file) if file else None,
+            )
+            if message['done']:
+                return
@@ -1,16 +1,28 @@
-from typing import List, Optional
+from typing import (Awaitable, Callable, Generic, List, NewType, Optional,
+                    TypeVar)
 
 import strawberry
 
 from db.models import UserModel, FileModel
+from schemas.directives import Cost
+
+T = TypeVar('T')
+
+# GraphQL Int is 32-bit, file sizes may be bigger
+BigInt = strawberry.scalar(
+    NewType('BigInt', int),
+    serialize=int,
+    parse_value=int,
+    description='Integer which may exceed 32 bits',
+)
 
 
 @strawberry.input
 class UserInput:
     email: str
     password: str
-    first_name: Optional[str]
-    last_name: Optional[str]
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
 
     def create_update_dict(data):
         return data.__dict__
@@ -30,12 +42,88 @@ class UserType:
 
 #
 
+@strawberry.type
+class FileVariant:
+    name: str
+    url: str
+    content_type: str
+    width: int
+    height: int
+
+
 @strawberry.type
 class FileType:
     id: str
     file_name: str
     file_url: str
     is_deleted: bool
+    variants: strawberry.Private[Optional[dict]] = None
+
+    @strawberry.field(
+        name='variants',
+        description='Thumbnail, pixelated and converted copies of photos',
+    )
+    def resolve_variants(self) -> List[FileVariant]:
+        return [FileVariant(name=name, **variant)
+                for name, variant in (self.variants or {}).items()]
+
+
+@strawberry.type
+class UploadProgress:
+    upload_id: str
+    loaded: BigInt
+    total: Optional[BigInt]
+    done: bool = False
+    file: Optional[FileType] = None
+
+
+@strawberry.input
+class UploadUrlInput:
+    file_name: str
+    size: BigInt = strawberry.field(description='File size in bytes')
+    content_type: Optional[str] = None
+
+
+@strawberry.type
+class FormField:
+    name: str
+    value: str
+
+
+@strawberry.type
+class UploadPart:
+    part_number: int
+    url: str
+
+
+@strawberry.type
+class UploadTicket:
+    upload_token: str = strawberry.field(
+        description='Passed to `confirmUpload` after the file is uploaded'
+    )
+    url: Optional[str] = strawberry.field(
+        description='POST form with `fields` and the file, single part only'
+    )
+    fields: List[FormField]
+    parts: List[UploadPart] = strawberry.field(
+        description='PUT URLs for parts of `partSize` bytes, multipart only'
+    )
+    part_size: Optional[int]
+    expires_in: int
+
+
+@strawberry.input
+class UploadedPartInput:
+    part_number: int
+    etag: str
+
+
+@strawberry.input
+class ConfirmUploadInput:
+    upload_token: str
+    parts: Optional[List[UploadedPartInput]] = strawberry.field(
+        default=None, description='ETags of uploaded parts, multipart only'
+    )
 
 
 @strawberry.input
@@ -51,6 +139,12 @@ class LoginSuccess:
     refresh_token: str
 
 
+@strawberry.type
+class AppInfoType:
+    app_name: str
+    admin_email: str
+
+
 @strawberry.type
 class MessageType:
     message: str
@@ -59,3 +153,39 @@ class MessageType:
 @strawberry.input
 class RefreshTokenInput:
     refresh_token: str
+
+
+@strawberry.type
+class BulkCreateResult:
+    total: int
+    created: int
+    skipped: List[str] = strawberry.field(
+        description='Emails which already exist or are repeated in input'
+    )
+
+
+@strawberry.type
+class PageInfo:
+    has_next_page: bool
+    end_cursor: Optional[str]
+
+
+@strawberry.type
+class Edge(Generic[T]):
+    cursor: str
+    node: T
+
+
+@strawberry.type
+class Connection(Generic[T]):
+    edges: List[Edge[T]]
+    page_info: PageInfo
+    count: strawberry.Private[Callable[[], Awaitable[int]]]
+
+    @strawberry.field(
+        description='Total count, computed only if requested',
+        # COUNT(*) over the whole table, once per page
+        directives=[Cost(weight=50, once=True)],
+    )
+    async def total_count(self) -> int:
+        return await self.count()
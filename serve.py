@@ -0,0 +1,320 @@
+'''
+Production launcher: the app is imported once, then worker processes are
+forked from it, so they share schema, mappers and templates copy-on-write.
+
+    python serve.py --host 0.0.0.0 --port 8000 --workers 4
+
+Workers run uvicorn with uvloop and httptools on one shared socket.
+Signals to the master process:
+
+    SIGHUP           replacing workers one by one, without downtime
+    SIGTERM, SIGINT  graceful shutdown
+
+Code changes need a restart of the master, workers are forked from the
+code loaded at start.
+'''
+import argparse
+import gc
+import logging
+import os
+import random
+import select
+import signal
+import socket
+import sys
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import uvicorn
+
+from settings import get_settings
+
+logger = logging.getLogger('serve')
+
+# Seconds before respawning after a failed startup, doubled on each failure
+RESPAWN_BACKOFF = 1
+RESPAWN_BACKOFF_MAX = 60
+
+
+@dataclass
+class Worker:
+    pid: int
+    ready_fd: Optional[int]  # closed and cleared when worker reports
+    ready: bool = False
+    retiring: bool = False
+
+
+class WorkerServer(uvicorn.Server):
+    ''' Reports to the master through the pipe when startup is done '''
+
+    def __init__(self, config: uvicorn.Config, ready_fd: int):
+        super().__init__(config)
+        self.ready_fd = ready_fd
+
+    async def startup(self, sockets=None) -> None:
+        await super().startup(sockets=sockets)
+        if not self.should_exit:
+            os.write(self.ready_fd, b'1')
+        os.close(self.ready_fd)
+
+
+class Master:
+    def __init__(self, app, sock: socket.socket, workers: int,
+                 max_requests: int, max_requests_jitter: int,
+                 graceful_timeout: float):
+        self.app = app
+        self.sock = sock
+        self.number = workers
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.graceful_timeout = graceful_timeout
+        self.workers: Dict[int, Worker] = {}
+        self.signals: List[int] = []
+        self.stopping = False
+        # Failed startups in a row and when the next worker may be spawned
+        self.failures = 0
+        self.spawn_after = 0.0
+
+    def spawn(self) -> Worker:
+        max_requests = self.max_requests
+        if max_requests and self.max_requests_jitter:
+            max_requests += random.randint(0, self.max_requests_jitter)
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            self.run_worker(write_fd, max_requests)
+        os.close(write_fd)
+        worker = Worker(pid, read_fd)
+        self.workers[pid] = worker
+        return worker
+
+    def run_worker(self, ready_fd: int, max_requests: int) -> None:
+        ''' Child process, never returns '''
+
+        code = 0
+        try:
+            signal.set_wakeup_fd(-1)
+            os.close(self.wakeup_fd)
+            for worker in self.workers.values():
+                if worker.ready_fd is not None:
+                    os.close(worker.ready_fd)
+            for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT,
+                           signal.SIGCHLD):
+                signal.signal(signum, signal.SIG_DFL)
+            # Restarts are driven by the master
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            config = uvicorn.Config(
+                self.app, loop='uvloop', http='httptools', lifespan='on',
+                limit_max_requests=max_requests or None,
+                # Uvicorn's records go to the root JSON handler
+                log_config=None,
+            )
+            WorkerServer(config, ready_fd).run(sockets=[self.sock])
+        except BaseException:
+            logger.exception('Worker failed')
+            code = 1
+        finally:
+            from services.logger import stop_logging
+
+            stop_logging()
+            os._exit(code)
+
+    def wait_ready(self, workers: List[Worker], timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        pending = [worker for worker in workers if worker.ready_fd is not None]
+        while pending and time.monotonic() < deadline:
+            self.check_ready(deadline - time.monotonic())
+            self.reap()
+            pending = [worker for worker in pending
+                       if worker.ready_fd is not None
+                       and worker.pid in self.workers]
+        return all(worker.ready and worker.pid in self.workers
+                   for worker in workers)
+
+    def check_ready(self, timeout: float) -> None:
+        fds = {worker.ready_fd: worker for worker in self.workers.values()
+               if worker.ready_fd is not None}
+        try:
+            readable, _, _ = select.select([self.wakeup_fd, *fds],
+                                           [], [], max(timeout, 0))
+        except InterruptedError:
+            return
+        for fd in readable:
+            if fd == self.wakeup_fd:
+                self.signals.extend(os.read(fd, 64))
+                continue
+            worker = fds[fd]
+            data = os.read(fd, 1)
+            os.close(fd)
+            worker.ready_fd = None
+            if data:
+                worker.ready = True
+                self.failures = 0
+            else:
+                # Pipe closed without report: startup failed
+                logger.error('Worker failed to start', extra={'pid': worker.pid})
+
+    def reap(self) -> None:
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            worker = self.workers.pop(pid, None)
+            if worker is None:
+                continue
+            if worker.ready_fd is not None:
+                os.close(worker.ready_fd)
+                worker.ready_fd = None
+            if self.stopping or worker.retiring:
+                continue
+            if not worker.ready:
+                # Respawning right away would likely fail the same way
+                self.failures += 1
+                delay = min(RESPAWN_BACKOFF * 2 ** (self.failures - 1),
+                            RESPAWN_BACKOFF_MAX)
+                self.spawn_after = time.monotonic() + delay
+                logger.error('Worker exited during startup', extra={
+                    'pid': pid, 'retry_after': delay,
+                })
+            else:
+                # Crashed or served `max_requests`
+                logger.info('Replacing worker', extra={
+                    'pid': pid, 'exit_code': os.waitstatus_to_exitcode(status),
+                })
+
+    def fill(self) -> None:
+        ''' Spawning missing workers, after a delay if startups failed '''
+
+        active = [worker for worker in self.workers.values()
+                  if not worker.retiring]
+        if len(active) < self.number and time.monotonic() >= self.spawn_after:
+            for _ in range(self.number - len(active)):
+                self.spawn()
+
+    def restart(self) -> None:
+        '''
+        Rolling restart: new worker is ready before the old one stops.
+        If it isn't, the restart is stopped and old workers keep running
+        '''
+
+        logger.info('Restarting workers')
+        for worker in list(self.workers.values()):
+            if worker.retiring or worker.pid not in self.workers:
+                continue
+            new_worker = self.spawn()
+            if not self.wait_ready([new_worker], self.graceful_timeout):
+                logger.error('Restart is stopped, new worker is not ready')
+                if new_worker.pid in self.workers:
+                    self.retire(new_worker)
+                return
+            self.retire(worker)
+
+    def retire(self, worker: Worker) -> None:
+        worker.retiring = True
+        try:
+            os.kill(worker.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    def stop(self) -> None:
+        ''' Graceful shutdown, killing workers after `graceful_timeout` '''
+
+        self.stopping = True
+        for worker in list(self.workers.values()):
+            self.retire(worker)
+        deadline = time.monotonic() + self.graceful_timeout
+        while self.workers and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        for pid in self.workers:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        self.workers.clear()
+
+    def run(self) -> None:
+        read_fd, write_fd = os.pipe()
+        os.set_blocking(read_fd, False)
+        os.set_blocking(write_fd, False)
+        self.wakeup_fd = read_fd
+        # Handlers only wake up the loop, signals are read from the pipe
+        signal.set_wakeup_fd(write_fd)
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT,
+                       signal.SIGCHLD):
+            signal.signal(signum, lambda *args: None)
+
+        # Objects loaded so far are never collected, their pages stay shared
+        gc.collect()
+        gc.freeze()
+
+        workers = [self.spawn() for _ in range(self.number)]
+        if not self.wait_ready(workers, self.graceful_timeout):
+            logger.error('Workers failed to start')
+            self.stop()
+            sys.exit(1)
+        logger.info('Workers started', extra={'workers': self.number,
+                                               'pid': os.getpid()})
+
+        while True:
+            self.check_ready(1)
+            self.reap()
+            self.fill()
+            signals, self.signals = self.signals, []
+            if signal.SIGTERM in signals or signal.SIGINT in signals:
+                logger.info('Shutting down')
+                self.stop()
+                return
+            if signal.SIGHUP in signals:
+                self.restart()
+
+
+def bind_socket(host: str, port: int, backlog: int) -> socket.socket:
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def parse_args() -> argparse.Namespace:
+    settings = get_settings()
+    parser = argparse.ArgumentParser(description='Starting app workers')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int,
+                        default=settings.server_workers or os.cpu_count())
+    parser.add_argument('--max-requests', type=int,
+                        default=settings.server_max_requests)
+    parser.add_argument('--max-requests-jitter', type=int,
+                        default=settings.server_max_requests_jitter)
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    settings = get_settings()
+    # Preloading before fork, also sets up logging
+    from main import app, preload
+
+    preload()
+
+    if args.workers > 1 and settings.events_backend == 'memory':
+        logger.warning('Events are not shared between workers, cached users '
+                       'and results, and subscriptions need '
+                       'EVENTS_BACKEND=postgres')
+
+    sock = bind_socket(args.host, args.port, settings.server_backlog)
+    Master(app, sock, args.workers, args.max_requests,
+           args.max_requests_jitter, settings.server_graceful_timeout).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, Optional, Set, Tuple
+
+
+class LRUCache:
+    ''' In-process LRU cache with per-entry expiry and tag invalidation '''
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # key -> (expires_at, value, tags)
+        self._data: 'OrderedDict[Hashable, Tuple[Optional[float], Any, Tuple]]' = OrderedDict()
+        self._tags: Dict[Hashable, Set[Hashable]] = {}
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        entry = self._data.get(key)
+        return entry is not None and not self._is_expired(entry[0])
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        expires_at, value, _ = entry
+        if self._is_expired(expires_at):
+            self._remove(key)
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None,
+            tags: Iterable[Hashable] = ()) -> None:
+        ''' Storing value, `ttl` (seconds) overrides the cache default '''
+
+        if self.maxsize <= 0:
+            return
+        ttl = self.ttl if ttl is None else ttl
+        if ttl is not None and ttl <= 0:
+            return
+        if key in self._data:
+            self._remove(key)
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        tags = tuple(tags)
+        self._data[key] = (expires_at, value, tags)
+        for tag in tags:
+            self._tags.setdefault(tag, set()).add(key)
+        while len(self._data) > self.maxsize:
+            oldest = next(iter(self._data))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        self._remove(key)
+        return entry[1]
+
+    def invalidate_tag(self, tag: Hashable) -> int:
+        ''' Dropping all entries stored with the tag '''
+
+        keys = self._tags.pop(tag, set())
+        for key in keys:
+            self._remove(key)
+        return len(keys)
+
+    def clear(self) -> None:
+        self._data.clear()
+        self._tags.clear()
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': round(self.hits / requests, 4) if requests else 0.0,
+        }
+
+    @staticmethod
+    def _is_expired(expires_at: Optional[float]) -> bool:
+        return expires_at is not None and expires_at <= time.monotonic()
+
+    def _remove(self, key: Hashable) -> None:
+        _, _, tags = self._data.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
@@ -0,0 +1,130 @@
+import zlib
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # optional, gzip is used without it
+    brotli = None
+
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript',
+                      'application/xml', 'image/svg+xml')
+
+
+class GzipEncoder:
+    encoding = 'gzip'
+
+    def __init__(self, level: int):
+        # wbits=31: gzip header and trailer
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush()
+
+
+class BrotliEncoder:
+    encoding = 'br'
+
+    def __init__(self, quality: int):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.finish()
+
+
+class CompressionMiddleware:
+    '''
+    Brotli (if installed) or gzip for text responses over `minimum_size`.
+    Unlike starlette's GZipMiddleware, skips already encoded and binary
+    responses.
+    '''
+
+    def __init__(self, app: ASGIApp, minimum_size: int = 500,
+                 gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] == 'http':
+            encoder = self.get_encoder(Headers(scope=scope))
+            if encoder is not None:
+                responder = CompressionResponder(self.app, encoder,
+                                                 self.minimum_size)
+                await responder(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+    def get_encoder(self, headers: Headers):
+        accepted = {value.split(';')[0].strip() for value in
+                    headers.get('Accept-Encoding', '').split(',')}
+        if brotli is not None and 'br' in accepted:
+            return BrotliEncoder(self.brotli_quality)
+        if 'gzip' in accepted:
+            return GzipEncoder(self.gzip_level)
+        return None
+
+
+class CompressionResponder:
+    def __init__(self, app: ASGIApp, encoder, minimum_size: int):
+        self.app = app
+        self.encoder = encoder
+        self.minimum_size = minimum_size
+        self.send: Optional[Send] = None
+        self.initial_message: Message = {}
+        self.started = False
+        self.compressing = False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        self.send = send
+        await self.app(scope, receive, self.send_compressed)
+
+    async def send_compressed(self, message: Message) -> None:
+        if message['type'] == 'http.response.start':
+            # Headers are sent with the first body chunk, when it's known
+            # whether the response is compressed
+            self.initial_message = message
+            return
+        if message['type'] != 'http.response.body':
+            await self.send(message)
+            return
+        body = message.get('body', b'')
+        more_body = message.get('more_body', False)
+        if not self.started:
+            self.started = True
+            headers = MutableHeaders(raw=self.initial_message['headers'])
+            self.compressing = (
+                'content-encoding' not in headers
+                and headers.get('content-type', '').startswith(COMPRESSIBLE_TYPES)
+                and (more_body or len(body) >= self.minimum_size)
+            )
+            if self.compressing:
+                headers['Content-Encoding'] = self.encoder.encoding
+                headers.add_vary_header('Accept-Encoding')
+                if more_body:
+                    del headers['Content-Length']
+            await self.send_body(message, body, more_body, headers)
+            return
+        await self.send_body(message, body, more_body)
+
+    async def send_body(self, message: Message, body: bytes, more_body: bool,
+                        headers: Optional[MutableHeaders] = None) -> None:
+        if self.compressing:
+            body = self.encoder.compress(body)
+            if not more_body:
+                body += self.encoder.flush()
+            message['body'] = body
+            if headers is not None and not more_body:
+                headers['Content-Length'] = str(len(body))
+        if headers is not None:
+            await self.send(self.initial_message)
+        await self.send(message)
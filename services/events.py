@@ -0,0 +1,148 @@
+import asyncio
+import json
+import logging
+import uuid
+from typing import AsyncIterator, Dict, Optional, Set
+
+import asyncpg
+from sqlalchemy import text
+
+from db.session import engine
+from settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+FILES_CHANNEL = 'files'
+USERS_CHANNEL = 'users'  # changed users, cached principals are dropped
+CACHE_CHANNEL = 'cache'  # invalidated tags of the result cache
+
+
+def upload_channel(user_id: int, upload_id: str) -> str:
+    ''' Upload ids are chosen by clients, channels are per user '''
+
+    return f'upload:{user_id}:{upload_id}'
+
+
+class Broker:
+    '''
+    In-process pub/sub: every subscriber has a bounded queue, the oldest
+    message is dropped for slow ones. With Postgres bridge messages
+    are also sent to and received from other processes.
+    '''
+
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self.dropped = 0
+        self.bridge: Optional['PostgresBridge'] = None
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+
+    async def publish(self, channel: str, message: dict) -> None:
+        '''
+        Never raises: callers publish after their changes are committed,
+        other processes just miss the message if the bridge fails
+        '''
+
+        self.deliver(channel, message)
+        if self.bridge is not None:
+            try:
+                await self.bridge.publish(channel, message)
+            except Exception:
+                logger.exception('Events bridge publish failed',
+                                 extra={'channel': channel})
+
+    def deliver(self, channel: str, message: dict) -> None:
+        for queue in self._subscribers.get(channel, ()):
+            if queue.full():
+                queue.get_nowait()
+                self.dropped += 1
+            queue.put_nowait(message)
+
+    async def subscribe(self, channel: str) -> AsyncIterator[dict]:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.setdefault(channel, set()).add(queue)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            subscribers = self._subscribers.get(channel, set())
+            subscribers.discard(queue)
+            if not subscribers:
+                self._subscribers.pop(channel, None)
+
+    def stats(self) -> dict:
+        return {
+            'channels': len(self._subscribers),
+            'subscribers': sum(map(len, self._subscribers.values())),
+            'dropped': self.dropped,
+            'bridge': self.bridge is not None,
+        }
+
+
+class PostgresBridge:
+    ''' Fan-out between processes through LISTEN/NOTIFY on one channel '''
+
+    def __init__(self, broker: Broker, dsn: str, channel: str):
+        self.broker = broker
+        self.dsn = dsn
+        self.channel = channel
+        # Own messages come back from Postgres, they are already delivered
+        self.origin = uuid.uuid4().hex
+        self._task: Optional[asyncio.Task] = None
+
+    async def publish(self, channel: str, message: dict) -> None:
+        payload = json.dumps({'origin': self.origin, 'channel': channel,
+                              'message': message}, default=str)
+        query = text('SELECT pg_notify(:channel, :payload)')
+        async with engine.connect() as connection:
+            await connection.execute(query, {'channel': self.channel,
+                                             'payload': payload})
+            await connection.commit()
+
+    def on_notification(self, connection, pid, channel, payload) -> None:
+        data = json.loads(payload)
+        if data['origin'] != self.origin:
+            self.broker.deliver(data['channel'], data['message'])
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self.listen())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+
+    async def listen(self) -> None:
+        ''' Keeping listening connection, reconnecting after failures '''
+
+        while True:
+            connection = None
+            try:
+                connection = await asyncpg.connect(self.dsn)
+                closed = asyncio.Event()
+                connection.add_termination_listener(lambda _: closed.set())
+                await connection.add_listener(self.channel,
+                                              self.on_notification)
+                await closed.wait()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Events listener failed')
+            finally:
+                if connection is not None and not connection.is_closed():
+                    await connection.close()
+            await asyncio.sleep(1)
+
+
+broker = Broker(queue_size=get_settings().events_queue_size)
+
+
+def start_events_bridge() -> None:
+    settings = get_settings()
+    if settings.events_backend == 'postgres':
+        dsn = settings.db_url.replace('+asyncpg', '')
+        broker.bridge = PostgresBridge(broker, dsn, settings.events_pg_channel)
+        broker.bridge.start()
+
+
+async def stop_events_bridge() -> None:
+    if broker.bridge is not None:
+        await broker.bridge.stop()
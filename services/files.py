@@ -1,43 +1,289 @@
+import asyncio
+import math
+import threading
+import time
 import uuid
-from typing import List
+from datetime import timedelta
+from functools import partial
+from typing import List, Optional, Sequence, Tuple
 
-import boto3
 from fastapi import UploadFile
-from sqlalchemy import select
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import joinedload
 
-from db.models import FileModel
+from db.models import FileModel, UserModel
+from db.session import use_primary
+from exceptions import FoundError, GQLError, ValidationError
+from messages import (INVALID_TOKEN, INVALID_UPLOAD_SIZE, UPLOAD_NOT_FOUND,
+                      UPLOAD_PARTS_INVALID, UPLOAD_PARTS_NEEDED,
+                      UPLOAD_SIZE_MISMATCH)
+from services.events import FILES_CHANNEL, broker, upload_channel
+from services.pagination import paginate
+from services.result_cache import result_cache
+from services.storage import (complete_multipart_upload,
+                              create_multipart_upload, delete_object,
+                              head_object, object_url, presigned_part_urls,
+                              presigned_post, upload_fileobj)
+from schemas.types import (ConfirmUploadInput, Connection, Edge, FileType,
+                           FormField, PageInfo, UploadPart, UploadTicket,
+                           UploadUrlInput)
 from settings import get_settings
-from schemas.types import FileType
+from utils import create_access_token, decode_payload
 
+# Result cache tag of everything read from the file table
+FILES_TAG = 'files'
+# Files list is the same for every authenticated user
+FILES_SCOPE = 'authenticated'
 
-async def get_files(session: AsyncSession) -> List[FileType]:
-    ''' Getting list of files '''
 
-    query = select(FileModel).options(joinedload('*'))
+async def get_files(session: AsyncSession, first: Optional[int] = None,
+                    after: Optional[str] = None) -> Connection[FileType]:
+    ''' Getting page of not deleted files, pages and count are cached '''
+
+    edges, page_info = await result_cache.get_or_set(
+        'files_list', {'first': first, 'after': after},
+        partial(load_files_page, first=first, after=after), session,
+        scope=FILES_SCOPE, tags=[FILES_TAG],
+    )
+    return Connection(edges=edges, page_info=page_info,
+                      count=partial(count_files, session))
+
+
+async def load_files_page(session: AsyncSession, first: Optional[int],
+                          after: Optional[str]) -> Tuple[List[Edge], PageInfo]:
+    query = select(FileModel).where(FileModel.is_deleted.isnot(True))
+    connection = await paginate(session, query, FileModel, first, after)
+    # Plain values, cached entries outlive the session
+    edges = [Edge(cursor=edge.cursor, node=FileType(**file_message(edge.node)))
+             for edge in connection.edges]
+    return edges, connection.page_info
+
+
+async def count_files(session: AsyncSession) -> int:
+    async def count(session: AsyncSession) -> int:
+        query = select(func.count()).select_from(FileModel) \
+                                    .where(FileModel.is_deleted.isnot(True))
+        return (await session.execute(query)).scalar_one()
+
+    return await result_cache.get_or_set('files_count', {}, count, session,
+                                         scope=FILES_SCOPE, tags=[FILES_TAG])
+
+
+async def get_files_by_ids(session: AsyncSession,
+                          ids: Sequence[int]) -> List[FileModel]:
+    ''' Getting files by ids in one query '''
+
+    query = select(FileModel).where(FileModel.id.in_([int(i) for i in ids]))
     result = await session.execute(query)
-    return result.scalars().unique().all()
+    return result.scalars().all()
+
+
+def file_message(file: FileModel) -> dict:
+    ''' File as plain values: for caching and events '''
 
+    return {
+        'id': file.id,
+        'file_name': file.file_name,
+        'file_url': file.file_url,
+        'is_deleted': file.is_deleted,
+        'variants': file.variants,
+    }
 
-async def upload(file: UploadFile, session: AsyncSession) -> FileType:
-    ''' Uploading files to AWS S3 '''
 
-    S3_BUCKET_NAME = get_settings().s3_bucket
+class UploadProgressPublisher:
+    ''' boto3 transfer callback, runs in transfer threads '''
+
+    def __init__(self, user_id: int, upload_id: str, total: int):
+        self.upload_id = upload_id
+        self.channel = upload_channel(user_id, upload_id)
+        self.total = total
+        self.loaded = 0
+        self.published_at = 0.0
+        self.loop = asyncio.get_running_loop()
+        self.lock = threading.Lock()
+
+    def __call__(self, bytes_amount: int) -> None:
+        with self.lock:
+            self.loaded += bytes_amount
+            now = time.monotonic()
+            if (now - self.published_at < get_settings().upload_progress_interval
+                    and self.loaded < self.total):
+                return
+            self.published_at = now
+            message = self.message()
+        asyncio.run_coroutine_threadsafe(
+            broker.publish(self.channel, message), self.loop
+        )
+
+    def message(self, file: Optional[FileModel] = None) -> dict:
+        return {
+            'upload_id': self.upload_id,
+            'loaded': self.loaded,
+            'total': self.total,
+            'done': file is not None,
+            'file': file_message(file) if file is not None else None,
+        }
+
+
+async def upload(file: UploadFile, session: AsyncSession,
+                 upload_id: Optional[str] = None,
+                 user: Optional[UserModel] = None) -> FileType:
+    ''' Uploading files to AWS S3, progress is published to `user` '''
+
+    size = file.file.seek(0, 2)
+    file.file.seek(0)
+    progress = None
+    if upload_id and user is not None:
+        progress = UploadProgressPublisher(user.id, upload_id, size)
+
+    # Pillow is heavy to import, it's done on the first upload
+    from services.images import make_variants, should_process
+
+    # Uploading, photos are processed meanwhile
+    path = media_key(file.filename)
+    variants = None
+    if should_process(file.content_type, size):
+        # Read in a thread unless the file is still in memory
+        data = await file.read()
+        await file.seek(0)
+        uploaded_file_url, variants = await asyncio.gather(
+            upload_fileobj(file.file, path, file.content_type, progress),
+            make_variants(data, path),
+        )
+    else:
+        uploaded_file_url = await upload_fileobj(file.file, path,
+                                                 file.content_type, progress)
+
+    added_file = await add_file(session, file.filename, uploaded_file_url,
+                                variants or None)
+    if progress:
+        await broker.publish(progress.channel, progress.message(added_file))
+
+    return added_file
 
-    # Uploading
-    s3 = boto3.resource('s3')
-    bucket = s3.Bucket(S3_BUCKET_NAME)
-    path = f'media/{uuid.uuid4().hex[:12]}_{file.filename}'
-    bucket.upload_fileobj(file.file, path, ExtraArgs={'ACL': 'public-read'})
-    uploaded_file_url = f'https://{S3_BUCKET_NAME}.s3.amazonaws.com/{path}'
 
-    # Storing URL in database
+def media_key(file_name: str) -> str:
+    return f'media/{uuid.uuid4().hex[:12]}_{file_name}'
+
+
+async def add_file(session: AsyncSession, file_name: str, file_url: str,
+                   variants: Optional[dict] = None) -> FileModel:
+    ''' Storing URL of uploaded file in database '''
+
     added_file = FileModel(
-        file_name=file.filename,
-        file_url=uploaded_file_url
+        file_name=file_name,
+        file_url=file_url,
+        variants=variants,
     )
     session.add(added_file)
     await session.commit()
-
+    await result_cache.invalidate(FILES_TAG)
+    await broker.publish(FILES_CHANNEL, {'event': 'added',
+                                         'file': file_message(added_file)})
     return added_file
+
+
+async def request_upload(data: UploadUrlInput,
+                         user: UserModel) -> UploadTicket:
+    '''
+    Presigned upload straight to S3: POST form for files up to one part,
+    multipart upload with PUT URL per part for bigger ones
+    '''
+
+    settings = get_settings()
+    if not 0 < data.size <= settings.s3_max_upload_size:
+        raise ValidationError(INVALID_UPLOAD_SIZE)
+
+    key = media_key(data.file_name)
+    claims = {
+        'user_id': user.id,
+        'token_type': 'upload',
+        'key': key,
+        'file_name': data.file_name,
+        'size': data.size,
+    }
+    url, fields, parts, part_size = None, [], [], None
+    if data.size <= settings.s3_part_size:
+        post = presigned_post(key, data.size, data.content_type)
+        url = post['url']
+        fields = [FormField(name=name, value=value)
+                  for name, value in post['fields'].items()]
+    else:
+        part_size = settings.s3_part_size
+        claims['upload_id'] = await create_multipart_upload(key,
+                                                            data.content_type)
+        urls = presigned_part_urls(key, claims['upload_id'],
+                                   math.ceil(data.size / part_size))
+        parts = [UploadPart(part_number=number, url=url)
+                 for number, url in enumerate(urls, 1)]
+
+    # Confirmation comes after the upload, so the token outlives the URLs
+    expires_in = settings.s3_presign_expires
+    upload_token = create_access_token(claims, timedelta(seconds=2 * expires_in))
+    return UploadTicket(upload_token=upload_token, url=url, fields=fields,
+                        parts=parts, part_size=part_size, expires_in=expires_in)
+
+
+async def confirm_upload(data: ConfirmUploadInput, session: AsyncSession,
+                         user: UserModel) -> FileType:
+    ''' Checking uploaded object with HEAD and storing it in database '''
+
+    claims = decode_payload(data.upload_token, 'upload')
+    if claims['user_id'] != user.id:
+        raise GQLError(INVALID_TOKEN)
+    key = claims['key']
+    file_url = object_url(key)
+
+    # Repeated confirmation returns the same file
+    existing = await get_file_by_url(session, file_url)
+    if existing is not None:
+        return existing
+
+    if 'upload_id' in claims:
+        if not data.parts:
+            raise ValidationError(UPLOAD_PARTS_NEEDED)
+        parts = [{'PartNumber': part.part_number, 'ETag': part.etag}
+                 for part in sorted(data.parts, key=lambda p: p.part_number)]
+        await complete_upload(key, claims['upload_id'], parts)
+
+    metadata = await head_object(key)
+    if metadata is None:
+        raise FoundError(UPLOAD_NOT_FOUND)
+    if metadata['ContentLength'] != claims['size']:
+        # Not stored, the object would stay in the bucket unused
+        await delete_object(key)
+        raise ValidationError(UPLOAD_SIZE_MISMATCH)
+
+    try:
+        return await add_file(session, claims['file_name'], file_url)
+    except IntegrityError:
+        # Concurrent confirmation stored it first
+        await session.rollback()
+        return await get_file_by_url(session, file_url)
+
+
+async def complete_upload(key: str, upload_id: str, parts: List[dict]) -> None:
+    ''' Completing multipart upload, S3 errors are turned into GQL errors '''
+
+    from botocore.exceptions import ClientError
+
+    try:
+        await complete_multipart_upload(key, upload_id, parts)
+    except ClientError as error:
+        code = error.response.get('Error', {}).get('Code')
+        if code == 'NoSuchUpload':
+            # Completed by concurrent confirmation or aborted, the object
+            # is checked next
+            return
+        if code in ('InvalidPart', 'InvalidPartOrder', 'EntityTooSmall'):
+            raise ValidationError(UPLOAD_PARTS_INVALID)
+        raise
+
+
+async def get_file_by_url(session: AsyncSession,
+                          file_url: str) -> Optional[FileModel]:
+    # Primary: the file may be stored just now
+    use_primary(session)
+    query = select(FileModel).where(FileModel.file_url == file_url)
+    return (await session.execute(query)).scalars().first()
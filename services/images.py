@@ -0,0 +1,194 @@
+'''
+Variants of uploaded photos: thumbnail, pixelated preview and converted
+copies (WebP, AVIF if a Pillow plugin provides it). Decoding and encoding
+run in worker processes, the event loop only uploads the results.
+'''
+import asyncio
+import io
+import logging
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image, ImageOps, UnidentifiedImageError, features
+
+from services.metrics import Histogram
+from services.storage import upload_fileobj
+from settings import get_settings
+from utils import WorkerPool
+
+try:
+    import pillow_avif  # noqa: F401, registers AVIF in Pillow
+except ImportError:  # optional, AVIF copies are skipped without it
+    pass
+
+logger = logging.getLogger(__name__)
+
+image_duration = Histogram(
+    'image_processing_duration_seconds', 'Image processing step duration',
+    labels=['step'],
+)
+
+# Pillow format -> (content type, file extension)
+FORMATS = {
+    'WEBP': ('image/webp', 'webp'),
+    'AVIF': ('image/avif', 'avif'),
+    'JPEG': ('image/jpeg', 'jpg'),
+}
+
+
+@dataclass
+class Variant:
+    name: str
+    data: bytes
+    content_type: str
+    extension: str
+    width: int
+    height: int
+
+
+@dataclass
+class ImageOptions:
+    ''' Passed to worker processes, they don't read settings '''
+
+    max_pixels: int
+    max_side: int
+    thumbnail_size: int
+    pixel_size: int
+    formats: Tuple[str, ...]
+    quality: int
+
+    @classmethod
+    def from_settings(cls) -> 'ImageOptions':
+        settings = get_settings()
+        return cls(
+            max_pixels=settings.image_max_pixels,
+            max_side=settings.image_max_side,
+            thumbnail_size=settings.image_thumbnail_size,
+            pixel_size=settings.image_pixel_size,
+            formats=tuple(name.strip().upper()
+                          for name in settings.image_formats.split(',')
+                          if name.strip()),
+            quality=settings.image_quality,
+        )
+
+
+def supported_formats(formats: Tuple[str, ...]) -> List[str]:
+    # Plugins register their formats on init
+    Image.init()
+    return [name for name in formats
+            if name in Image.SAVE
+            and (name != 'WEBP' or features.check('webp'))]
+
+
+def encode(image: Image.Image, name: str, image_format: str,
+           quality: int) -> Variant:
+    if image_format == 'JPEG' and image.mode != 'RGB':
+        image = image.convert('RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, quality=quality)
+    return Variant(name, buffer.getvalue(), *FORMATS[image_format],
+                   image.width, image.height)
+
+
+def process_image(data: bytes, options: ImageOptions
+                  ) -> Tuple[List[Variant], Dict[str, float]]:
+    ''' Runs in a worker process, returns variants and step timings '''
+
+    timings = {}
+    started = time.perf_counter()
+    Image.MAX_IMAGE_PIXELS = options.max_pixels
+    image = Image.open(io.BytesIO(data))
+    # Pillow only warns up to twice MAX_IMAGE_PIXELS, size is read from the
+    # header, nothing is decoded yet
+    if image.width * image.height > options.max_pixels:
+        raise Image.DecompressionBombError(
+            f'Image size ({image.width * image.height} pixels) exceeds limit '
+            f'of {options.max_pixels} pixels'
+        )
+    # JPEG is decoded already scaled down (DCT scaling), bounding memory
+    image.draft('RGB', (options.max_side, options.max_side))
+    image = ImageOps.exif_transpose(image)
+    image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+    image.thumbnail((options.max_side, options.max_side))
+    timings['decode'] = time.perf_counter() - started
+
+    formats = supported_formats(options.formats)
+    preview_format = 'WEBP' if 'WEBP' in formats else 'JPEG'
+    variants = []
+
+    started = time.perf_counter()
+    thumbnail = image.copy()
+    thumbnail.thumbnail((options.thumbnail_size, options.thumbnail_size))
+    variants.append(encode(thumbnail, 'thumbnail', preview_format,
+                           options.quality))
+    timings['thumbnail'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    small = image.resize((max(1, image.width // options.pixel_size),
+                          max(1, image.height // options.pixel_size)),
+                         Image.Resampling.BOX)
+    pixelated = small.resize(image.size, Image.Resampling.NEAREST)
+    variants.append(encode(pixelated, 'pixelated', preview_format,
+                           options.quality))
+    timings['pixelated'] = time.perf_counter() - started
+
+    for image_format in formats:
+        started = time.perf_counter()
+        variants.append(encode(image, image_format.lower(), image_format,
+                               options.quality))
+        timings[image_format.lower()] = time.perf_counter() - started
+    return variants, timings
+
+
+image_pool = WorkerPool(name='image', kind='process',
+                        workers=get_settings().image_workers,
+                        concurrency=get_settings().image_concurrency)
+
+
+def should_process(content_type: Optional[str], size: int) -> bool:
+    settings = get_settings()
+    return (settings.image_processing and size <= settings.image_max_bytes
+            and (content_type or '').startswith('image/'))
+
+
+async def make_variants(data: bytes, key: str) -> Dict[str, dict]:
+    '''
+    Variants uploaded next to the original `key`, as stored in
+    `FileModel.variants`. Broken or too slow images get no variants.
+    '''
+
+    started = time.perf_counter()
+    try:
+        variants, timings = await image_pool.run(
+            process_image, data, ImageOptions.from_settings(),
+            timeout=get_settings().image_timeout,
+        )
+    except UnidentifiedImageError:
+        # Formats unknown to Pillow, e.g. SVG
+        return {}
+    except Image.DecompressionBombError:
+        logger.warning('Image is too large to process', extra={'key': key})
+        return {}
+    except asyncio.TimeoutError:
+        logger.warning('Image processing timed out', extra={'key': key})
+        return {}
+    except Exception:
+        logger.exception('Image processing failed', extra={'key': key})
+        return {}
+    for step, duration in timings.items():
+        image_duration.observe(duration, step=step)
+
+    base = key.rsplit('.', 1)[0]
+    urls = await asyncio.gather(*(
+        upload_fileobj(io.BytesIO(variant.data),
+                       f'{base}_{variant.name}.{variant.extension}',
+                       variant.content_type)
+        for variant in variants
+    ))
+    image_duration.observe(time.perf_counter() - started, step='total')
+    return {
+        variant.name: {'url': url, 'content_type': variant.content_type,
+                       'width': variant.width, 'height': variant.height}
+        for variant, url in zip(variants, urls)
+    }
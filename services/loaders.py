@@ -0,0 +1,43 @@
+from typing import Dict, Hashable, Iterable, List, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from strawberry.dataloader import DataLoader
+
+from db.models import FileModel, UserModel
+from services.files import get_files_by_ids
+from services.users import get_many
+
+
+def order_by_keys(keys: Iterable[Hashable],
+                  items: Dict[Hashable, object]) -> List[Optional[object]]:
+    ''' DataLoader expects results in the same order as keys '''
+
+    return [items.get(key) for key in keys]
+
+
+class Loaders:
+    ''' Request-scoped loaders: one query per tick, memoized per request '''
+
+    def __init__(self, session: AsyncSession):
+        self.session = session
+        self.user_by_id = DataLoader(load_fn=self.load_users_by_id)
+        self.user_by_email = DataLoader(load_fn=self.load_users_by_email)
+        self.file_by_id = DataLoader(load_fn=self.load_files_by_id)
+
+    async def load_users_by_id(self, ids: List[int]) -> List[Optional[UserModel]]:
+        users = await get_many(self.session, ids=ids)
+        self.prime_users(users)
+        return order_by_keys(ids, {user.id: user for user in users})
+
+    async def load_users_by_email(self, emails: List[str]) -> List[Optional[UserModel]]:
+        users = await get_many(self.session, emails=emails)
+        self.prime_users(users)
+        return order_by_keys(emails, {user.email: user for user in users})
+
+    async def load_files_by_id(self, ids: List[int]) -> List[Optional[FileModel]]:
+        files = await get_files_by_ids(self.session, ids)
+        return order_by_keys(ids, {file.id: file for file in files})
+
+    def prime_users(self, users: List[UserModel]) -> None:
+        self.user_by_id.prime_many({user.id: user for user in users})
+        self.user_by_email.prime_many({user.email: user for user in users})
@@ -1,30 +1,56 @@
-from os import environ
+import atexit
+import json
+import logging
+import queue
+import random
+import sys
+import time
+import traceback
+import uuid
+import zlib
+from collections import deque
+from contextvars import ContextVar
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+from os import environ, register_at_fork
+from typing import Dict, Hashable, List, Optional
+
+from settings import get_settings
 
 PROJECT_ID_SB = environ.get('PROJECT_ID_SB')
+REQUEST_ID_HEADER = 'X-Request-ID'
+
+request_id: ContextVar[Optional[str]] = ContextVar('request_id', default=None)
+
+# Attributes of every `LogRecord`, the rest came from `extra`
+RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {
+    'message', 'asctime', 'request_id', 'error', 'suppressed',
+}
 
 
-def generate_log_message(error):
-    trace = []
-    tb = error.__traceback__
-    # Generate the source of error
-    while tb is not None:
+def generate_log_message(error: BaseException,
+                         limit: Optional[int] = None) -> dict:
+    ''' Error type, message and `limit` innermost frames of traceback '''
+
+    trace = deque(maxlen=limit)
+    for frame, line in traceback.walk_tb(error.__traceback__):
         trace.append({
-            "filename": tb.tb_frame.f_code.co_filename,
-            "name": tb.tb_frame.f_code.co_name,
-            "line": tb.tb_lineno
+            "filename": frame.f_code.co_filename,
+            "name": frame.f_code.co_name,
+            "line": line
         })
-        tb = tb.tb_next
 
-    return (str({
+    return {
         'type': type(error).__name__,
         'message': str(error),
         'project_id': PROJECT_ID_SB,
-        'trace': trace
-    }))
+        'trace': list(trace)
+    }
 
 
-def generate_log_message_handled(level, message, current_file, function):
-    return (str({
+def generate_log_message_handled(level, message, current_file, function,
+                                 line: Optional[int] = None) -> dict:
+    return {
         'type': level,
         'message': message,
         'project_id': PROJECT_ID_SB,
@@ -32,6 +58,214 @@ def generate_log_message_handled(level, message, current_file, function):
             {
                 'filename': current_file,
                 'name': function,
+                'line': line,
             }
         ]
-    }))
+    }
+
+
+class JSONFormatter(logging.Formatter):
+    ''' One JSON object per line, runs in the listener thread '''
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = generate_log_message_handled(record.levelname,
+                                            record.getMessage(),
+                                            record.pathname, record.funcName,
+                                            record.lineno)
+        data.update({
+            'time': datetime.utcfromtimestamp(record.created).isoformat() + 'Z',
+            'logger': record.name,
+            'request_id': getattr(record, 'request_id', None),
+        })
+        error = getattr(record, 'error', None)
+        if error is not None:
+            data['error'] = error
+        if getattr(record, 'suppressed', 0):
+            data['suppressed'] = record.suppressed
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRS and key not in data:
+                data[key] = value
+        return json.dumps(data, default=str)
+
+
+class RequestIdFilter(logging.Filter):
+    ''' Adds id of the current request, must run in the request context '''
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    '''
+    Passes `rate` part of DEBUG records. Decision is made per request,
+    so a sampled request has all of its debug logs.
+    '''
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.rate >= 1:
+            return True
+        current = getattr(record, 'request_id', None)
+        if current is None:
+            return random.random() < self.rate
+        return zlib.crc32(current.encode()) % 10000 < self.rate * 10000
+
+
+class DuplicateFilter(logging.Filter):
+    '''
+    Passes the first of repeated warnings and errors in `window` seconds,
+    the next one after the window gets the count of suppressed records.
+    '''
+
+    def __init__(self, window: float, maxsize: int = 1000):
+        super().__init__()
+        self.window = window
+        self.maxsize = maxsize
+        # key -> [window end, suppressed count]
+        self._seen: Dict[Hashable, List] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING or self.window <= 0:
+            return True
+        error = record.exc_info[0].__name__ if record.exc_info else None
+        key = (record.name, record.pathname, record.lineno, str(record.msg),
+               error)
+        now = time.monotonic()
+        entry = self._seen.get(key)
+        if entry is not None and now < entry[0]:
+            entry[1] += 1
+            return False
+        record.suppressed = entry[1] if entry is not None else 0
+        if entry is None and len(self._seen) >= self.maxsize:
+            self._seen = {key: value for key, value in self._seen.items()
+                          if now < value[0]}
+        self._seen[key] = [now + self.window, 0]
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    '''
+    Puts records to a bounded queue, formatting and writing are left
+    to `QueueListener` thread. Records are dropped when queue is full.
+    '''
+
+    def __init__(self, log_queue: queue.Queue, trace_limit: int):
+        super().__init__(log_queue)
+        self.trace_limit = trace_limit
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Walking traceback here, it can't be used after the handler returns
+        if record.exc_info:
+            record.error = generate_log_message(record.exc_info[1],
+                                                self.trace_limit)
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        record.exc_text = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class RequestIdMiddleware:
+    ''' Takes request id from the header or generates it, echoes it back '''
+
+    def __init__(self, app, header: str = REQUEST_ID_HEADER):
+        self.app = app
+        self.header = header.lower().encode()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] not in ('http', 'websocket'):
+            return await self.app(scope, receive, send)
+        value = None
+        for name, header in scope['headers']:
+            if name == self.header:
+                value = header.decode('latin-1')
+                break
+        if not value or len(value) > 64 or not value.isprintable():
+            value = uuid.uuid4().hex
+        token = request_id.set(value)
+
+        async def send_with_request_id(message):
+            if message['type'] == 'http.response.start':
+                message['headers'] = [*message.get('headers', ()),
+                                      (self.header, value.encode('latin-1'))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            request_id.reset(token)
+
+
+_handler: Optional[NonBlockingQueueHandler] = None
+_listener: Optional[QueueListener] = None
+
+
+def setup_logging() -> NonBlockingQueueHandler:
+    ''' Routing root logger through the queue to JSON lines in stdout '''
+
+    global _handler, _listener
+
+    if _handler is not None:
+        return _handler
+    settings = get_settings()
+    handler = NonBlockingQueueHandler(queue.Queue(settings.log_queue_size),
+                                      settings.log_trace_limit)
+    # Order matters: sampling uses the request id
+    handler.addFilter(RequestIdFilter())
+    handler.addFilter(SamplingFilter(settings.log_debug_sample_rate))
+    handler.addFilter(DuplicateFilter(settings.log_duplicate_window))
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JSONFormatter())
+    _listener = QueueListener(handler.queue, output)
+    _listener.start()
+    atexit.register(stop_logging)
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(settings.log_level.upper())
+    _handler = handler
+    return handler
+
+
+def stop_logging() -> None:
+    ''' Writing out queued records and stopping the listener thread '''
+
+    global _listener
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def restart_listener() -> None:
+    ''' Threads don't survive fork, forked child starts its own listener '''
+
+    if _listener is None:
+        return
+    # The queue lock could be held by the parent's listener during fork
+    _handler.queue = queue.Queue(_handler.queue.maxsize)
+    _listener.queue = _handler.queue
+    _listener.start()
+
+
+register_at_fork(after_in_child=restart_listener)
+
+
+def logging_stats() -> dict:
+    if _handler is None:
+        return {}
+    return {
+        'queue_size': _handler.queue.qsize(),
+        'queue_maxsize': _handler.queue.maxsize,
+        'dropped': _handler.dropped,
+    }
@@ -0,0 +1,58 @@
+import bisect
+from typing import Dict, List, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+registry: List['Histogram'] = []
+
+
+class Histogram:
+    ''' Prometheus-style cumulative histogram with optional labels '''
+
+    def __init__(self, name: str, description: str,
+                 buckets: Sequence[float] = DEFAULT_BUCKETS,
+                 labels: Sequence[str] = ()):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self.labels = tuple(labels)
+        # label values -> (bucket counts, sum, count)
+        self._series: Dict[Tuple[str, ...], list] = {}
+        registry.append(self)
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels.get(label, '')) for label in self.labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[0][index] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.description}',
+                 f'# TYPE {self.name} histogram']
+        for key, (counts, total, count) in self._series.items():
+            labels = [f'{label}="{value}"' for label, value in zip(self.labels, key)]
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                bucket_labels = ','.join(labels + [f'le="{bound}"'])
+                lines.append(f'{self.name}_bucket{{{bucket_labels}}} {cumulative}')
+            bucket_labels = ','.join(labels + ['le="+Inf"'])
+            lines.append(f'{self.name}_bucket{{{bucket_labels}}} {count}')
+            suffix = '{' + ','.join(labels) + '}' if labels else ''
+            lines.append(f'{self.name}_sum{suffix} {total}')
+            lines.append(f'{self.name}_count{suffix} {count}')
+        return lines
+
+
+def render_metrics() -> str:
+    lines = []
+    for histogram in registry:
+        lines.extend(histogram.render())
+    return '\n'.join(lines) + '\n'
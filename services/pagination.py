@@ -0,0 +1,60 @@
+import base64
+import binascii
+from typing import Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import Select
+
+from exceptions import ValidationError
+from messages import INVALID_CURSOR, INVALID_PAGE_SIZE
+from schemas.types import Connection, Edge, PageInfo
+from settings import get_settings
+
+CURSOR_PREFIX = 'cursor:'
+
+
+def encode_cursor(id: int) -> str:
+    return base64.urlsafe_b64encode(f'{CURSOR_PREFIX}{id}'.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        value = base64.urlsafe_b64decode(cursor.encode()).decode()
+        if not value.startswith(CURSOR_PREFIX):
+            raise ValueError(value)
+        return int(value[len(CURSOR_PREFIX):])
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValidationError(INVALID_CURSOR)
+
+
+async def paginate(session: AsyncSession, query: Select, model,
+                   first: Optional[int] = None,
+                   after: Optional[str] = None) -> Connection:
+    ''' Keyset pagination by primary key, `query` is already filtered '''
+
+    if first is None:
+        first = get_settings().page_size_default
+    if not 0 <= first <= get_settings().page_size_max:
+        raise ValidationError(INVALID_PAGE_SIZE)
+
+    async def count() -> int:
+        count_query = select(func.count()).select_from(query.subquery())
+        return (await session.execute(count_query)).scalar_one()
+
+    page_query = query.order_by(model.id.asc()).limit(first + 1)
+    if after:
+        page_query = page_query.where(model.id > decode_cursor(after))
+    result = await session.execute(page_query)
+    items = result.scalars().all()
+
+    edges = [Edge(cursor=encode_cursor(item.id), node=item)
+             for item in items[:first]]
+    return Connection(
+        edges=edges,
+        page_info=PageInfo(
+            has_next_page=len(items) > first,
+            end_cursor=edges[-1].cursor if edges else None,
+        ),
+        count=count,
+    )
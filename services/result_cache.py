@@ -0,0 +1,239 @@
+import asyncio
+import hashlib
+import json
+import logging
+import pickle
+import time
+from typing import (Any, Awaitable, Callable, Dict, Iterable, Optional, Set,
+                    Tuple)
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db.session import async_session
+from services.cache import LRUCache
+from services.events import CACHE_CHANNEL, broker
+from settings import get_settings
+
+try:
+    from redis import asyncio as redis
+except ImportError:  # optional, needed for the redis backend only
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+# (value, fresh until timestamp)
+Entry = Tuple[Any, float]
+
+
+class CacheBackend:
+    ''' Storage of result cache entries, keys are strings '''
+
+    # Invalidation is seen by other processes without broker messages
+    shared = False
+
+    async def get(self, key: str) -> Optional[Entry]:
+        raise NotImplementedError
+
+    async def set(self, key: str, entry: Entry, ttl: float,
+                  tags: Iterable[str] = ()) -> None:
+        raise NotImplementedError
+
+    async def invalidate_tags(self, tags: Iterable[str]) -> None:
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        return {}
+
+
+class MemoryBackend(CacheBackend):
+    '''
+    In-process LRU, other processes learn about invalidation from broker
+    (with `EVENTS_BACKEND=postgres`)
+    '''
+
+    def __init__(self, maxsize: int):
+        self.cache = LRUCache(maxsize=maxsize)
+
+    async def get(self, key: str) -> Optional[Entry]:
+        return self.cache.get(key)
+
+    async def set(self, key: str, entry: Entry, ttl: float,
+                  tags: Iterable[str] = ()) -> None:
+        self.cache.set(key, entry, ttl=ttl, tags=tags)
+
+    async def invalidate_tags(self, tags: Iterable[str]) -> None:
+        for tag in tags:
+            self.cache.invalidate_tag(tag)
+
+    def stats(self) -> dict:
+        return self.cache.stats()
+
+
+class RedisBackend(CacheBackend):
+    '''
+    Shared between processes. Each tag is a sorted set of its keys scored
+    by expiration time, expired ones are trimmed when keys are added.
+    '''
+
+    shared = True
+
+    def __init__(self, url: str, prefix: str = 'result:'):
+        if redis is None:
+            raise RuntimeError('Redis backend needs `redis` package')
+        self.client = redis.from_url(url)
+        self.prefix = prefix
+
+    async def get(self, key: str) -> Optional[Entry]:
+        value = await self.client.get(self.prefix + key)
+        return pickle.loads(value) if value is not None else None
+
+    async def set(self, key: str, entry: Entry, ttl: float,
+                  tags: Iterable[str] = ()) -> None:
+        key = self.prefix + key
+        now = time.time()
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.set(key, pickle.dumps(entry), px=int(ttl * 1000))
+            for tag in tags:
+                tag_key = self.tag_key(tag)
+                pipe.zadd(tag_key, {key: now + ttl})
+                pipe.zremrangebyscore(tag_key, '-inf', now)
+                # Entries of one cache share ttl, the last one outlives others
+                pipe.pexpire(tag_key, int(ttl * 1000))
+            await pipe.execute()
+
+    async def invalidate_tags(self, tags: Iterable[str]) -> None:
+        for tag in tags:
+            tag_key = self.tag_key(tag)
+            keys = await self.client.zrange(tag_key, 0, -1)
+            await self.client.delete(tag_key, *keys)
+
+    def tag_key(self, tag: str) -> str:
+        return f'{self.prefix}tags:{tag}'
+
+
+class ResultCache:
+    '''
+    Results of read-only queries by name, arguments and auth scope.
+    Entries are fresh for `ttl` seconds, then served for `stale_ttl`
+    more while one background task recomputes them in its own session.
+    '''
+
+    def __init__(self, backend: CacheBackend, ttl: float, stale_ttl: float):
+        self.backend = backend
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        # Computations in progress, concurrent misses wait for them
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._revalidating: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        # Bumped on invalidation, results computed before aren't stored
+        self._generation = 0
+
+    @staticmethod
+    def make_key(name: str, args: Dict[str, Any], scope: str) -> str:
+        args_hash = hashlib.sha1(
+            json.dumps(args, sort_keys=True, default=str).encode()
+        ).hexdigest()
+        return f'{name}:{scope}:{args_hash}'
+
+    async def get_or_set(self, name: str, args: Dict[str, Any],
+                         compute: Callable[[AsyncSession], Awaitable[Any]],
+                         session: AsyncSession, scope: str = 'public',
+                         tags: Iterable[str] = ()) -> Any:
+        key = self.make_key(name, args, scope)
+        tags = tuple(tags)
+        entry = await self.backend.get(key)
+        if entry is not None:
+            value, fresh_until = entry
+            if fresh_until > time.time():
+                self.hits += 1
+            else:
+                self.stale_hits += 1
+                if key not in self._revalidating:
+                    self._revalidating.add(key)
+                    task = asyncio.create_task(
+                        self._revalidate(key, compute, tags)
+                    )
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+            return value
+        self.misses += 1
+        if key in self._pending:
+            return await asyncio.shield(self._pending[key])
+        return await self._compute(key, compute, session, tags)
+
+    async def invalidate(self, *tags: str) -> None:
+        ''' Other processes drop local entries on the published message '''
+
+        await self.drop(tags)
+        if not self.backend.shared:
+            await broker.publish(CACHE_CHANNEL, {'tags': list(tags)})
+
+    async def drop(self, tags: Iterable[str]) -> None:
+        self._generation += 1
+        await self.backend.invalidate_tags(tags)
+
+    async def watch_invalidations(self) -> None:
+        ''' Background task, invalidation by other processes from broker '''
+
+        if self.backend.shared:
+            return
+        async for message in broker.subscribe(CACHE_CHANNEL):
+            await self.drop(message['tags'])
+
+    async def _compute(self, key: str, compute, session: AsyncSession,
+                       tags: Tuple[str, ...]) -> Any:
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        generation = self._generation
+        try:
+            value = await compute(session)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as error:
+            future.set_exception(error)
+            # Marking as retrieved, waiters are optional
+            future.exception()
+            raise
+        finally:
+            self._pending.pop(key, None)
+        future.set_result(value)
+        if generation == self._generation:
+            await self.backend.set(key, (value, time.time() + self.ttl),
+                                   ttl=self.ttl + self.stale_ttl, tags=tags)
+        return value
+
+    async def _revalidate(self, key: str, compute,
+                          tags: Tuple[str, ...]) -> None:
+        try:
+            async with async_session() as session:
+                await self._compute(key, compute, session, tags)
+        except Exception:
+            logger.exception('Result cache revalidation failed',
+                             extra={'key': key})
+        finally:
+            self._revalidating.discard(key)
+
+    def stats(self) -> dict:
+        return {
+            'backend': self.backend.stats(),
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'pending': len(self._pending),
+        }
+
+
+def get_backend() -> CacheBackend:
+    settings = get_settings()
+    if settings.result_cache_backend == 'redis':
+        return RedisBackend(settings.result_cache_redis_url)
+    return MemoryBackend(settings.result_cache_size)
+
+
+result_cache = ResultCache(get_backend(), ttl=get_settings().result_cache_ttl,
+                           stale_ttl=get_settings().result_cache_stale_ttl)
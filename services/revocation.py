@@ -0,0 +1,195 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from hashlib import blake2b
+from typing import Dict, Optional
+
+from sqlalchemy import delete, select, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from db.models import RevokedTokenModel
+from db.session import async_session, engine, use_primary
+from settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Advisory lock of the process deleting expired rows, see `purge_expired`
+PURGE_LOCK_ID = 0x7265766f6b65
+
+
+def token_key(jti: str) -> int:
+    ''' 64-bit hash of token id, keeps the index compact '''
+
+    return int.from_bytes(blake2b(jti.encode(), digest_size=8).digest(), 'big')
+
+
+def to_timestamp(value: datetime) -> int:
+    return int(value.replace(tzinfo=timezone.utc).timestamp())
+
+
+class RevocationList:
+    '''
+    In-process index of revoked token ids, so checks need no DB query.
+    Filled from `revoked_token` table on the primary: new rows every few
+    seconds, full reload with dropping of expired tokens from time to time.
+    '''
+
+    def __init__(self):
+        self.last_id = 0
+        self.refreshed_at: Optional[float] = None
+        self.reloaded_at: Optional[float] = None
+        # token key -> token expiry timestamp
+        self._tokens: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._tokens)
+
+    def __contains__(self, jti: Optional[str]) -> bool:
+        return jti is not None and token_key(jti) in self._tokens
+
+    def add(self, jti: str, expires_at: int) -> None:
+        self._tokens[token_key(jti)] = expires_at
+
+    async def refresh(self, session: AsyncSession) -> int:
+        '''
+        Loading tokens revoked since the last refresh. Ids are taken in
+        insert order but committed in any order, so the last
+        `REVOCATION_RESCAN_WINDOW` ids are read again: rows committed late
+        with lower ids aren't skipped. Returns the number of new tokens.
+        '''
+
+        size = len(self._tokens)
+        window = get_settings().revocation_rescan_window
+        query = select(RevokedTokenModel.id, RevokedTokenModel.jti,
+                       RevokedTokenModel.expires_at) \
+            .where(RevokedTokenModel.id > self.last_id - window) \
+            .order_by(RevokedTokenModel.id)
+        rows = (await session.execute(query)).all()
+        for row in rows:
+            self.add(row.jti, to_timestamp(row.expires_at))
+            self.last_id = max(self.last_id, row.id)
+        self.refreshed_at = time.time()
+        return len(self._tokens) - size
+
+    async def reload(self, session: AsyncSession) -> int:
+        ''' Replacing the index with not expired tokens '''
+
+        now = datetime.utcnow()
+        query = select(RevokedTokenModel.id, RevokedTokenModel.jti,
+                       RevokedTokenModel.expires_at) \
+            .where(RevokedTokenModel.expires_at > now)
+        rows = (await session.execute(query)).all()
+        # Keeping not expired local entries revoked during the query
+        pending = {key: expires_at for key, expires_at in self._tokens.items()
+                   if expires_at > time.time()}
+        self._tokens = {token_key(row.jti): to_timestamp(row.expires_at)
+                        for row in rows}
+        for key, expires_at in pending.items():
+            self._tokens.setdefault(key, expires_at)
+        self.last_id = max([self.last_id] + [row.id for row in rows])
+        self.reloaded_at = self.refreshed_at = time.time()
+        return len(rows)
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self._tokens),
+            'last_id': self.last_id,
+            'refreshed_at': self.refreshed_at,
+            'reloaded_at': self.reloaded_at,
+        }
+
+
+revoked_tokens = RevocationList()
+
+
+async def revoke(session: AsyncSession, payload: dict) -> bool:
+    ''' Revoking token by its payload, False if it was already revoked '''
+
+    jti = payload.get('jti')
+    if jti is None:
+        # Issued before tokens got ids
+        return False
+    session.add(RevokedTokenModel(
+        jti=jti,
+        user_id=int(payload['user_id']),
+        expires_at=datetime.utcfromtimestamp(payload['exp']),
+    ))
+    try:
+        await session.commit()
+    except IntegrityError:
+        await session.rollback()
+        revoked_tokens.add(jti, payload['exp'])
+        return False
+    revoked_tokens.add(jti, payload['exp'])
+    return True
+
+
+async def refresh_revoked_tokens() -> None:
+    ''' Background task keeping `revoked_tokens` up to date '''
+
+    settings = get_settings()
+    while True:
+        reload = (revoked_tokens.reloaded_at is None
+                  or time.time() - revoked_tokens.reloaded_at
+                  >= settings.revocation_reload_interval)
+        try:
+            async with async_session() as session:
+                # The replica lags behind, revoked tokens would be accepted
+                use_primary(session)
+                if reload:
+                    count = await revoked_tokens.reload(session)
+                else:
+                    count = await revoked_tokens.refresh(session)
+            logger.debug('Revoked tokens loaded',
+                         extra={'count': count, 'reload': reload})
+        except Exception:
+            logger.exception('Revoked tokens refresh failed')
+        await asyncio.sleep(settings.revocation_refresh_interval)
+
+
+async def purge_expired() -> None:
+    '''
+    Background task deleting expired rows. Only the process holding the
+    advisory lock deletes, others retry to take it over in case the holder
+    stops; the lock is held by the connection kept open meanwhile.
+    '''
+
+    interval = get_settings().revocation_reload_interval
+    while True:
+        try:
+            async with engine.connect() as connection:
+                locked = await take_purge_lock(connection)
+                try:
+                    while locked:
+                        result = await connection.execute(
+                            delete(RevokedTokenModel).where(
+                                RevokedTokenModel.expires_at
+                                <= datetime.utcnow()
+                            )
+                        )
+                        await connection.commit()
+                        logger.debug('Expired revoked tokens deleted',
+                                     extra={'count': result.rowcount})
+                        await asyncio.sleep(interval)
+                except BaseException:
+                    if locked:
+                        # Closing releases the lock, the pool would keep it
+                        await connection.invalidate()
+                    raise
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception('Expired revoked tokens purge failed')
+        await asyncio.sleep(interval)
+
+
+async def take_purge_lock(connection: AsyncConnection) -> bool:
+    if connection.dialect.name != 'postgresql':
+        # Single process setups, e.g. SQLite
+        return True
+    locked = await connection.scalar(text('SELECT pg_try_advisory_lock(:id)'),
+                                     {'id': PURGE_LOCK_ID})
+    await connection.commit()
+    return locked
@@ -0,0 +1,230 @@
+'''
+Secrets for settings from AWS Secrets Manager or from a JSON file
+(stand-in for offline work and tests).
+
+Values are cached on disk for `SECRETS_CACHE_TTL` seconds, so restarts
+don't wait for AWS, and the app checks the secret version in background
+to pick up rotated values without restart.
+
+The provider is configured with environment only, settings depend on it:
+
+    SECRETS_BACKEND=aws   AWS_SECRET_NAME, AWS_SECRET_REGION_NAME,
+                          ASM_AWS_ACCESS_KEY_ID, ASM_AWS_SECRET_ACCESS_KEY
+    SECRETS_BACKEND=file  SECRETS_FILE (default `secrets.json`)
+    SECRETS_CACHE_PATH    default `$XDG_CACHE_HOME/boilerplate-back/secrets.json`
+                          (`~/.cache` without XDG_CACHE_HOME), outside
+                          the working tree so it's never committed
+    SECRETS_CACHE_TTL     default 300 seconds
+'''
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from functools import lru_cache
+from os import environ
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import anyio
+
+logger = logging.getLogger(__name__)
+
+# (values, version), None if the known version is still current
+Fetched = Optional[Tuple[Dict[str, Any], str]]
+
+
+class SecretsBackend:
+    def fetch(self, version: Optional[str] = None) -> Fetched:
+        raise NotImplementedError
+
+
+class AWSSecretsBackend(SecretsBackend):
+    ''' JSON secret, the version is checked before reading the value '''
+
+    def __init__(self, secret_id: str, region: str,
+                 access_key: Optional[str] = None,
+                 secret_key: Optional[str] = None):
+        self.secret_id = secret_id
+        self.region = region
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self._client = None
+
+    @classmethod
+    def from_env(cls) -> 'AWSSecretsBackend':
+        return cls(environ.get('AWS_SECRET_NAME'),
+                   environ.get('AWS_SECRET_REGION_NAME'),
+                   environ.get('ASM_AWS_ACCESS_KEY_ID'),
+                   environ.get('ASM_AWS_SECRET_ACCESS_KEY'))
+
+    @property
+    def client(self):
+        if self._client is None:
+            import boto3
+
+            self._client = boto3.session.Session(
+                aws_access_key_id=self.access_key,
+                aws_secret_access_key=self.secret_key,
+            ).client('secretsmanager', region_name=self.region)
+        return self._client
+
+    def fetch(self, version: Optional[str] = None) -> Fetched:
+        if version is not None:
+            # Metadata only, the value isn't decrypted
+            stages = self.client.describe_secret(
+                SecretId=self.secret_id
+            )['VersionIdsToStages']
+            if 'AWSCURRENT' in stages.get(version, ()):
+                return None
+        response = self.client.get_secret_value(SecretId=self.secret_id)
+        if 'SecretString' in response:
+            secret = response['SecretString']
+        else:
+            secret = base64.b64decode(response['SecretBinary'])
+        return json.loads(secret), response['VersionId']
+
+
+class FileSecretsBackend(SecretsBackend):
+    ''' JSON file, the version is the content hash '''
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def fetch(self, version: Optional[str] = None) -> Fetched:
+        with open(self.path, 'rb') as file:
+            content = file.read()
+        current = hashlib.sha256(content).hexdigest()
+        if current == version:
+            return None
+        return json.loads(content), current
+
+
+class SecretsProvider:
+    '''
+    Values from the disk cache while it's fresh, otherwise the backend is
+    asked whether the version changed. If the backend fails, stale cached
+    values are used.
+    '''
+
+    def __init__(self, backend: SecretsBackend, cache_path: str, ttl: float):
+        self.backend = backend
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.values: Dict[str, Any] = {}
+        self.version: Optional[str] = None
+        self.fetched_at = 0.0
+        self.changes = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def load(self) -> Dict[str, Any]:
+        with self._lock:
+            if self.version is None:
+                self.read_cache()
+            if time.time() - self.fetched_at >= self.ttl:
+                try:
+                    self._refresh()
+                except Exception:
+                    if self.version is None:
+                        raise
+                    self.failures += 1
+                    logger.exception('Secrets refresh failed, cached are used')
+            return self.values
+
+    def refresh(self) -> bool:
+        ''' Checking the version, True if values changed '''
+
+        with self._lock:
+            return self._refresh()
+
+    def _refresh(self) -> bool:
+        fetched = self.backend.fetch(self.version)
+        self.fetched_at = time.time()
+        if fetched is not None:
+            self.values, self.version = fetched
+        self.write_cache()
+        return fetched is not None
+
+    def read_cache(self) -> None:
+        try:
+            with open(self.cache_path) as file:
+                data = json.load(file)
+            values, version = data['values'], data['version']
+            fetched_at = data['fetched_at']
+        except (OSError, ValueError, KeyError):
+            return
+        self.values, self.version, self.fetched_at = values, version, fetched_at
+
+    def write_cache(self) -> None:
+        ''' Atomic replace, other processes read the cache concurrently '''
+
+        directory = os.path.dirname(os.path.abspath(self.cache_path))
+        try:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+            descriptor, path = tempfile.mkstemp(dir=directory)
+            with os.fdopen(descriptor, 'w') as file:
+                json.dump({'values': self.values, 'version': self.version,
+                           'fetched_at': self.fetched_at}, file)
+            os.replace(path, self.cache_path)
+        except OSError:
+            logger.exception('Secrets cache is not written')
+
+    async def reload_periodically(self, interval: float,
+                                  on_change: Callable[[], None]) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                changed = await anyio.to_thread.run_sync(self.refresh)
+            except Exception:
+                self.failures += 1
+                logger.exception('Secrets reload failed')
+                continue
+            if changed:
+                self.changes += 1
+                logger.info('Secrets changed', extra={'version': self.version})
+                on_change()
+
+    def stats(self) -> dict:
+        return {
+            'version': self.version,
+            'age': round(time.time() - self.fetched_at, 1),
+            'changes': self.changes,
+            'failures': self.failures,
+        }
+
+
+def default_cache_path() -> str:
+    cache_home = (environ.get('XDG_CACHE_HOME')
+                  or os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(cache_home, 'boilerplate-back', 'secrets.json')
+
+
+@lru_cache
+def get_secrets_provider() -> Optional[SecretsProvider]:
+    backend_name = environ.get('SECRETS_BACKEND')
+    if backend_name == 'aws':
+        backend = AWSSecretsBackend.from_env()
+    elif backend_name == 'file':
+        backend = FileSecretsBackend(environ.get('SECRETS_FILE',
+                                                 'secrets.json'))
+    else:
+        return None
+    return SecretsProvider(
+        backend,
+        cache_path=environ.get('SECRETS_CACHE_PATH') or default_cache_path(),
+        ttl=float(environ.get('SECRETS_CACHE_TTL', 300)),
+    )
+
+
+def secrets_settings(settings) -> Dict[str, Any]:
+    ''' Pydantic settings source, secret names are env-style (DB_PASSWORD) '''
+
+    provider = get_secrets_provider()
+    if provider is None:
+        return {}
+    return {name.lower(): value for name, value in provider.load().items()
+            if name.lower() in settings.__fields__}
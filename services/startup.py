@@ -0,0 +1,82 @@
+'''
+Startup timings. Profiler mode:
+
+    python -m services.startup
+
+prints import time of `main` grouped by top-level package (measured with
+`python -X importtime` in a subprocess), then duration of lazy
+initialization and of every startup phase.
+'''
+import asyncio
+import logging
+import re
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Phase name -> seconds, filled by `startup_phase`
+phases: Dict[str, float] = {}
+
+IMPORT_TIME = re.compile(r'import time:\s+(\d+) \|\s+\d+ \|\s*(\S+)')
+
+
+@contextmanager
+def startup_phase(name: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases[name] = time.perf_counter() - started
+
+
+def log_startup() -> None:
+    logger.info('Startup finished', extra={
+        'phases': {name: round(duration, 4)
+                   for name, duration in phases.items()},
+    })
+
+
+def import_times(module: str) -> List[Tuple[str, float]]:
+    ''' Own import time of modules grouped by top-level package, seconds '''
+
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True, check=True,
+    )
+    totals: Dict[str, float] = defaultdict(float)
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME.match(line)
+        if match:
+            totals[match[2].split('.')[0]] += int(match[1]) / 1e6
+    return sorted(totals.items(), key=lambda item: item[1], reverse=True)
+
+
+def print_times(title: str, times: List[Tuple[str, float]],
+                limit: int = 20) -> None:
+    print(f'\n{title}: {sum(seconds for _, seconds in times) * 1000:.1f} ms')
+    for name, seconds in times[:limit]:
+        print(f'{seconds * 1000:10.1f} ms  {name}')
+
+
+async def profile_startup() -> None:
+    print_times('Import of main by package', import_times('main'))
+
+    with startup_phase('import main'):
+        from main import app, preload
+    with startup_phase('preload'):
+        preload()
+    await app.router.startup()
+    await app.router.shutdown()
+    print_times('Initialization by phase', list(phases.items()))
+
+
+if __name__ == '__main__':
+    # `main` records phases in the imported module, not in `__main__`
+    from services.startup import profile_startup
+
+    asyncio.run(profile_startup())
@@ -0,0 +1,39 @@
+import hashlib
+import os
+from functools import lru_cache
+from urllib.parse import parse_qs
+
+from fastapi.staticfiles import StaticFiles
+from starlette.responses import Response
+from starlette.types import Scope
+
+from settings import get_settings
+
+
+class CachedStaticFiles(StaticFiles):
+    '''
+    StaticFiles already answers with ETag/Last-Modified and 304.
+    URLs with `?v=` (see `static_version`) are cached as immutable,
+    the rest are revalidated on every use.
+    '''
+
+    def file_response(self, full_path, stat_result: os.stat_result,
+                      scope: Scope, status_code: int = 200) -> Response:
+        response = super().file_response(full_path, stat_result, scope,
+                                         status_code)
+        query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+        if 'v' in query:
+            response.headers['Cache-Control'] = (
+                f'public, max-age={get_settings().static_max_age}, immutable'
+            )
+        else:
+            response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+
+@lru_cache(maxsize=None)
+def static_version(directory: str, path: str) -> str:
+    ''' Content hash of static file for cache busting URLs '''
+
+    with open(os.path.join(directory, path), 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()[:12]
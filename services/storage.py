@@ -0,0 +1,160 @@
+'''
+boto3 is imported on first use: it's slow to import and most processes
+(scripts, tests, workers serving no uploads) never need it.
+'''
+from functools import lru_cache, partial
+from typing import IO, TYPE_CHECKING, Callable, List, Optional
+
+import anyio
+
+from settings import get_settings
+
+if TYPE_CHECKING:
+    from boto3.s3.transfer import TransferConfig
+
+_upload_limiter: Optional[anyio.CapacityLimiter] = None
+
+
+@lru_cache
+def get_s3_client():
+    ''' Shared S3 client, boto3 clients are thread-safe and keep a pool '''
+
+    import boto3
+    from botocore.config import Config
+
+    settings = get_settings()
+    return boto3.session.Session().client(
+        's3',
+        region_name=settings.s3_region,
+        endpoint_url=settings.s3_endpoint_url,
+        aws_access_key_id=settings.s3_key,
+        aws_secret_access_key=settings.s3_secret,
+        config=Config(max_pool_connections=settings.s3_max_pool_connections),
+    )
+
+
+@lru_cache
+def get_transfer_config() -> 'TransferConfig':
+    from boto3.s3.transfer import TransferConfig
+
+    settings = get_settings()
+    return TransferConfig(
+        multipart_threshold=settings.s3_part_size,
+        multipart_chunksize=settings.s3_part_size,
+        max_concurrency=settings.s3_upload_concurrency,
+    )
+
+
+def get_upload_limiter() -> anyio.CapacityLimiter:
+    global _upload_limiter
+    if _upload_limiter is None:
+        _upload_limiter = anyio.CapacityLimiter(get_settings().s3_max_uploads)
+    return _upload_limiter
+
+
+def object_url(key: str) -> str:
+    settings = get_settings()
+    if settings.s3_endpoint_url:
+        return f'{settings.s3_endpoint_url.rstrip("/")}/{settings.s3_bucket}/{key}'
+    return f'https://{settings.s3_bucket}.s3.amazonaws.com/{key}'
+
+
+async def upload_fileobj(fileobj: IO[bytes], key: str,
+                         content_type: Optional[str] = None,
+                         callback: Optional[Callable[[int], None]] = None) -> str:
+    ''' Streaming file object to S3 in parts, off the event loop '''
+
+    extra_args = {'ACL': 'public-read'}
+    if content_type:
+        extra_args['ContentType'] = content_type
+
+    def _upload():
+        get_s3_client().upload_fileobj(
+            fileobj, get_settings().s3_bucket, key,
+            ExtraArgs=extra_args,
+            Config=get_transfer_config(),
+            Callback=callback,
+        )
+
+    await anyio.to_thread.run_sync(_upload, limiter=get_upload_limiter())
+    return object_url(key)
+
+
+def presigned_post(key: str, size: int,
+                   content_type: Optional[str] = None) -> dict:
+    ''' URL and form fields for uploading object by browser with POST '''
+
+    settings = get_settings()
+    fields = {'acl': 'public-read'}
+    conditions = [{'acl': 'public-read'},
+                  ['content-length-range', size, size]]
+    if content_type:
+        fields['Content-Type'] = content_type
+        conditions.append({'Content-Type': content_type})
+    # Signing is local, no request to S3 here
+    return get_s3_client().generate_presigned_post(
+        settings.s3_bucket, key, Fields=fields, Conditions=conditions,
+        ExpiresIn=settings.s3_presign_expires,
+    )
+
+
+async def create_multipart_upload(key: str,
+                                  content_type: Optional[str] = None) -> str:
+    extra_args = {'ACL': 'public-read'}
+    if content_type:
+        extra_args['ContentType'] = content_type
+    response = await anyio.to_thread.run_sync(partial(
+        get_s3_client().create_multipart_upload,
+        Bucket=get_settings().s3_bucket, Key=key, **extra_args,
+    ))
+    return response['UploadId']
+
+
+def presigned_part_urls(key: str, upload_id: str, parts: int) -> List[str]:
+    ''' PUT URLs for parts 1..parts of multipart upload '''
+
+    settings = get_settings()
+    client = get_s3_client()
+    return [
+        client.generate_presigned_url(
+            'upload_part',
+            Params={'Bucket': settings.s3_bucket, 'Key': key,
+                    'UploadId': upload_id, 'PartNumber': number},
+            ExpiresIn=settings.s3_presign_expires,
+        )
+        for number in range(1, parts + 1)
+    ]
+
+
+async def complete_multipart_upload(key: str, upload_id: str,
+                                    parts: List[dict]) -> None:
+    ''' Parts are dicts with `PartNumber` and `ETag` returned by S3 '''
+
+    await anyio.to_thread.run_sync(partial(
+        get_s3_client().complete_multipart_upload,
+        Bucket=get_settings().s3_bucket, Key=key, UploadId=upload_id,
+        MultipartUpload={'Parts': parts},
+    ))
+
+
+async def delete_object(key: str) -> None:
+    await anyio.to_thread.run_sync(partial(
+        get_s3_client().delete_object,
+        Bucket=get_settings().s3_bucket, Key=key,
+    ))
+
+
+async def head_object(key: str) -> Optional[dict]:
+    ''' Object metadata or None if it doesn't exist '''
+
+    from botocore.exceptions import ClientError
+
+    try:
+        return await anyio.to_thread.run_sync(partial(
+            get_s3_client().head_object,
+            Bucket=get_settings().s3_bucket, Key=key,
+        ))
+    except ClientError as error:
+        if error.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey'):
+            return None
+        raise
@@ -0,0 +1,182 @@
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from exceptions import ThrottledError
+from messages import LOGIN_THROTTLED
+from settings import get_settings
+
+try:
+    from redis import asyncio as redis
+except ImportError:  # optional, needed for the redis backend only
+    redis = None
+
+
+class ThrottleBackend:
+    ''' Token buckets: `rate` tokens per second refill up to `burst` '''
+
+    async def take(self, key: str, rate: float, burst: int) -> float:
+        ''' Taking one token, returns seconds to wait if there is none '''
+
+        raise NotImplementedError
+
+    async def refund(self, key: str, rate: float, burst: int) -> None:
+        ''' Returning a taken token '''
+
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        return {}
+
+
+class MemoryBackend(ThrottleBackend):
+    '''
+    Bucket is (tokens, updated at) per key. The least recently used are
+    evicted, they are most likely full again anyway.
+    '''
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.evictions = 0
+        self._buckets: 'OrderedDict[str, Tuple[float, float]]' = OrderedDict()
+
+    async def take(self, key: str, rate: float, burst: int) -> float:
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.pop(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated_at) * rate)
+        retry_after = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            retry_after = (1 - tokens) / rate
+        self._buckets[key] = (tokens, now)
+        while len(self._buckets) > self.maxsize:
+            self._buckets.popitem(last=False)
+            self.evictions += 1
+        return retry_after
+
+    async def refund(self, key: str, rate: float, burst: int) -> None:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            # Evicted, it's full again anyway
+            return
+        tokens, updated_at = bucket
+        self._buckets[key] = (min(burst, tokens + 1), updated_at)
+
+    def stats(self) -> dict:
+        return {
+            'buckets': len(self._buckets),
+            'maxsize': self.maxsize,
+            'evictions': self.evictions,
+        }
+
+
+class RedisBackend(ThrottleBackend):
+    ''' Shared between workers, the bucket is updated by one Lua script '''
+
+    SCRIPT = '''
+        local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+        local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+        local tokens = tonumber(bucket[1]) or burst
+        local updated_at = tonumber(bucket[2]) or now
+        tokens = math.min(burst, tokens + math.max(now - updated_at, 0) * rate)
+        local retry_after = 0
+        if tokens >= 1 then
+            tokens = tokens - 1
+        else
+            retry_after = (1 - tokens) / rate
+        end
+        redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated_at', now)
+        redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000))
+        return tostring(retry_after)
+    '''
+
+    REFUND_SCRIPT = '''
+        local burst = tonumber(ARGV[1])
+        local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens'))
+        if tokens then
+            redis.call('HSET', KEYS[1], 'tokens', math.min(burst, tokens + 1))
+        end
+    '''
+
+    def __init__(self, url: str, prefix: str = 'throttle:'):
+        if redis is None:
+            raise RuntimeError('Redis backend needs `redis` package')
+        self.client = redis.from_url(url)
+        self.script = self.client.register_script(self.SCRIPT)
+        self.refund_script = self.client.register_script(self.REFUND_SCRIPT)
+        self.prefix = prefix
+
+    async def take(self, key: str, rate: float, burst: int) -> float:
+        retry_after = await self.script(keys=[self.prefix + key],
+                                        args=[rate, burst, time.time()])
+        return float(retry_after)
+
+    async def refund(self, key: str, rate: float, burst: int) -> None:
+        await self.refund_script(keys=[self.prefix + key], args=[burst])
+
+
+class LoginThrottle:
+    '''
+    Limits login attempts per client IP and per account. Checked before
+    the user query and password hashing, so rejection costs no DB or CPU.
+
+    Every attempt takes a token from both buckets, bounding concurrent
+    password checks of one account. The account token is returned after
+    successful check, so the owner isn't locked out by own logins.
+    '''
+
+    def __init__(self, backend: ThrottleBackend):
+        self.backend = backend
+        self.allowed = 0
+        self.rejected = 0
+
+    async def check(self, email: str, client_ip: Optional[str] = None) -> None:
+        settings = get_settings()
+        if client_ip and settings.login_ip_per_minute > 0:
+            self.reject_after(await self.backend.take(
+                f'ip:{client_ip}', settings.login_ip_per_minute / 60,
+                settings.login_ip_burst,
+            ))
+        if settings.login_account_per_minute > 0:
+            self.reject_after(await self.backend.take(
+                account_key(email), settings.login_account_per_minute / 60,
+                settings.login_account_burst,
+            ))
+        self.allowed += 1
+
+    async def succeeded(self, email: str) -> None:
+        ''' Refunding the account token after successful credentials check '''
+
+        settings = get_settings()
+        if settings.login_account_per_minute > 0:
+            await self.backend.refund(account_key(email),
+                                      settings.login_account_per_minute / 60,
+                                      settings.login_account_burst)
+
+    def reject_after(self, retry_after: float) -> None:
+        if retry_after > 0:
+            self.rejected += 1
+            raise ThrottledError({**LOGIN_THROTTLED,
+                                  'retry_after': int(retry_after) + 1})
+
+    def stats(self) -> dict:
+        return {
+            'backend': self.backend.stats(),
+            'allowed': self.allowed,
+            'rejected': self.rejected,
+        }
+
+
+def account_key(email: str) -> str:
+    return f'account:{email.strip().lower()}'
+
+
+def get_backend() -> ThrottleBackend:
+    settings = get_settings()
+    if settings.throttle_backend == 'redis':
+        return RedisBackend(settings.throttle_redis_url)
+    return MemoryBackend(settings.throttle_size)
+
+
+login_throttle = LoginThrottle(get_backend())
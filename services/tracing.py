@@ -0,0 +1,112 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from services.metrics import COUNT_BUCKETS, Histogram
+from settings import get_settings
+
+request_duration = Histogram(
+    'graphql_request_duration_seconds', 'GraphQL request duration',
+    labels=['operation'],
+)
+field_duration = Histogram(
+    'graphql_field_duration_seconds', 'GraphQL field resolve duration',
+    labels=['field'],
+)
+span_duration = Histogram(
+    'span_duration_seconds', 'Duration of traced code blocks',
+    labels=['name'],
+)
+sql_duration = Histogram(
+    'db_query_duration_seconds', 'SQL statement duration',
+)
+request_sql_count = Histogram(
+    'graphql_request_sql_queries', 'SQL statements per GraphQL request',
+    buckets=COUNT_BUCKETS,
+)
+
+
+def operation_label(name: Optional[str]) -> str:
+    '''
+    Operation names are chosen by clients, only known ones become label
+    values, so the number of series stays bounded
+    '''
+
+    if not name:
+        return 'anonymous'
+    known = get_settings().graphql_metrics_operations.split(',')
+    return name if name in known else 'other'
+
+
+class RequestTrace:
+    ''' Timings collected during one GraphQL request '''
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.fields: List[Dict] = []
+        self.spans: List[Dict] = []
+        self.sql_count = 0
+        self.sql_duration = 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            'duration': time.perf_counter() - self.started_at,
+            'fields': self.fields,
+            'spans': self.spans,
+            'sql': {'count': self.sql_count, 'duration': self.sql_duration},
+        }
+
+
+current_trace: ContextVar[Optional[RequestTrace]] = ContextVar('current_trace',
+                                                               default=None)
+
+
+@contextmanager
+def span(name: str):
+    ''' Timing code block, e.g. permission check or password hashing '''
+
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - started_at
+        span_duration.observe(duration, name=name)
+        trace = current_trace.get()
+        if trace is not None:
+            trace.spans.append({'name': name, 'duration': duration})
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    conn.info.setdefault('query_started_at', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    duration = time.perf_counter() - conn.info['query_started_at'].pop()
+    sql_duration.observe(duration)
+    trace = current_trace.get()
+    if trace is not None:
+        trace.sql_count += 1
+        trace.sql_duration += duration
+
+
+def _handle_error(exception_context):
+    connection = exception_context.connection
+    if connection is not None and connection.info.get('query_started_at'):
+        connection.info['query_started_at'].pop()
+
+
+def instrument_engine(engine: AsyncEngine) -> None:
+    ''' Counting and timing SQL statements of the engine '''
+
+    sync_engine = engine.sync_engine
+    if not event.contains(sync_engine, 'before_cursor_execute',
+                          _before_cursor_execute):
+        event.listen(sync_engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(sync_engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(sync_engine, 'handle_error', _handle_error)
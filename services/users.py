@@ -1,20 +1,44 @@
+import logging
+import time
 from datetime import datetime, timedelta
-from typing import List
+from itertools import islice
+from typing import (TYPE_CHECKING, Callable, Dict, Iterable, List, Optional,
+                    Sequence, Set)
 
-from sqlalchemy import select
-from sqlalchemy.orm import joinedload
+from sqlalchemy import insert, inspect, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import joinedload, make_transient_to_detached
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from db.models import UserModel
 from exceptions import FoundError, GQLError, ValidationError
-from messages import (INCORRECT_PASSWORD, USER_EXISTS, USER_NOT_ADMIN,
-                      USER_NOT_EXISTS, USER_NOT_ACTIVE)
-from schemas.types import (UserInput, LoginInput,
-                           LoginSuccess, UserType, MessageType,
+from messages import (INCORRECT_PASSWORD, INVALID_TOKEN, REVOKED_TOKEN,
+                      USER_EXISTS, USER_NOT_ADMIN, USER_NOT_EXISTS,
+                      USER_NOT_ACTIVE, WRONG_TOKEN)
+from schemas.types import (BulkCreateResult, Connection, UserInput,
+                           LoginInput, LoginSuccess, UserType, MessageType,
                            RefreshTokenInput)
+from services.cache import LRUCache
+from services.events import USERS_CHANNEL, broker
+from services.pagination import paginate
+from services.revocation import revoke, revoked_tokens
+from services.throttle import login_throttle
 from settings import get_settings
-from utils import (decode_token, get_password_hash, verify_password,
-                   create_access_token)
+from utils import (WorkerPool, check_password, create_access_token,
+                   decode_payload, hash_password, hash_passwords,
+                   password_pool)
+
+if TYPE_CHECKING:
+    from services.loaders import Loaders
+
+logger = logging.getLogger(__name__)
+
+# Verified principals by access token, see `get_current_user`
+principal_cache = LRUCache(maxsize=get_settings().principal_cache_size,
+                           ttl=get_settings().principal_cache_ttl)
+# Last known `UserModel.version` by user id, None for deleted users. Filled
+# from change messages, stale admin session claims are revalidated
+user_versions: Dict[int, Optional[int]] = {}
 
 ## Queries functions ##
 
@@ -32,12 +56,23 @@ async def get(session: AsyncSession, email: str = None,
     return result.scalars().first()
 
 
-async def get_users(session: AsyncSession) -> List[UserType]:
-    ''' Getting list of users '''
+async def get_many(session: AsyncSession, ids: Sequence[int] = (),
+                   emails: Sequence[str] = ()) -> List[UserModel]:
+    ''' Getting users by ids or emails in one query '''
+
+    if ids:
+        condition = UserModel.id.in_([int(user_id) for user_id in ids])
+    else:
+        condition = UserModel.email.in_(list(emails))
+    result = await session.execute(select(UserModel).where(condition))
+    return result.scalars().all()
+
 
-    query = select(UserModel).options(joinedload('*'))
-    result = await session.execute(query.order_by(UserModel.id.asc()))
-    return result.scalars().unique().all()
+async def get_users(session: AsyncSession, first: Optional[int] = None,
+                    after: Optional[str] = None) -> Connection[UserType]:
+    ''' Getting page of users '''
+
+    return await paginate(session, select(UserModel), UserModel, first, after)
 
 ## Mutations functions ##
 
@@ -49,12 +84,93 @@ async def create(data: LoginInput, session: AsyncSession) -> MessageType:
     if user_exists:
         raise ValidationError(USER_EXISTS)
     user = UserModel(email=data.email)
-    user.hashed_password = get_password_hash(password)
+    user.hashed_password = await hash_password(password)
     session.add(user)
     await session.commit()
     return MessageType(message=f'User was created: {user.email}')
 
 
+async def bulk_create(users: Iterable[UserInput], session: AsyncSession,
+                      pool: WorkerPool = password_pool,
+                      batch_size: Optional[int] = None,
+                      concurrency: Optional[int] = None,
+                      progress: Optional[Callable[[BulkCreateResult],
+                                                  None]] = None,
+                      ) -> BulkCreateResult:
+    '''
+    Creating users by batches: one query for duplicates, one insert.
+    At most `concurrency` passwords (half of the pool by default) are
+    hashed at once, so logins sharing the pool keep their slots.
+    '''
+
+    batch_size = batch_size or get_settings().bulk_create_batch_size
+    concurrency = concurrency or max(1, pool.concurrency // 2)
+    result = BulkCreateResult(total=0, created=0, skipped=[])
+    seen = set()
+    users = iter(users)
+    while batch := list(islice(users, batch_size)):
+        result.total += len(batch)
+        new_users = []
+        for user in batch:
+            if user.email in seen:
+                result.skipped.append(user.email)
+            else:
+                seen.add(user.email)
+                new_users.append(user)
+        query = select(UserModel.email).where(
+            UserModel.email.in_([user.email for user in new_users])
+        )
+        existing = set((await session.execute(query)).scalars())
+        result.skipped.extend(user.email for user in new_users
+                              if user.email in existing)
+        new_users = [user for user in new_users if user.email not in existing]
+        if new_users:
+            hashes = iter(await hash_passwords(
+                [user.password for user in new_users if user.password],
+                pool, concurrency,
+            ))
+            rows = [{
+                'email': user.email,
+                'hashed_password': next(hashes) if user.password else None,
+                'first_name': user.first_name,
+                'last_name': user.last_name,
+            } for user in new_users]
+            created = await insert_new_users(session, rows)
+            await session.commit()
+            result.created += len(created)
+            # Emails created concurrently are skipped by the insert
+            result.skipped.extend(row['email'] for row in rows
+                                  if row['email'] not in created)
+        if progress:
+            progress(result)
+    return result
+
+
+async def insert_new_users(session: AsyncSession, rows: List[dict]) -> Set[str]:
+    ''' INSERT ... ON CONFLICT (email) DO NOTHING, returns inserted emails '''
+
+    dialect = session.bind.dialect.name
+    if dialect == 'postgresql':
+        statement = postgresql.insert(UserModel).values(rows) \
+            .on_conflict_do_nothing(index_elements=[UserModel.email]) \
+            .returning(UserModel.email)
+        return set((await session.execute(statement)).scalars())
+
+    def insert_rows(rows: List[dict]):
+        if dialect == 'sqlite':
+            return sqlite.insert(UserModel).values(rows) \
+                .on_conflict_do_nothing(index_elements=[UserModel.email])
+        return insert(UserModel).values(rows)
+
+    # No RETURNING in SQLAlchemy 1.4 for SQLite
+    if (await session.execute(insert_rows(rows))).rowcount == len(rows):
+        return {row['email'] for row in rows}
+    # Some emails were taken concurrently, row counts tell which ones
+    await session.rollback()
+    return {row['email'] for row in rows
+            if (await session.execute(insert_rows([row]))).rowcount}
+
+
 async def update(data: UserInput, session: AsyncSession,
                  user: UserModel) -> UserType:
     ''' Updating user '''
@@ -64,7 +180,7 @@ async def update(data: UserInput, session: AsyncSession,
         if data_dict[arg] != None:
             user.__setattr__(arg, data_dict[arg])
     user.updated_at = datetime.utcnow()
-    await session.commit()
+    await invalidate_principal(user.id, await bump_version(session, user))
     return user
 
 
@@ -73,42 +189,78 @@ async def delete_user(session: AsyncSession, user: UserModel) -> MessageType:
 
     await session.delete(user)
     await session.commit()
+    await invalidate_principal(user.id)
     return MessageType(message=f'User was deleted: {user.email}')
 
 
-async def login(data: LoginInput, session: AsyncSession) -> LoginSuccess:
+async def login(data: LoginInput, session: AsyncSession,
+                loaders: Optional['Loaders'] = None,
+                client_ip: Optional[str] = None) -> LoginSuccess:
     ''' User authentication '''
 
-    user = await get(session, data.email)
+    await login_throttle.check(data.email, client_ip)
+    if loaders:
+        user = await loaders.user_by_email.load(data.email)
+    else:
+        user = await get(session, data.email)
     if not user:
         raise ValidationError(USER_NOT_EXISTS)
-    if not verify_password(data.password, user.hashed_password):
+    if not await check_password(data.password, user.hashed_password):
         raise ValidationError(INCORRECT_PASSWORD)
+    await login_throttle.succeeded(data.email)
     if not user.is_active:
         raise GQLError(USER_NOT_ACTIVE)
     return await create_tokens(user)
 
 
-async def refresh_token(data: RefreshTokenInput,
-                        session: AsyncSession) -> LoginSuccess:
-    ''' Getting new access and refresh tokens '''
+async def refresh_token(data: RefreshTokenInput, session: AsyncSession,
+                        loaders: Optional['Loaders'] = None) -> LoginSuccess:
+    ''' Getting new access and refresh tokens, refresh token is single-use '''
 
-    user_id = decode_token(data.refresh_token)
-    user = await get(session, user_id=user_id)
+    payload = decode_payload(data.refresh_token, token_type='refresh')
+    user_id = payload['user_id']
+    if 'jti' not in payload:
+        # Issued before tokens got ids, it couldn't be used only once
+        raise GQLError(INVALID_TOKEN)
+    if not await revoke(session, payload):
+        # Concurrent refresh with the same token
+        raise GQLError(REVOKED_TOKEN)
+    if loaders:
+        user = await loaders.user_by_id.load(int(user_id))
+    else:
+        user = await get(session, user_id=user_id)
     if user is None:
         raise FoundError(USER_NOT_EXISTS)
     return await create_tokens(user)
 
+
+async def logout(token: str, session: AsyncSession, user: UserModel,
+                 refresh_token: Optional[str] = None) -> MessageType:
+    ''' Revoking current access token and, optionally, refresh token '''
+
+    payloads = [decode_payload(token)]
+    if refresh_token:
+        payloads.append(decode_payload(refresh_token, token_type='refresh'))
+    if any(int(payload['user_id']) != user.id for payload in payloads):
+        raise GQLError(WRONG_TOKEN)
+    for payload in payloads:
+        await revoke(session, payload)
+    principal_cache.pop(token)
+    return MessageType(message=f'User was logged out: {user.email}')
+
 ## Auxiliary functions ##
 
-async def login_admin(data: LoginInput, session: AsyncSession) -> str:
+async def login_admin(data: LoginInput, session: AsyncSession,
+                      client_ip: Optional[str] = None) -> str:
     ''' User authentication: admin panel '''
 
+    await login_throttle.check(data.email, client_ip)
     user = await get(session, data.email)
     if not user:
         raise FoundError(USER_NOT_EXISTS)
-    if not verify_password(data.password, user.hashed_password):
+    if not await check_password(data.password, user.hashed_password):
         raise ValidationError(INCORRECT_PASSWORD)
+    await login_throttle.succeeded(data.email)
     errors = {}
     if not user.is_active:
         errors.update(USER_NOT_ACTIVE)
@@ -124,16 +276,83 @@ async def login_admin(data: LoginInput, session: AsyncSession) -> str:
     )
 
 
-async def get_current_user(token: str, session: AsyncSession) -> UserType:
-    ''' Getting current user by token '''
+async def get_current_user(token: str, session: AsyncSession,
+                           loaders: Optional['Loaders'] = None) -> UserType:
+    ''' Getting current user by token, verified tokens are cached '''
 
-    user_id = decode_token(token)
-    user = await get(session, user_id=user_id)
+    cached = principal_cache.get(token)
+    if cached is not None:
+        jti, principal = cached
+        if jti in revoked_tokens:
+            principal_cache.pop(token)
+            raise GQLError(REVOKED_TOKEN)
+        logger.debug('Principal cache hit', extra={'user_id': principal.id})
+        # Attaching a copy, so the cached instance is never modified
+        return await session.merge(principal, load=False)
+    payload = decode_payload(token)
+    if loaders:
+        user = await loaders.user_by_id.load(int(payload['user_id']))
+    else:
+        user = await get(session, user_id=payload['user_id'])
     if user is None:
         raise FoundError(USER_NOT_EXISTS)
+    logger.debug('Principal cache miss', extra={'user_id': user.id})
+    cache_principal(token, user, payload)
     return user
 
 
+def cache_principal(token: str, user: UserModel, payload: dict) -> None:
+    ''' Storing detached copy of user until token or cache TTL expires '''
+
+    ttl = min(get_settings().principal_cache_ttl, payload['exp'] - time.time())
+    values = {attr.key: getattr(user, attr.key)
+              for attr in inspect(UserModel).column_attrs}
+    principal = UserModel(**values)
+    make_transient_to_detached(principal)
+    principal_cache.set(token, (payload.get('jti'), principal), ttl=ttl,
+                        tags=[('user', user.id)])
+
+
+async def bump_version(session: AsyncSession, user: UserModel) -> int:
+    ''' Committing user changes with the next version '''
+
+    user.version = UserModel.version + 1
+    await session.commit()
+    await session.refresh(user, ['version'])
+    return user.version
+
+
+async def invalidate_principal(user_id: int,
+                               version: Optional[int] = None) -> None:
+    '''
+    Dropping cached principals of user after changing (with new `version`)
+    or deleting, other processes drop them on the published message, see
+    `watch_user_changes`
+    '''
+
+    message = {'user_id': int(user_id), 'version': version}
+    drop_principals(message)
+    await broker.publish(USERS_CHANNEL, message)
+
+
+def drop_principals(message: dict) -> None:
+    principal_cache.invalidate_tag(('user', message['user_id']))
+    user_versions[message['user_id']] = message['version']
+
+
+async def watch_user_changes() -> None:
+    ''' Background task, changes made by other processes come from broker '''
+
+    async for message in broker.subscribe(USERS_CHANNEL):
+        drop_principals(message)
+
+
+def is_current_version(user_id: int, version: Optional[int]) -> bool:
+    ''' Unknown users are current, their claims expire soon anyway '''
+
+    return user_versions.get(int(user_id), version) == version
+
+
 async def create_tokens(user: UserModel) -> LoginSuccess:
     access_token = create_access_token(
         data={"token_type": "access", "user_id": user.id},
@@ -1,6 +1,7 @@
-import os
 from functools import lru_cache
-from pydantic import BaseSettings
+from pydantic import BaseSettings, validator
+
+from services.secrets import secrets_settings
 
 
 class Settings(BaseSettings):
@@ -10,34 +11,167 @@ class Settings(BaseSettings):
     secret_key: str = 'bPVisLCKKyDIkIBVpWIukimDvyxGxVnHoszVijcZwcOLOMAaDeApkyHZuRVWlTHh'
     algorithm: str = 'HS256'
     jwt_header: str = 'Bearer'
+    # PEM keys for asymmetric algorithms (EdDSA, ES256, RS256, ...)
+    jwt_private_key: str = None
+    jwt_public_key: str = None
+    jwt_key_id: str = None
     access_token_expire_minutes: int = 36000
     refresh_token_expire_days: int = 30
 
-    db_host: str = os.getenv('DB_HOST')
-    db_port: str = os.getenv('DB_PORT')
-    db_database: str = os.getenv('DB_DATABASE')
-    db_database_test: str = os.getenv('DB_DATABASE_TEST')
-    db_username: str = os.getenv('DB_USERNAME')
-    db_password: str = os.getenv('DB_PASSWORD')
-    db_url: str = f'postgresql+asyncpg://{db_username}:{db_password}' \
-                  f'@{db_host}:{db_port}/{db_database}'
-    test_db_url: str = f'postgresql://{db_username}:{db_password}' \
-                       f'@{db_host}:{db_port}/{db_database_test}'
+    principal_cache_size: int = 10000
+    principal_cache_ttl: int = 300
+    admin_session_ttl: int = 60
+    revocation_refresh_interval: float = 5
+    revocation_reload_interval: int = 300
+    revocation_rescan_window: int = 1000  # ids read again on every refresh
+
+    # Login attempts, token buckets refilled per minute, 0 disables
+    login_ip_per_minute: float = 30
+    login_ip_burst: int = 10
+    login_account_per_minute: float = 5
+    login_account_burst: int = 5
+    throttle_backend: str = 'memory'  # 'memory' or 'redis'
+    throttle_redis_url: str = 'redis://localhost:6379/0'
+    throttle_size: int = 100000  # buckets kept in memory
+    secrets_reload_interval: float = 60  # see `services/secrets.py`
+
+    password_hash_executor: str = 'thread'  # 'thread' or 'process'
+    password_hash_workers: int = 4
+    password_hash_concurrency: int = 8
+
+    bulk_create_batch_size: int = 500
+    bulk_create_max_users: int = 1000  # per `bulkCreateUsers` mutation
+
+    graphql_document_cache_size: int = 1000
+    graphql_persisted_queries_size: int = 10000
+    graphql_max_cost: int = 1000
+    graphql_max_depth: int = 10
+    # Requests with this header get timings in response `extensions`,
+    # keep empty to disable
+    graphql_trace_header: str = ''
+    # Comma-separated operation names labeled in request metrics,
+    # others are counted as `other`
+    graphql_metrics_operations: str = ''
+
+    compression_minimum_size: int = 500
+    gzip_level: int = 6
+    brotli_quality: int = 4
+    static_max_age: int = 365 * 24 * 3600  # versioned static files
+    info_max_age: int = 300
+
+    result_cache_backend: str = 'memory'  # 'memory' or 'redis'
+    result_cache_redis_url: str = 'redis://localhost:6379/0'
+    result_cache_size: int = 1000
+    result_cache_ttl: float = 30
+    result_cache_stale_ttl: float = 30
+
+    events_backend: str = 'memory'  # 'memory' or 'postgres' (LISTEN/NOTIFY)
+    events_pg_channel: str = 'events'
+    events_queue_size: int = 100  # per subscriber
+    upload_progress_interval: float = 0.2  # seconds between progress events
+
+    # `serve.py` production launcher
+    server_workers: int = 0  # 0 is one per CPU
+    server_max_requests: int = 0  # worker is replaced after, 0 disables
+    server_max_requests_jitter: int = 0  # spreads replacement of workers
+    server_graceful_timeout: float = 30  # seconds before killing worker
+    server_backlog: int = 2048
+
+    page_size_default: int = 20
+    page_size_max: int = 100
+
+    # Fields are read from environment and `.env` when settings are created
+    db_host: str = None
+    db_port: str = None
+    db_database: str = None
+    db_database_test: str = None
+    db_username: str = None
+    db_password: str = None
+    db_url: str = None  # built from the fields above if not set
+    test_db_url: str = None
+
+    db_replica_url: str = None
+    db_replica_sticky_seconds: int = 5
+
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 30
+    db_pool_recycle: int = 1800
+    db_pool_pre_ping: bool = True
+    db_statement_cache_size: int = 100
+    db_statement_timeout: int = 0  # ms, 0 disables
+    db_application_name: str = 'boilerplate'
+    db_warmup_connections: int = 0  # opened at startup, up to pool size
+
+    @validator('db_url', always=True)
+    def build_db_url(cls, value, values):
+        return value or (
+            f'postgresql+asyncpg://{values["db_username"]}:'
+            f'{values["db_password"]}@{values["db_host"]}:'
+            f'{values["db_port"]}/{values["db_database"]}'
+        )
+
+    @validator('test_db_url', always=True)
+    def build_test_db_url(cls, value, values):
+        return value or (
+            f'postgresql://{values["db_username"]}:{values["db_password"]}'
+            f'@{values["db_host"]}:{values["db_port"]}'
+            f'/{values["db_database_test"]}'
+        )
 
     @property
     def alembic_db_url(self) -> str:
         return self.db_url.replace('+asyncpg', '')
 
-    s3_key: str = os.getenv('S3_KEY')
-    s3_secret: str = os.getenv('S3_SECRET')
-    s3_bucket: str = os.getenv('S3_BUCKET')
-    s3_region: str = os.getenv('S3_REGION')
+    s3_key: str = None
+    s3_secret: str = None
+    s3_bucket: str = None
+    s3_region: str = None
+    s3_endpoint_url: str = None  # local stand-in
+    s3_part_size: int = 8 * 1024 * 1024
+    s3_upload_concurrency: int = 4
+    s3_max_uploads: int = 8
+    s3_max_pool_connections: int = 32
+    s3_presign_expires: int = 3600  # seconds, presigned upload URLs
+    s3_max_upload_size: int = 5 * 1024 ** 3
+
+    image_processing: bool = True  # variants of uploaded photos
+    image_workers: int = 2  # processes
+    image_concurrency: int = 4  # images processed at once per app process
+    image_timeout: float = 30
+    image_max_bytes: int = 20 * 1024 * 1024  # bigger files are kept as is
+    image_max_pixels: int = 50_000_000  # decompression bomb guard
+    image_max_side: int = 2048  # converted copies are resized to fit
+    image_thumbnail_size: int = 256
+    image_pixel_size: int = 16  # pixelation block size
+    image_formats: str = 'webp,avif'  # unsupported by Pillow are skipped
+    image_quality: int = 80
+
+    log_level: str = 'INFO'
+    log_queue_size: int = 10000
+    log_trace_limit: int = 20  # innermost traceback frames
+    log_debug_sample_rate: float = 0.01
+    log_duplicate_window: float = 60  # seconds, 0 disables suppression
 
     class Config:
         env_file = ".env"
 
+        @classmethod
+        def customise_sources(cls, init_settings, env_settings,
+                              file_secret_settings):
+            # Environment overrides secrets, e.g. for local runs
+            return (init_settings, env_settings, secrets_settings,
+                    file_secret_settings)
+
 
 @lru_cache
 def get_settings() -> Settings:
     settings = Settings()
     return settings
+
+
+def reload_settings() -> Settings:
+    ''' New settings after secrets rotation, secrets come from the cache '''
+
+    get_settings.cache_clear()
+    return get_settings()
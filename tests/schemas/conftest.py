@@ -0,0 +1,4 @@
+import os
+
+# Schema tests never touch the database from `.env`
+os.environ.setdefault('DB_URL', 'sqlite+aiosqlite://')
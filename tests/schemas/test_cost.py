@@ -0,0 +1,49 @@
+import pytest
+import strawberry
+from graphql import parse
+
+from schemas.cost import document_cost
+from schemas.queries import Query
+from settings import get_settings
+
+
+@pytest.fixture(scope='module')
+def schema():
+    return strawberry.Schema(query=Query)._schema
+
+
+def cost(schema, query: str) -> int:
+    return document_cost(schema, parse(query))[0]
+
+
+def test_page_cost_multiplied(schema):
+    small = cost(schema, '{ usersList(first: 1) { edges { node { id } } } }')
+    big = cost(schema, '{ usersList(first: 10) { edges { node { id } } } }')
+
+    assert big > small
+    assert big - 5 == 10 * (small - 5)  # field weight is not multiplied
+
+
+def test_total_count_once_per_page(schema):
+    edges = '{ usersList(first: 100) { edges { node { id } } } }'
+    with_count = ('{ usersList(first: 100) { totalCount '
+                  'edges { node { id } } } }')
+
+    assert cost(schema, with_count) - cost(schema, edges) == 50
+
+
+def test_aliased_counts_over_budget(schema):
+    # Every alias runs a full table count
+    aliases = ' '.join(f'u{number}: usersList(first: 0) {{ totalCount }}'
+                       for number in range(20))
+
+    assert cost(schema, f'{{ {aliases} }}') > get_settings().graphql_max_cost
+
+
+def test_total_count_in_fragment(schema):
+    query = '''
+        { usersList(first: 100) { ...Page } }
+        fragment Page on UserTypeConnection { totalCount }
+    '''
+
+    assert cost(schema, query) == 5 + 50
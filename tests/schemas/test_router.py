@@ -0,0 +1,61 @@
+import json
+
+import pytest
+import strawberry
+from fastapi import FastAPI
+from starlette.testclient import TestClient
+
+from schemas.documents import query_hash
+from schemas.router import PersistedQueryRouter
+
+
+@strawberry.type
+class Query:
+    @strawberry.field
+    def hello(self) -> str:
+        return 'world'
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.include_router(PersistedQueryRouter(strawberry.Schema(Query)),
+                       prefix='/graphql')
+    return TestClient(app)
+
+
+def test_query(client):
+    response = client.post('/graphql', json={'query': '{ hello }'})
+
+    assert response.json() == {'data': {'hello': 'world'}}
+
+
+@pytest.mark.parametrize('body', [[{'query': '{ hello }'}], 'query', 1, None])
+def test_body_not_object(client, body):
+    response = client.post('/graphql', content=json.dumps(body),
+                           headers={'Content-Type': 'application/json'})
+
+    assert response.status_code == 400
+    assert response.text == 'Unable to parse request body as JSON object'
+
+
+@pytest.mark.parametrize('extensions', ['[1]', '{bad', 1, [1]])
+def test_extensions_not_object(client, extensions):
+    response = client.post('/graphql', json={'query': '{ hello }',
+                                             'extensions': extensions})
+
+    assert response.status_code == 400
+    assert response.text == 'Unable to parse extensions as JSON object'
+
+
+def test_persisted_query(client):
+    query = '{ hello }'
+    extensions = {'persistedQuery': {'version': 1,
+                                     'sha256Hash': query_hash(query)}}
+    client.post('/graphql', json={'query': query, 'extensions': extensions})
+
+    response = client.get('/graphql', params={
+        'extensions': json.dumps(extensions),
+    })
+
+    assert response.json() == {'data': {'hello': 'world'}}
@@ -0,0 +1,89 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from urllib.error import URLError
+from urllib.request import urlopen
+
+import pytest
+from sqlalchemy import create_engine
+
+from db.models import Base
+
+ROOT = Path(__file__).resolve().parents[2]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def db_url(tmp_path):
+    path = tmp_path / 'serve.db'
+    engine = create_engine(f'sqlite:///{path}')
+    Base.metadata.create_all(engine)
+    engine.dispose()
+    return f'sqlite+aiosqlite:///{path}'
+
+
+@contextmanager
+def serve(db_url: str, workers: int = 2):
+    ''' `serve.py` in a subprocess, yields URL of `/info` '''
+
+    port = free_port()
+    env = {**os.environ, 'DB_URL': db_url, 'EVENTS_BACKEND': 'memory',
+           'DB_WARMUP_CONNECTIONS': '2', 'SERVER_GRACEFUL_TIMEOUT': '10'}
+    env.pop('SECRETS_BACKEND', None)
+    process = subprocess.Popen(
+        [sys.executable, 'serve.py', '--port', str(port),
+         '--workers', str(workers)],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        yield process, f'http://127.0.0.1:{port}/info'
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+
+def get(url: str, timeout: float) -> bytes:
+    ''' Retrying until the server answers '''
+
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with urlopen(url, timeout=2) as response:
+                return response.read()
+        except (URLError, OSError):
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
+
+
+def test_serve_and_stop(db_url):
+    with serve(db_url) as (process, url):
+        # Workers connect to the database concurrently at startup
+        for _ in range(4):
+            assert b'app_name' in get(url, timeout=30)
+        process.send_signal(signal.SIGTERM)
+        assert process.wait(timeout=15) == 0
+
+
+def test_rolling_restart(db_url):
+    with serve(db_url) as (process, url):
+        get(url, timeout=30)
+        process.send_signal(signal.SIGHUP)
+        for _ in range(20):
+            assert b'app_name' in get(url, timeout=10)
+            time.sleep(0.1)
+        assert process.poll() is None
+        process.send_signal(signal.SIGTERM)
+        assert process.wait(timeout=15) == 0
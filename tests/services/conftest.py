@@ -0,0 +1,84 @@
+import logging
+import os
+import socket
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+# Services never touch the database from `.env`, see `db_session`
+os.environ.setdefault('DB_URL', 'sqlite+aiosqlite://')
+
+from db.models import Base
+from settings import get_settings
+from services.storage import get_s3_client
+
+BUCKET = 'test-bucket'
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def anyio_backend():
+    return 'asyncio'
+
+
+@pytest.fixture
+async def db_session():
+    """
+    Session of a fresh in-memory database with all tables.
+    """
+    engine = create_async_engine('sqlite+aiosqlite://', poolclass=StaticPool)
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+    try:
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            yield session
+    finally:
+        await engine.dispose()
+
+
+@pytest.fixture(scope='session')
+def s3_server():
+    """
+    Local S3 stand-in (moto server), shared by tests.
+    """
+    from moto.server import ThreadedMotoServer
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    port = free_port()
+    server = ThreadedMotoServer(port=port, verbose=False)
+    server.start()
+    try:
+        yield f'http://127.0.0.1:{port}'
+    finally:
+        server.stop()
+
+
+@pytest.fixture
+def s3(s3_server, monkeypatch):
+    """
+    Settings pointed to the stand-in with an empty bucket, yields S3 client.
+    """
+    monkeypatch.setenv('S3_ENDPOINT_URL', s3_server)
+    monkeypatch.setenv('S3_BUCKET', BUCKET)
+    monkeypatch.setenv('S3_KEY', 'testing')
+    monkeypatch.setenv('S3_SECRET', 'testing')
+    monkeypatch.setenv('S3_REGION', 'us-east-1')
+    get_settings.cache_clear()
+    get_s3_client.cache_clear()
+    client = get_s3_client()
+    client.create_bucket(Bucket=BUCKET)
+    try:
+        yield client
+    finally:
+        objects = client.list_objects_v2(Bucket=BUCKET).get('Contents', [])
+        for item in objects:
+            client.delete_object(Bucket=BUCKET, Key=item['Key'])
+        client.delete_bucket(Bucket=BUCKET)
+        get_settings.cache_clear()
+        get_s3_client.cache_clear()
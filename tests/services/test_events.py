@@ -0,0 +1,27 @@
+import asyncio
+
+import pytest
+
+from services.events import Broker
+
+pytestmark = pytest.mark.anyio
+
+
+class FailingBridge:
+    async def publish(self, channel: str, message: dict) -> None:
+        raise ConnectionError('database is down')
+
+
+async def test_publish_survives_bridge_failure(caplog):
+    broker = Broker(queue_size=10)
+    broker.bridge = FailingBridge()
+    messages = broker.subscribe('files')
+    receiving = asyncio.create_task(messages.__anext__())
+    await asyncio.sleep(0)
+
+    await broker.publish('files', {'id': 1})
+
+    # Delivered locally, the failure is only logged
+    assert await receiving == {'id': 1}
+    assert 'Events bridge publish failed' in caplog.text
+    await messages.aclose()
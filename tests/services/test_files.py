@@ -0,0 +1,145 @@
+import pytest
+import requests
+from sqlalchemy import func, select
+
+from db.models import FileModel, UserModel
+from exceptions import ValidationError
+from messages import UPLOAD_PARTS_INVALID, UPLOAD_SIZE_MISMATCH
+from schemas.types import (ConfirmUploadInput, UploadedPartInput,
+                           UploadUrlInput)
+from services.files import confirm_upload, request_upload
+from services.storage import object_url
+from settings import get_settings
+from utils import decode_payload
+
+pytestmark = pytest.mark.anyio
+
+PART_SIZE = 5 * 1024 * 1024  # S3 minimum
+
+
+@pytest.fixture
+def user():
+    return UserModel(id=1, email='user@example.com')
+
+
+@pytest.fixture
+def part_size(s3, monkeypatch):
+    monkeypatch.setenv('S3_PART_SIZE', str(PART_SIZE))
+    get_settings.cache_clear()
+
+
+def post_file(ticket, data: bytes) -> None:
+    fields = {field.name: field.value for field in ticket.fields}
+    response = requests.post(ticket.url, data=fields,
+                             files={'file': ('hello.txt', data)})
+    response.raise_for_status()
+
+
+def put_parts(ticket, chunks) -> list:
+    parts = []
+    for part, chunk in zip(ticket.parts, chunks):
+        response = requests.put(part.url, data=chunk)
+        response.raise_for_status()
+        parts.append(UploadedPartInput(part_number=part.part_number,
+                                       etag=response.headers['ETag']))
+    return parts
+
+
+async def count_files(session) -> int:
+    return (await session.execute(select(func.count(FileModel.id)))).scalar()
+
+
+async def test_confirm_posted_upload(s3, db_session, user):
+    ticket = await request_upload(
+        UploadUrlInput(file_name='hello.txt', size=5), user
+    )
+    assert ticket.url and not ticket.parts
+    post_file(ticket, b'hello')
+
+    data = ConfirmUploadInput(upload_token=ticket.upload_token)
+    added = await confirm_upload(data, db_session, user)
+
+    key = decode_payload(ticket.upload_token, 'upload')['key']
+    assert added.file_name == 'hello.txt'
+    assert added.file_url == object_url(key)
+    # Repeated confirmation doesn't store it twice
+    assert (await confirm_upload(data, db_session, user)).id == added.id
+    assert await count_files(db_session) == 1
+
+
+async def test_confirm_posted_upload_size_mismatch(s3, db_session, user):
+    ticket = await request_upload(
+        UploadUrlInput(file_name='hello.txt', size=5), user
+    )
+    key = decode_payload(ticket.upload_token, 'upload')['key']
+    s3.put_object(Bucket=get_settings().s3_bucket, Key=key, Body=b'hi')
+
+    with pytest.raises(ValidationError) as error:
+        await confirm_upload(
+            ConfirmUploadInput(upload_token=ticket.upload_token),
+            db_session, user,
+        )
+
+    assert error.value.extensions['explain'] == UPLOAD_SIZE_MISMATCH
+    assert await count_files(db_session) == 0
+    listed = s3.list_objects_v2(Bucket=get_settings().s3_bucket, Prefix=key)
+    assert listed['KeyCount'] == 0  # not left in the bucket
+
+
+async def test_confirm_multipart_upload(part_size, db_session, s3, user):
+    size = PART_SIZE + 10
+    ticket = await request_upload(
+        UploadUrlInput(file_name='big.bin', size=size), user
+    )
+    assert ticket.url is None and len(ticket.parts) == 2
+    parts = put_parts(ticket, [b'x' * PART_SIZE, b'x' * 10])
+
+    added = await confirm_upload(
+        ConfirmUploadInput(upload_token=ticket.upload_token, parts=parts),
+        db_session, user,
+    )
+
+    key = decode_payload(ticket.upload_token, 'upload')['key']
+    head = s3.head_object(Bucket=get_settings().s3_bucket, Key=key)
+    assert head['ContentLength'] == size
+    assert added.file_url == object_url(key)
+    assert await count_files(db_session) == 1
+
+
+async def test_confirm_multipart_upload_size_mismatch(part_size, db_session,
+                                                      s3, user):
+    ticket = await request_upload(
+        UploadUrlInput(file_name='big.bin', size=PART_SIZE + 10), user
+    )
+    parts = put_parts(ticket, [b'x' * PART_SIZE, b'x' * 5])
+
+    with pytest.raises(ValidationError) as error:
+        await confirm_upload(
+            ConfirmUploadInput(upload_token=ticket.upload_token, parts=parts),
+            db_session, user,
+        )
+
+    assert error.value.extensions['explain'] == UPLOAD_SIZE_MISMATCH
+    assert await count_files(db_session) == 0
+    key = decode_payload(ticket.upload_token, 'upload')['key']
+    listed = s3.list_objects_v2(Bucket=get_settings().s3_bucket, Prefix=key)
+    assert listed['KeyCount'] == 0
+
+
+async def test_confirm_multipart_upload_wrong_parts(part_size, db_session,
+                                                    user):
+    ticket = await request_upload(
+        UploadUrlInput(file_name='big.bin', size=PART_SIZE + 10), user
+    )
+    put_parts(ticket, [b'x' * PART_SIZE, b'x' * 10])
+    parts = [UploadedPartInput(part_number=number, etag='"0"')
+             for number in (1, 2)]
+
+    with pytest.raises(ValidationError) as error:
+        await confirm_upload(
+            ConfirmUploadInput(upload_token=ticket.upload_token, parts=parts),
+            db_session, user,
+        )
+
+    assert error.value.extensions['explain'] == UPLOAD_PARTS_INVALID
+    assert await count_files(db_session) == 0
@@ -0,0 +1,33 @@
+import io
+
+import pytest
+from PIL import Image
+
+from services.images import ImageOptions, process_image
+
+
+def png(width: int, height: int) -> bytes:
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), 'red').save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def options(max_pixels: int) -> ImageOptions:
+    return ImageOptions(max_pixels=max_pixels, max_side=64, thumbnail_size=16,
+                        pixel_size=4, formats=('JPEG',), quality=80)
+
+
+def test_process_image():
+    variants, timings = process_image(png(100, 50), options(100 * 50))
+
+    sizes = {variant.name: (variant.width, variant.height)
+             for variant in variants}
+    assert sizes == {'thumbnail': (16, 8), 'pixelated': (64, 32),
+                     'jpeg': (64, 32)}
+    assert 'decode' in timings
+
+
+def test_process_image_over_max_pixels():
+    # Below twice the limit Pillow itself only warns
+    with pytest.raises(Image.DecompressionBombError):
+        process_image(png(100, 50), options(100 * 50 - 1))
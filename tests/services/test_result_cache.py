@@ -0,0 +1,49 @@
+import asyncio
+
+import pytest
+
+from services.result_cache import MemoryBackend, ResultCache
+
+pytestmark = pytest.mark.anyio
+
+
+def make_cache() -> ResultCache:
+    return ResultCache(MemoryBackend(maxsize=10), ttl=60, stale_ttl=60)
+
+
+async def test_invalidation_reaches_other_caches():
+    # Caches of two processes, the broker is shared
+    cache, other = make_cache(), make_cache()
+    watcher = asyncio.create_task(other.watch_invalidations())
+    await asyncio.sleep(0)
+    counter = iter(range(100))
+
+    async def compute(session):
+        return next(counter)
+
+    try:
+        first = await other.get_or_set('files', {}, compute, None,
+                                       tags=['files'])
+        assert await other.get_or_set('files', {}, compute, None,
+                                      tags=['files']) == first
+
+        await cache.invalidate('files')
+        await asyncio.sleep(0)
+
+        assert await other.get_or_set('files', {}, compute, None,
+                                      tags=['files']) != first
+    finally:
+        watcher.cancel()
+
+
+async def test_invalidation_of_other_tags_keeps_entries():
+    cache = make_cache()
+
+    async def compute(session):
+        return object()
+
+    value = await cache.get_or_set('files', {}, compute, None, tags=['files'])
+    await cache.invalidate('users')
+
+    assert await cache.get_or_set('files', {}, compute, None,
+                                  tags=['files']) is value
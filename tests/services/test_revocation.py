@@ -0,0 +1,145 @@
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from db.models import RevokedTokenModel, UserModel
+from exceptions import GQLError
+from messages import INVALID_TOKEN, REVOKED_TOKEN
+from schemas.types import RefreshTokenInput
+from services.revocation import RevocationList, revoked_tokens
+from services.users import (get_current_user, logout, principal_cache,
+                            refresh_token)
+from settings import get_settings
+from tokens import get_token_engine
+from utils import create_access_token, decode_payload
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def user(db_session):
+    user = UserModel(email='user@example.com', hashed_password='-')
+    db_session.add(user)
+    await db_session.commit()
+    yield user
+    principal_cache.clear()
+
+
+def access_token(user: UserModel) -> str:
+    return create_access_token({'token_type': 'access', 'user_id': user.id},
+                               timedelta(minutes=5))
+
+
+def revoked_row(row_id: int, jti: str, expires_in: float = 60
+                ) -> RevokedTokenModel:
+    return RevokedTokenModel(
+        id=row_id, jti=jti, user_id=1,
+        expires_at=datetime.utcnow() + timedelta(seconds=expires_in),
+    )
+
+
+async def test_revoked_token_rejected(user):
+    token = access_token(user)
+    payload = decode_payload(token)
+
+    revoked_tokens.add(payload['jti'], payload['exp'])
+
+    with pytest.raises(GQLError) as error:
+        decode_payload(token)
+    assert error.value.extensions['explain'] == REVOKED_TOKEN
+
+
+async def test_revoked_token_rejected_on_cache_hit(db_session, user):
+    token = access_token(user)
+    assert (await get_current_user(token, db_session)).id == user.id
+    assert principal_cache.get(token) is not None
+
+    await logout(token, db_session, user)
+
+    with pytest.raises(GQLError) as error:
+        await get_current_user(token, db_session)
+    assert error.value.extensions['explain'] == REVOKED_TOKEN
+
+
+async def test_refresh_token_is_single_use(db_session, user):
+    token = create_access_token({'token_type': 'refresh', 'user_id': user.id},
+                                timedelta(days=1))
+    data = RefreshTokenInput(refresh_token=token)
+
+    assert (await refresh_token(data, db_session)).access_token
+
+    with pytest.raises(GQLError) as error:
+        await refresh_token(data, db_session)
+    assert error.value.extensions['explain'] == REVOKED_TOKEN
+
+
+async def test_refresh_token_without_id_rejected(db_session, user):
+    token = create_access_token({'token_type': 'refresh', 'user_id': user.id},
+                                timedelta(days=1))
+    claims = decode_payload(token, 'refresh')
+    del claims['jti']
+    # As issued before tokens got ids
+    token = get_token_engine().encode(claims)
+
+    with pytest.raises(GQLError) as error:
+        await refresh_token(RefreshTokenInput(refresh_token=token), db_session)
+    assert error.value.extensions['explain'] == INVALID_TOKEN
+
+
+async def test_refresh_picks_up_late_commits(db_session):
+    tokens = RevocationList()
+    db_session.add_all([revoked_row(1, 'a'), revoked_row(3, 'c')])
+    await db_session.commit()
+    assert await tokens.refresh(db_session) == 2
+    assert tokens.last_id == 3
+
+    # Lower id committed after the refresh
+    db_session.add(revoked_row(2, 'b'))
+    await db_session.commit()
+
+    assert await tokens.refresh(db_session) == 1
+    assert 'b' in tokens
+
+
+async def test_late_commits_out_of_window_picked_up_by_reload(db_session,
+                                                              monkeypatch):
+    monkeypatch.setenv('REVOCATION_RESCAN_WINDOW', '1')
+    get_settings.cache_clear()
+    tokens = RevocationList()
+    try:
+        db_session.add_all([revoked_row(1, 'a'), revoked_row(5, 'e')])
+        await db_session.commit()
+        await tokens.refresh(db_session)
+        db_session.add(revoked_row(2, 'b'))
+        await db_session.commit()
+
+        assert await tokens.refresh(db_session) == 0
+        await tokens.reload(db_session)
+        assert 'b' in tokens
+    finally:
+        get_settings.cache_clear()
+
+
+async def test_reload_drops_expired(db_session):
+    tokens = RevocationList()
+    db_session.add_all([revoked_row(1, 'old', expires_in=-60),
+                        revoked_row(2, 'new')])
+    await db_session.commit()
+    await tokens.refresh(db_session)
+    assert 'old' in tokens
+
+    await tokens.reload(db_session)
+
+    assert 'old' not in tokens and 'new' in tokens
+    assert tokens.last_id == 2
+
+
+async def test_revoked_locally_kept_by_reload(db_session):
+    tokens = RevocationList()
+    # Revoked by this process, not yet committed when reload queried
+    tokens.add('pending', int(time.time()) + 60)
+
+    await tokens.reload(db_session)
+
+    assert 'pending' in tokens
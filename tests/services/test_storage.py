@@ -0,0 +1,44 @@
+import io
+
+import pytest
+
+from services.storage import (get_s3_client, get_transfer_config, object_url,
+                              upload_fileobj)
+from settings import get_settings
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_upload_fileobj(s3):
+    url = await upload_fileobj(io.BytesIO(b'hello'), 'files/hello.txt',
+                               'text/plain')
+
+    assert url == object_url('files/hello.txt')
+    stored = s3.get_object(Bucket=get_settings().s3_bucket,
+                           Key='files/hello.txt')
+    assert stored['Body'].read() == b'hello'
+    assert stored['ContentType'] == 'text/plain'
+
+
+async def test_upload_fileobj_in_parts(s3, monkeypatch):
+    part_size = 5 * 1024 * 1024  # S3 minimum
+    monkeypatch.setenv('S3_PART_SIZE', str(part_size))
+    get_settings.cache_clear()
+    get_transfer_config.cache_clear()
+    data = b'x' * (part_size + 10)
+    uploaded = []
+    try:
+        await upload_fileobj(io.BytesIO(data), 'files/big.bin',
+                             callback=uploaded.append)
+    finally:
+        get_transfer_config.cache_clear()
+
+    head = s3.head_object(Bucket=get_settings().s3_bucket,
+                          Key='files/big.bin')
+    assert head['ContentLength'] == len(data)
+    assert head['ETag'].endswith('-2"')  # multipart upload of two parts
+    assert sum(uploaded) == len(data)
+
+
+async def test_client_is_shared(s3):
+    assert get_s3_client() is s3
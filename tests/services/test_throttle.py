@@ -0,0 +1,129 @@
+import pytest
+from starlette.testclient import TestClient
+
+from exceptions import ThrottledError
+from services import throttle
+from services.throttle import LoginThrottle, MemoryBackend
+from settings import get_settings
+
+pytestmark = pytest.mark.anyio
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(throttle.time, 'monotonic', clock)
+    return clock
+
+
+@pytest.fixture
+def limits(monkeypatch):
+    ''' Two attempts per account, refilled one per 10 seconds '''
+
+    monkeypatch.setenv('LOGIN_ACCOUNT_PER_MINUTE', '6')
+    monkeypatch.setenv('LOGIN_ACCOUNT_BURST', '2')
+    monkeypatch.setenv('LOGIN_IP_PER_MINUTE', '0')
+    get_settings.cache_clear()
+    yield
+    get_settings.cache_clear()
+
+
+async def test_bucket_burst_and_retry_after(clock):
+    backend = MemoryBackend(maxsize=10)
+
+    assert await backend.take('key', rate=0.5, burst=2) == 0
+    assert await backend.take('key', rate=0.5, burst=2) == 0
+    # No tokens left, one comes in 1 / rate seconds
+    assert await backend.take('key', rate=0.5, burst=2) == pytest.approx(2)
+
+
+async def test_bucket_refill(clock):
+    backend = MemoryBackend(maxsize=10)
+    for _ in range(2):
+        await backend.take('key', rate=0.5, burst=2)
+
+    clock.now += 2
+    assert await backend.take('key', rate=0.5, burst=2) == 0
+    assert await backend.take('key', rate=0.5, burst=2) > 0
+
+    # Refilled up to burst only
+    clock.now += 100
+    for _ in range(2):
+        assert await backend.take('key', rate=0.5, burst=2) == 0
+    assert await backend.take('key', rate=0.5, burst=2) > 0
+
+
+async def test_bucket_lru_eviction(clock):
+    backend = MemoryBackend(maxsize=2)
+    await backend.take('a', rate=1, burst=1)
+    await backend.take('b', rate=1, burst=1)
+    # Recently used `a` is kept
+    assert await backend.take('a', rate=1, burst=1) > 0
+
+    await backend.take('c', rate=1, burst=1)
+
+    assert backend.stats() == {'buckets': 2, 'maxsize': 2, 'evictions': 1}
+    # Evicted `b` starts full again
+    assert await backend.take('b', rate=1, burst=1) == 0
+
+
+async def test_refund(clock):
+    backend = MemoryBackend(maxsize=10)
+    await backend.take('key', rate=1, burst=1)
+
+    await backend.refund('key', rate=1, burst=1)
+    await backend.refund('key', rate=1, burst=1)
+
+    assert await backend.take('key', rate=1, burst=1) == 0
+    assert await backend.take('key', rate=1, burst=1) > 0
+
+
+async def test_concurrent_attempts_bounded(clock, limits):
+    login_throttle = LoginThrottle(MemoryBackend(maxsize=10))
+
+    # Checks in flight from different IPs, none finished yet
+    for number in range(2):
+        await login_throttle.check('user@example.com', f'10.0.0.{number}')
+    with pytest.raises(ThrottledError) as error:
+        await login_throttle.check('User@Example.com ', '10.0.0.9')
+
+    assert error.value.extensions['explain']['retry_after'] == 11
+    assert login_throttle.stats()['rejected'] == 1
+
+
+async def test_successful_logins_refunded(clock, limits):
+    login_throttle = LoginThrottle(MemoryBackend(maxsize=10))
+
+    for _ in range(10):
+        await login_throttle.check('user@example.com')
+        await login_throttle.succeeded('user@example.com')
+
+    # Failed attempts still count
+    for _ in range(2):
+        await login_throttle.check('user@example.com')
+    with pytest.raises(ThrottledError):
+        await login_throttle.check('user@example.com')
+
+
+async def test_token_endpoint_retry_after(clock, limits, monkeypatch):
+    from main import app
+
+    monkeypatch.setattr(throttle.login_throttle, 'backend',
+                        MemoryBackend(maxsize=10))
+    for _ in range(2):
+        await throttle.login_throttle.check('user@example.com')
+
+    response = TestClient(app).post('/token', data={
+        'username': 'user@example.com', 'password': 'password',
+    })
+
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '11'
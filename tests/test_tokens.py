@@ -0,0 +1,189 @@
+import json
+import time
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import ed25519
+from jose import jwt as jose_jwt
+from jwt import DecodeError, ExpiredSignatureError, InvalidSignatureError
+from jwt.utils import base64url_decode, base64url_encode
+
+from settings import get_settings
+from tokens import (TokenEngine, get_token_engine, rotate_token_engine,
+                    token_lifetime)
+
+SECRET = 'old-secret-' * 4
+NEW_SECRET = 'new-secret-' * 4
+
+
+def segments(token: str) -> list:
+    return token.split('.')
+
+
+@pytest.fixture
+def engine():
+    return TokenEngine('HS256', SECRET, SECRET, 'old')
+
+
+@pytest.fixture
+def settings(monkeypatch):
+    ''' HS256 settings with `SECRET`, token engine built from them '''
+
+    monkeypatch.setenv('SECRET_KEY', SECRET)
+    monkeypatch.setenv('ALGORITHM', 'HS256')
+    monkeypatch.setenv('SECRETS_RELOAD_INTERVAL', '60')
+    monkeypatch.delenv('JWT_KEY_ID', raising=False)
+    get_settings.cache_clear()
+    get_token_engine.cache_clear()
+    yield monkeypatch
+    get_settings.cache_clear()
+    get_token_engine.cache_clear()
+
+
+def rotate(monkeypatch, secret: str) -> TokenEngine:
+    monkeypatch.setenv('SECRET_KEY', secret)
+    get_settings.cache_clear()
+    return rotate_token_engine()
+
+
+def test_round_trip(engine):
+    token = engine.encode({'user_id': 1, 'exp': time.time() + 60})
+
+    assert engine.decode(token)['user_id'] == 1
+
+
+@pytest.mark.parametrize('algorithm', ['HS384', 'HS512', 'none'])
+def test_algorithm_mismatch(engine, algorithm):
+    # Properly signed, but not with the algorithm of the key
+    token = jwt.encode({'user_id': 1}, SECRET if algorithm != 'none' else None,
+                       algorithm=algorithm, headers={'kid': 'old'})
+
+    with pytest.raises(InvalidSignatureError):
+        engine.decode(token)
+
+
+def test_unknown_key_id(engine):
+    token = jwt.encode({'user_id': 1}, SECRET, algorithm='HS256',
+                       headers={'kid': 'other'})
+
+    with pytest.raises(InvalidSignatureError):
+        engine.decode(token)
+
+
+def test_missing_key_id_uses_current_key(engine):
+    token = jwt.encode({'user_id': 1}, SECRET, algorithm='HS256')
+
+    assert engine.decode(token)['user_id'] == 1
+    other = TokenEngine('HS256', NEW_SECRET, NEW_SECRET, 'new')
+    with pytest.raises(InvalidSignatureError):
+        other.decode(token)
+
+
+def test_expired(engine):
+    token = engine.encode({'user_id': 1, 'exp': int(time.time()) - 1})
+
+    with pytest.raises(ExpiredSignatureError):
+        engine.decode(token)
+
+
+def test_invalid_expiration(engine):
+    token = engine.encode({'user_id': 1, 'exp': 'never'})
+
+    with pytest.raises(DecodeError):
+        engine.decode(token)
+
+
+def test_tampered_payload(engine):
+    header, _, signature = segments(engine.encode({'user_id': 1}))
+    payload = base64url_encode(json.dumps({'user_id': 2}).encode()).decode()
+
+    with pytest.raises(InvalidSignatureError):
+        engine.decode('.'.join([header, payload, signature]))
+
+
+def test_tampered_signature(engine):
+    header, payload, signature = segments(engine.encode({'user_id': 1}))
+    signature = ('A' if signature[0] != 'A' else 'B') + signature[1:]
+
+    with pytest.raises(InvalidSignatureError):
+        engine.decode('.'.join([header, payload, signature]))
+
+
+@pytest.mark.parametrize('token', ['', 'abc', 'a.b', 'a.b.c', '..'])
+def test_malformed(engine, token):
+    with pytest.raises(DecodeError):
+        engine.decode(token)
+
+
+def test_legacy_jose_token(settings):
+    # Issued by python-jose before the token engine, without `kid`
+    token = jose_jwt.encode({'user_id': 1, 'exp': int(time.time()) + 60},
+                            SECRET, algorithm='HS256')
+
+    assert get_token_engine().decode(token)['user_id'] == 1
+
+
+def test_asymmetric_jwks():
+    key = ed25519.Ed25519PrivateKey.generate()
+    engine = TokenEngine('EdDSA', key, key.public_key(), 'ed-1')
+
+    keys = engine.jwks()['keys']
+    assert [(item['kid'], item['alg']) for item in keys] == [('ed-1', 'EdDSA')]
+    assert engine.decode(engine.encode({'user_id': 1}))['user_id'] == 1
+
+
+def test_hs_keys_not_published(engine):
+    assert engine.jwks() == {'keys': []}
+
+
+def test_rotation_handover(settings):
+    old_engine = get_token_engine()
+    old_token = old_engine.encode({'user_id': 1})
+
+    engine = rotate(settings, NEW_SECRET)
+
+    assert engine.key_id != old_engine.key_id
+    # Signed with the previous key, workers that haven't rotated accept it
+    handover_token = engine.encode({'user_id': 2})
+    assert old_engine.decode(handover_token)['user_id'] == 2
+    assert engine.decode(handover_token)['user_id'] == 2
+    assert engine.decode(old_token)['user_id'] == 1
+
+
+def test_rotation_after_handover(settings):
+    old_engine = get_token_engine()
+    engine = rotate(settings, NEW_SECRET)
+    reload_interval = get_settings().secrets_reload_interval
+
+    later = time.time() + reload_interval + 1
+    settings.setattr('tokens.time.time', lambda: later)
+    token = engine.encode({'user_id': 1})
+
+    assert segments(token)[0] != segments(old_engine.encode({}))[0]
+    assert engine.decode(token)['user_id'] == 1
+    with pytest.raises(InvalidSignatureError):
+        old_engine.decode(token)
+
+
+def test_retired_key_lifetime(settings):
+    old_token = get_token_engine().encode({'user_id': 1})
+    engine = rotate(settings, NEW_SECRET)
+    current = get_settings()
+    kept = token_lifetime(current) + current.secrets_reload_interval
+    now = time.time()
+
+    settings.setattr('tokens.time.time', lambda: now + kept - 10)
+    assert engine.decode(old_token)['user_id'] == 1
+    settings.setattr('tokens.time.time', lambda: now + kept + 10)
+    with pytest.raises(InvalidSignatureError):
+        engine.decode(old_token)
+
+
+def test_rotation_of_other_secrets_keeps_keys(settings):
+    old_token = get_token_engine().encode({'user_id': 1})
+    engine = rotate(settings, NEW_SECRET)
+    # E.g. DB password rotated, the JWT key is the same
+    engine = rotate(settings, NEW_SECRET)
+
+    assert engine.decode(old_token)['user_id'] == 1
+    assert get_token_engine().decode(engine.encode({'user_id': 2}))
@@ -0,0 +1,201 @@
+'''
+JWT signing and verification with keys prepared once per process.
+
+HS* algorithms use `secret_key`. Asymmetric ones (EdDSA, ES256, RS256, ...)
+use PEM keys from settings, so other services can verify tokens locally
+with the public key from `/.well-known/jwks.json`.
+
+Tokens carry `kid` of the signing key (`jwt_key_id` or derived from the
+key). After secrets rotation previous keys still verify tokens for their
+whole lifetime, and new tokens are signed with the previous key until all
+workers have picked up the new one.
+'''
+import hashlib
+import json
+import logging
+import time
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple
+
+from jwt import DecodeError, ExpiredSignatureError, InvalidSignatureError
+from jwt.algorithms import get_default_algorithms
+from jwt.utils import base64url_decode, base64url_encode
+
+from settings import Settings, get_settings
+
+logger = logging.getLogger(__name__)
+
+_json_encoder = json.JSONEncoder(separators=(',', ':'))
+
+
+class TokenEngine:
+    def __init__(self, algorithm: str, signing_key, verifying_key,
+                 key_id: Optional[str] = None):
+        self.algorithm = algorithm
+        self.key_id = key_id
+        self._algorithm = get_default_algorithms()[algorithm]
+        self._signing_key = self._algorithm.prepare_key(signing_key)
+        self._verifying_key = self._algorithm.prepare_key(verifying_key)
+        header = {'alg': algorithm, 'typ': 'JWT'}
+        if key_id:
+            header['kid'] = key_id
+        self._header = base64url_encode(_json_encoder.encode(header).encode())
+        # Keys of previous rotations by kid:
+        # (algorithm name, algorithm, key, dropped at)
+        self._retired: Dict[Optional[str], Tuple[str, Any, Any, float]] = {}
+        # Previous signing key until workers know the new one:
+        # (header, algorithm, key, switched at)
+        self._handover: Optional[Tuple[bytes, Any, Any, float]] = None
+
+    @classmethod
+    def from_settings(cls) -> 'TokenEngine':
+        settings = get_settings()
+        algorithm = get_default_algorithms()[settings.algorithm]
+        if settings.algorithm.startswith('HS'):
+            signing_key = verifying_key = settings.secret_key
+        else:
+            signing_key = algorithm.prepare_key(settings.jwt_private_key)
+            verifying_key = (settings.jwt_public_key
+                             or signing_key.public_key())
+        key_id = settings.jwt_key_id or key_fingerprint(
+            algorithm, algorithm.prepare_key(verifying_key)
+        )
+        return cls(settings.algorithm, signing_key, verifying_key, key_id)
+
+    def keep_keys(self, previous: 'TokenEngine', retain: float,
+                  handover: float) -> None:
+        '''
+        Taking over keys of the engine before rotation: its verifying keys
+        are kept for `retain` seconds, its signing key is used for `handover`
+        seconds more
+        '''
+
+        now = time.time()
+        self._retired = {
+            key_id: retired for key_id, retired in previous._retired.items()
+            if key_id != self.key_id and retired[3] > now
+        }
+        if previous.key_id == self.key_id:
+            # Other secrets rotated, or the key without changing its id
+            if (key_fingerprint(previous._algorithm, previous._verifying_key)
+                    != key_fingerprint(self._algorithm, self._verifying_key)):
+                logger.warning('JWT key changed but key id %r is the same, '
+                               'tokens of the previous key are rejected',
+                               self.key_id)
+                return
+            self._handover = previous._handover
+            return
+        self._retired[previous.key_id] = (
+            previous.algorithm, previous._algorithm, previous._verifying_key,
+            now + retain,
+        )
+        self._handover = (previous._header, previous._algorithm,
+                          previous._signing_key, now + handover)
+
+    def encode(self, claims: dict) -> str:
+        header, algorithm, key = (self._header, self._algorithm,
+                                  self._signing_key)
+        if self._handover is not None:
+            if self._handover[3] > time.time():
+                header, algorithm, key, _ = self._handover
+            else:
+                self._handover = None
+        payload = base64url_encode(_json_encoder.encode(claims).encode())
+        signing_input = header + b'.' + payload
+        signature = algorithm.sign(signing_input, key)
+        return (signing_input + b'.' + base64url_encode(signature)).decode()
+
+    def decode(self, token: str) -> dict:
+        ''' Verified claims, raises PyJWT errors like `jwt.decode` '''
+
+        try:
+            signing_input, signature = token.encode().rsplit(b'.', 1)
+            header, payload = signing_input.split(b'.', 1)
+            header = json.loads(base64url_decode(header))
+            claims = json.loads(base64url_decode(payload))
+            signature = base64url_decode(signature)
+        except (ValueError, TypeError) as e:
+            raise DecodeError('Invalid token') from e
+        if not isinstance(header, dict) or not isinstance(claims, dict):
+            raise DecodeError('Invalid token')
+        key_id = header.get('kid', self.key_id)
+        if key_id == self.key_id:
+            name, algorithm, key = (self.algorithm, self._algorithm,
+                                    self._verifying_key)
+        else:
+            retired = self._retired.get(key_id)
+            if retired is None or retired[3] <= time.time():
+                raise InvalidSignatureError('Unknown key id')
+            name, algorithm, key, _ = retired
+        # Never trust `alg` from the token itself
+        if header.get('alg') != name:
+            raise InvalidSignatureError('Unexpected algorithm')
+        if not algorithm.verify(signing_input, key, signature):
+            raise InvalidSignatureError('Signature verification failed')
+        exp = claims.get('exp')
+        if exp is not None:
+            if not isinstance(exp, (int, float)):
+                raise DecodeError('Expiration Time claim (exp) must be a number')
+            if exp <= time.time():
+                raise ExpiredSignatureError('Signature has expired')
+        return claims
+
+    def jwks(self) -> Dict:
+        '''
+        Public key set for local verification, with keys of previous
+        rotations, HS* keys are never published
+        '''
+
+        now = time.time()
+        verifying = [(self.key_id, self.algorithm, self._algorithm,
+                      self._verifying_key)]
+        verifying += [(key_id, name, algorithm, key) for key_id,
+                      (name, algorithm, key, dropped_at)
+                      in self._retired.items() if dropped_at > now]
+        keys = []
+        for key_id, name, algorithm, verifying_key in verifying:
+            if name.startswith('HS'):
+                continue
+            key = json.loads(algorithm.to_jwk(verifying_key))
+            key.update({'alg': name, 'use': 'sig'})
+            if key_id:
+                key['kid'] = key_id
+            keys.append(key)
+        return {'keys': keys}
+
+
+def key_fingerprint(algorithm, key) -> str:
+    ''' Key id derived from the (verifying) key itself '''
+
+    return hashlib.sha256(algorithm.to_jwk(key).encode()).hexdigest()[:16]
+
+
+def token_lifetime(settings: Settings) -> float:
+    ''' Longest lifetime of issued tokens, seconds '''
+
+    return max(settings.access_token_expire_minutes * 60,
+               settings.refresh_token_expire_days * 86400,
+               2 * settings.s3_presign_expires)
+
+
+@lru_cache
+def get_token_engine() -> TokenEngine:
+    return TokenEngine.from_settings()
+
+
+def rotate_token_engine() -> TokenEngine:
+    '''
+    Engine with rotated keys. Tokens of the previous key stay valid for
+    their lifetime; it also signs new tokens for one secrets reload
+    interval, so workers that haven't reloaded yet can verify them
+    '''
+
+    previous = get_token_engine()
+    get_token_engine.cache_clear()
+    engine = get_token_engine()
+    settings = get_settings()
+    engine.keep_keys(previous,
+                     retain=token_lifetime(settings)
+                     + settings.secrets_reload_interval,
+                     handover=settings.secrets_reload_interval)
+    return engine
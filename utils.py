@@ -1,12 +1,19 @@
-from datetime import datetime, timedelta
-from typing import Union
+import asyncio
+import time
+import uuid
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import timedelta
+from typing import Any, Callable, List, Optional, Union
 
-from jose import jwt, ExpiredSignatureError, JWTError
+from jwt import ExpiredSignatureError, InvalidTokenError
 from passlib.context import CryptContext
 
 from exceptions import AuthenticationError, FoundError, GQLError
-from messages import INVALID_TOKEN, USER_NOT_EXISTS, WRONG_TOKEN
+from messages import INVALID_TOKEN, REVOKED_TOKEN, USER_NOT_EXISTS, WRONG_TOKEN
+from services.revocation import revoked_tokens
+from services.tracing import span
 from settings import get_settings
+from tokens import get_token_engine
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -22,29 +29,133 @@ def verify_password(plain_password, hashed_password):
         return False
 
 
+class WorkerPool:
+    ''' Bounded executor for CPU-bound work, keeps it off the event loop '''
+
+    def __init__(self, name: str, kind: str, workers: int, concurrency: int):
+        self.name = name
+        self.kind = kind
+        self.workers = workers
+        self.concurrency = concurrency
+        self.in_flight = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.completed = 0
+        self._executor: Optional[Executor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == 'process':
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix=self.name
+                )
+        return self._executor
+
+    async def run(self, func: Callable, *args,
+                  timeout: Optional[float] = None) -> Any:
+        '''
+        `timeout` counts from taking a slot. The slot is held until `func`
+        is done, even if the caller stopped waiting: executors can't stop it
+        '''
+
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.concurrency)
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self.executor, func, *args)
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        return await asyncio.wait_for(asyncio.shield(future), timeout)
+
+    def _release(self, future: Optional[asyncio.Future] = None) -> None:
+        if future is not None and not future.cancelled():
+            # Retrieved, nobody may be waiting for it anymore
+            future.exception()
+        self.in_flight -= 1
+        self.completed += 1
+        self._slots.release()
+
+    def stats(self) -> dict:
+        return {
+            'executor': self.kind,
+            'workers': self.workers,
+            'concurrency': self.concurrency,
+            'in_flight': self.in_flight,
+            'waiting': self.waiting,
+            'max_waiting': self.max_waiting,
+            'completed': self.completed,
+        }
+
+
+password_pool = WorkerPool(name='password',
+                           kind=get_settings().password_hash_executor,
+                           workers=get_settings().password_hash_workers,
+                           concurrency=get_settings().password_hash_concurrency)
+
+
+async def hash_password(password: str) -> str:
+    with span('hash_password'):
+        return await password_pool.run(get_password_hash, password)
+
+
+async def hash_passwords(passwords: List[str], pool: WorkerPool,
+                         concurrency: int) -> List[str]:
+    ''' Hashes in input order, at most `concurrency` of them in the pool '''
+
+    limiter = asyncio.Semaphore(concurrency)
+
+    async def _hash(password: str) -> str:
+        async with limiter:
+            return await pool.run(get_password_hash, password)
+
+    with span('hash_passwords'):
+        return await asyncio.gather(*map(_hash, passwords))
+
+
+async def check_password(plain_password: str, hashed_password: str) -> bool:
+    with span('check_password'):
+        return await password_pool.run(verify_password, plain_password,
+                                       hashed_password)
+
+
 def create_access_token(data: dict, expires_delta: Union[timedelta, None] = None):
     to_encode = data.copy()
-    if expires_delta:
-        expire = datetime.utcnow() + expires_delta
-    else:
-        expire = datetime.utcnow() + timedelta(minutes=15)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, get_settings().secret_key, algorithm=get_settings().algorithm)
-    return encoded_jwt
+    if expires_delta is None:
+        expires_delta = timedelta(minutes=15)
+    to_encode.update({"exp": int(time.time() + expires_delta.total_seconds())})
+    to_encode.setdefault("jti", uuid.uuid4().hex)
+    return get_token_engine().encode(to_encode)
 
 
-def decode_token(token: str) -> str:
+def decode_payload(token: str, token_type: str = 'access') -> dict:
     try:
-        payload = jwt.decode(token, get_settings().secret_key,
-                                algorithms=[get_settings().algorithm])
+        payload = get_token_engine().decode(token)
         user_id: str = payload.get('user_id')
-        token_type: str = payload.get('token_type')
         if user_id is None:
             raise FoundError(USER_NOT_EXISTS)
-        if token_type != 'access':
+        if payload.get('token_type') != token_type:
             raise GQLError(WRONG_TOKEN)
+        if payload.get('jti') in revoked_tokens:
+            raise GQLError(REVOKED_TOKEN)
     except ExpiredSignatureError:
         raise AuthenticationError()
-    except JWTError:
+    except InvalidTokenError:
         raise GQLError(INVALID_TOKEN)
-    return user_id
+    return payload
+
+
+def decode_token(token: str, token_type: str = 'access') -> str:
+    return decode_payload(token, token_type)['user_id']